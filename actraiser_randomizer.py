@@ -5,11 +5,21 @@
 # 2019-10-19
 
 import argparse
+import bisect
+import builtins
+import collections
+import functools
 import hashlib
 import itertools
+import json
+import mmap
+import os
 import random
 import struct
+import sys
 import textwrap
+import time
+import zlib
 
 
 
@@ -27,7 +37,9 @@ randomizerVersion = "2025-03-14"
 # of an Act, with later rooms expecting it to already be there.
 # This works with a fixed room order, but breaks when randomized.
 # Solution: Make each map load all of its required assets.
-extendedMapMetadata = bytes.fromhex(" ".join([
+# This is the annotated source form of the metadata. The decoded bytes are
+# extendedMapMetadata, below.
+extendedMapMetadataSource = [
     # Map [53 59]
     "53 59",
     "00",
@@ -1135,11 +1147,157 @@ extendedMapMetadata = bytes.fromhex(" ".join([
     "02 01 00       5C B0 0B",
     "02 01 01       88 29 0E",
     "00",
-]))
-
-
+]
 
-# Constants for the randomizer's gameplay options.
+# The decoded metadata is also shipped as a binary file beside this module.
+# If it's present and its SHA-256 matches, it's used instead of decoding the
+# source form. If you change the source form, update the SHA-256 and then
+# regenerate the binary file with writeExtendedMapMetadataBlob.
+# (The source form is always checked against the SHA-256 when it's decoded,
+# so a stale SHA-256 won't go unnoticed.)
+extendedMapMetadataFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extended_map_metadata.bin")
+extendedMapMetadataSHA256 = "53021139C2D60214B0165144BF4D1A554F0506A93C6F501117BC1B2E76BD1977"
+
+def decodeExtendedMapMetadataSource():
+    extendedMapMetadata = bytes.fromhex(" ".join(extendedMapMetadataSource))
+    sourceSHA256 = hashlib.sha256(extendedMapMetadata).hexdigest().upper()
+    if sourceSHA256 != extendedMapMetadataSHA256:
+        raise ValueError(f"Extended map metadata SHA-256 mismatch: {sourceSHA256!r} # Expected: {extendedMapMetadataSHA256!r}")
+    return extendedMapMetadata
+
+def loadExtendedMapMetadata():
+    try:
+        with open(extendedMapMetadataFileName, "rb") as blobFile:
+            extendedMapMetadata = blobFile.read()
+    except OSError:
+        extendedMapMetadata = None
+    if extendedMapMetadata is not None:
+        if hashlib.sha256(extendedMapMetadata).hexdigest().upper() == extendedMapMetadataSHA256:
+            return extendedMapMetadata
+    return decodeExtendedMapMetadataSource()
+
+def writeExtendedMapMetadataBlob():
+    with open(extendedMapMetadataFileName, "wb") as blobFile:
+        blobFile.write(decodeExtendedMapMetadataSource())
+
+extendedMapMetadata = loadExtendedMapMetadata()
+
+
+
+# Structured map metadata
+# The extended map metadata is a sequence of maps. Each map is a 16-bit map
+# number (high byte first), then a list of records, then a 0x00 byte.
+# Each record is a type byte, followed by a fixed number of bytes that
+# depends on the type. Every record type except 0x08 ends with a 24-bit
+# little-endian pointer to the asset it loads.
+# (The first "map", [53 59], has no records and isn't a real map.)
+MAP_METADATA_RECORD_SIZES = {
+    0x01: 7,
+    0x02: 6,
+    0x08: 2,
+    0x10: 5,
+    0x20: 8,
+    0x40: 7,
+    0x80: 7,
+}
+
+class MapMetadataRecord:
+    __slots__ = ["recordType", "data"]
+
+    def __init__(self, recordType, data):
+        if MAP_METADATA_RECORD_SIZES.get(recordType) != 1 + len(data):
+            raise ValueError(f"Unexpected map metadata record: {recordType:02X} {bytes(data).hex(' ').upper()}")
+        self.recordType = recordType
+        self.data = bytes(data)
+
+    @property
+    def pointer(self):
+        if self.recordType == 0x08:
+            return None
+        return int.from_bytes(self.data[-3:], "little")
+
+    def __bytes__(self):
+        return bytes([self.recordType]) + self.data
+
+    def __eq__(self, other):
+        if not isinstance(other, MapMetadataRecord):
+            return NotImplemented
+        return self.recordType == other.recordType and self.data == other.data
+
+    def __hash__(self):
+        return hash((self.recordType, self.data))
+
+    def __repr__(self):
+        return f"MapMetadataRecord(0x{self.recordType:02X}, {self.data.hex(' ').upper()!r})"
+
+class MapMetadata:
+    # maps: A dict of map number --> list of MapMetadataRecord.
+    # The order of the dict is the order the maps are serialized in.
+    def __init__(self, maps):
+        self.maps = {mapNumber: tuple(records) for mapNumber, records in maps.items()}
+
+    @classmethod
+    def fromBytes(cls, metadataBytes):
+        maps = {}
+        position = 0
+        while position < len(metadataBytes):
+            if position + 3 > len(metadataBytes):
+                raise ValueError(f"Truncated map metadata at offset 0x{position:X}")
+            mapNumber = int.from_bytes(metadataBytes[position:position+2], "big")
+            if mapNumber in maps:
+                raise ValueError(f"Duplicate map metadata for map {mapNumber:X}")
+            position += 2
+            records = []
+            while metadataBytes[position] != 0x00:
+                recordType = metadataBytes[position]
+                recordSize = MAP_METADATA_RECORD_SIZES.get(recordType)
+                if recordSize is None:
+                    raise ValueError(f"Unexpected map metadata record type {recordType:02X} at offset 0x{position:X}")
+                records.append(MapMetadataRecord(recordType, metadataBytes[position+1:position+recordSize]))
+                position += recordSize
+            position += 1
+            maps[mapNumber] = records
+        return cls(maps)
+
+    def __bytes__(self):
+        metadataBytes = bytearray()
+        for mapNumber, records in self.maps.items():
+            metadataBytes += mapNumber.to_bytes(2, "big")
+            for record in records:
+                metadataBytes += bytes(record)
+            metadataBytes.append(0x00)
+        return bytes(metadataBytes)
+
+    def __getitem__(self, mapNumber):
+        return self.maps[mapNumber]
+
+    def __contains__(self, mapNumber):
+        return mapNumber in self.maps
+
+    def __iter__(self):
+        return iter(self.maps)
+
+    def __len__(self):
+        return len(self.maps)
+
+    # Get a map's records of a particular type, e.g. all of its 0x20 records.
+    def getRecords(self, mapNumber, recordType):
+        return [record for record in self.maps[mapNumber] if record.recordType == recordType]
+
+    # Compare two maps' records.
+    # Returns (records only in the first map, records only in the second map).
+    def diff(self, mapNumber, otherMapNumber):
+        records = collections.Counter(self.maps[mapNumber])
+        otherRecords = collections.Counter(self.maps[otherMapNumber])
+        return list((records - otherRecords).elements()), list((otherRecords - records).elements())
+
+@functools.cache
+def getMapMetadata():
+    return MapMetadata.fromBytes(extendedMapMetadata)
+
+
+
+# Constants for the randomizer's gameplay and output options.
 INITIAL_LIVES___EXTRA = "extra"
 INITIAL_LIVES___UNLIMITED = "unlimited"
 INITIAL_LIVES___DEATHCOUNT = "deathcount"
@@ -1155,6 +1313,14 @@ BOSS_RUSH_TYPE_CHOICES = [
     BOSS_RUSH_TYPE___CONSECUTIVE,
     BOSS_RUSH_TYPE___SCATTERED,
 ]
+OUTPUT_FORMAT___SFC = "sfc"
+OUTPUT_FORMAT___IPS = "ips"
+OUTPUT_FORMAT___BPS = "bps"
+OUTPUT_FORMAT_CHOICES = [
+    OUTPUT_FORMAT___SFC,
+    OUTPUT_FORMAT___IPS,
+    OUTPUT_FORMAT___BPS,
+]
 
 
 
@@ -1185,6 +1351,65 @@ def getFlagString(initialLives, zantetsuken, marahnaPath, bossRushType):
 
 
 
+# The reverse of getFlagString: returns (initialLives, zantetsuken,
+# marahnaPath, bossRushType) for a flag string. Raises a ValueError if the
+# flag string isn't one that getFlagString could have returned.
+def parseFlagString(flagString):
+    initialLives = None
+    for flag, value in [
+        ("E", INITIAL_LIVES___EXTRA),
+        ("U", INITIAL_LIVES___UNLIMITED),
+        ("D", INITIAL_LIVES___DEATHCOUNT),
+    ]:
+        if flag in flagString:
+            initialLives = value
+    zantetsuken = "Z" in flagString
+    marahnaPath = None
+    if "L" in flagString:
+        marahnaPath = MARAHNA_PATH___LEFT
+    elif "R" in flagString:
+        marahnaPath = MARAHNA_PATH___RIGHT
+    bossRushType = None
+    if "C" in flagString:
+        bossRushType = BOSS_RUSH_TYPE___CONSECUTIVE
+    elif "S" in flagString:
+        bossRushType = BOSS_RUSH_TYPE___SCATTERED
+
+    if getFlagString(initialLives, zantetsuken, marahnaPath, bossRushType) != flagString:
+        raise ValueError(f"Unexpected flag string: {flagString!r}")
+    return initialLives, zantetsuken, marahnaPath, bossRushType
+
+
+
+# The maps to be shuffled, in their original order.
+# The boss rush is represented by eight placeholders, which are replaced
+# after the shuffle: see randomize().
+BOSS_RUSH_PLACEHOLDER = 0x700
+
+def getUnshuffledMapNumbers(marahnaPath):
+    return [
+        0x101,
+        0x102, 0x103, 0x104,
+        0x201,
+        0x202, 0x203, 0x204, 0x205, 0x206, 0x207, 0x208,
+        0x301, 0x302,
+        0x303, 0x304, 0x305, 0x306,
+        0x401, 0x402, 0x403,
+        0x404, 0x405, 0x406, 0x407,
+        0x501, 0x502, 0x503,
+        0x504, 0x505, (0x506 if marahnaPath == MARAHNA_PATH___LEFT else 0x507), 0x508,
+        0x601, 0x602, 0x603, 0x604,
+        0x605, 0x606, 0x607, 0x608,
+        *([BOSS_RUSH_PLACEHOLDER] * 8),
+    ]
+
+# The boss rooms to be shuffled, in their original order.
+# Death Heim Clear (0x701) always comes last, so it isn't shuffled.
+def getUnshuffledBossRush():
+    return [0x702, 0x703, 0x704, 0x705, 0x706, 0x707, 0x708]
+
+
+
 def randomize(seed, marahnaPath, bossRushType):
     # Create and seed the random number generator.
     rng = random.Random(seed)
@@ -1205,26 +1430,11 @@ def randomize(seed, marahnaPath, bossRushType):
         raise ValueError(f"Unexpected bossRushType value: {bossRushType!r}")
 
     # Shuffle the maps.
-    BOSS_RUSH_PLACEHOLDER = 0x700
-    mapNumbers = [
-        0x101,
-        0x102, 0x103, 0x104,
-        0x201,
-        0x202, 0x203, 0x204, 0x205, 0x206, 0x207, 0x208,
-        0x301, 0x302,
-        0x303, 0x304, 0x305, 0x306,
-        0x401, 0x402, 0x403,
-        0x404, 0x405, 0x406, 0x407,
-        0x501, 0x502, 0x503,
-        0x504, 0x505, (0x506 if marahnaPath == MARAHNA_PATH___LEFT else 0x507), 0x508,
-        0x601, 0x602, 0x603, 0x604,
-        0x605, 0x606, 0x607, 0x608,
-        *([BOSS_RUSH_PLACEHOLDER] * 8),
-    ]
+    mapNumbers = getUnshuffledMapNumbers(marahnaPath)
     rng.shuffle(mapNumbers)
 
     # Shuffle the boss rooms, and end the boss rush with Death Heim Clear.
-    bossRush = [0x702, 0x703, 0x704, 0x705, 0x706, 0x707, 0x708]
+    bossRush = getUnshuffledBossRush()
     rng.shuffle(bossRush)
     bossRush.append(0x701)
 
@@ -1245,6 +1455,20 @@ def randomize(seed, marahnaPath, bossRushType):
 
 
 
+# Work out the Marahna II path and boss rush type from a shuffled list of
+# map numbers. (A scattered boss rush can happen to land in consecutive
+# rooms, so the boss rush type is a best guess.)
+def getShuffleOptions(mapNumbers):
+    marahnaPath = MARAHNA_PATH___LEFT if 0x506 in mapNumbers else MARAHNA_PATH___RIGHT
+    bossRushIndexes = [i for i, x in enumerate(mapNumbers) if x & 0xF00 == 0x700]
+    if bossRushIndexes and bossRushIndexes[-1] - bossRushIndexes[0] == len(bossRushIndexes) - 1:
+        bossRushType = BOSS_RUSH_TYPE___CONSECUTIVE
+    else:
+        bossRushType = BOSS_RUSH_TYPE___SCATTERED
+    return marahnaPath, bossRushType
+
+
+
 def getHashString(mapNumbers):
     hashInput = ",".join([randomizerVersion, *[format(x, "X") for x in mapNumbers]])
     hashString = hashlib.md5(hashInput.encode()).hexdigest().upper()[:8]
@@ -1252,6 +1476,40 @@ def getHashString(mapNumbers):
 
 
 
+# Helper function for checking that we've been given the right ROM.
+def validateROM(romBytes, romDescription="ROM"):
+    if len(romBytes) != 1048576:
+        raise ValueError(f"{romDescription} is not 1048576 bytes in size")
+    romName = bytes(romBytes[0x7FC0:0x7FD5])
+    goodName = b"ACTRAISER-USA        "
+    if romName != goodName:
+        raise ValueError(f"Unexpected internal ROM name: {romName!r} # Expected: {goodName!r}")
+
+
+
+# Open a ROM file for reading. Instead of reading the whole file, map it into
+# memory, read-only: only the parts that are used are read from the disk,
+# and the memory is shared with the operating system's file cache.
+def openROM(fileName):
+    with open(fileName, "rb") as inFile:
+        # mmap can't map an empty file.
+        if os.fstat(inFile.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+
+# Write a ROM or patch to a new file. A RomOverlay is written straight from
+# its pieces, without building the whole image first.
+def writeOutputFile(outFileName, outputBytes):
+    with open(outFileName, "xb") as outFile:
+        if isinstance(outputBytes, RomOverlay):
+            outputBytes.writeTo(outFile)
+        else:
+            outFile.write(outputBytes)
+
+
+
 # Helper function for writing blocks of bytes.
 def writeHelper(buffer, offset, data):
     nextOffset = offset + len(data)
@@ -1260,56 +1518,50 @@ def writeHelper(buffer, offset, data):
 
 
 
-def modifyROM(romBytes, titleString, mapNumbers, initialLives, zantetsuken):
-    # Limit the number of rooms.
-    # (The room counter uses BCD and cannot store values higher than 99.)
-    mapNumbersLimit = 99
-    if len(mapNumbers) > mapNumbersLimit:
-        raise ValueError(f"Too many map numbers: {len(mapNumbers)!r} # Limit: {mapNumbersLimit!r}")
-
-    # Create a mutable copy of romBytes.
-    romByteArray = bytearray(romBytes)
-
-    # Write the extended map metadata to 0xF8000.
-    writeHelper(romByteArray, 0xF8000, extendedMapMetadata)
-
+# ROM patches
+# Every fixed-content change the randomizer makes to the ROM is listed here.
+# Each patch has an ID, the flag that enables it, the offset to write to,
+# and the bytes to write (either a list of hex strings, so the assembly can
+# be annotated line by line, or a bytes object).
+# Patches with no flag are applied to every seed, by BasePatch.
+# Patches with a flag (a letter from getFlagString) are applied by modifyROM
+# when that flag is part of the seed's flag string.
+RomPatch = collections.namedtuple("RomPatch", ["patchID", "flag", "offset", "data"])
+romPatches = [
     # Look for map metadata at 0xF8000 instead of 0x28000.
-    writeHelper(romByteArray, 0x13E28, bytes.fromhex(" ".join([
+    RomPatch("mapMetadataBank", None, 0x13E28, [
         "A9 1F",       # 02/BE28: LDA #$1F ; Map metadata bank (was #$05)
-    ])))
+    ]),
 
     # Always show exactly one menu option on the title screen.
     # (ActRaiser does this to show "> START" when there's no save data.)
-    writeHelper(romByteArray, 0x1270D, bytes.fromhex(" ".join([
+    RomPatch("titleMenuOneOption", None, 0x1270D, [
         "EA",          # 02/A70D: NOP
         "EA",          # 02/A70E: NOP
-    ])))
+    ]),
 
     # Change the one menu option to show the selected seed and flags.
     # We need more space to store the seed-and-flags string, so let's
     # repurpose the space used by the menu-cursor strings at 0x12A34.
-    writeHelper(romByteArray, 0x12711, bytes.fromhex(" ".join([
+    # (The seed-and-flags string itself is written by modifyROM.)
+    RomPatch("titleMenuText", None, 0x12711, [
         "A9 00 11",    # 02/A711: LDA #$1100 ; Text location (was #$120C)
         "A0 34 AA",    # 02/A714: LDY #$AA34 ; Text pointer  (was #$A9D6)
-    ])))
-    menuOptionBytes = f"{'> ' + titleString[:25]:^32.32s}\x00".encode("ascii")
-    writeHelper(romByteArray, 0x12A34, menuOptionBytes)
+    ]),
 
     # Display the seed hash and randomizer version on the title screen.
     # (Prepend the new line to the existing copyright/license text.)
-    writeHelper(romByteArray, 0x1271B, bytes.fromhex(" ".join([
+    # (The new line itself is written by modifyROM.)
+    RomPatch("titleHashVersionText", None, 0x1271B, [
         "A9 00 15",    # 02/A71B: LDA #$1500 ; Text location (was #$1700)
         "A0 BF A9",    # 02/A71E: LDY #$A9BF ; Text pointer  (was #$A9DE)
-    ])))
-    hashString = getHashString(mapNumbers)
-    hvLineBytes = f"  {hashString:<8.8s}  {'v.' + randomizerVersion[:15]:>17.17s}\x0D\x0D".encode("ascii")
-    writeHelper(romByteArray, 0x129BF, hvLineBytes)
+    ]),
 
     # Always enter Professional Mode from the title screen menu.
-    writeHelper(romByteArray, 0x40, bytes.fromhex(" ".join([
+    RomPatch("professionalMode", None, 0x40, [
         "EA",          # 00/8040: NOP
         "EA",          # 00/8041: NOP
-    ])))
+    ]),
 
     # Add the room counter to the HUD.
     # You can't get or use magic in Professional Mode, so this feature
@@ -1317,7 +1569,7 @@ def modifyROM(romBytes, titleString, mapNumbers, initialLives, zantetsuken):
 
     # Replace the code that draws a scroll for each MP you have (always zero
     # in Professional Mode) with code to display the room counter.
-    writeHelper(romByteArray, 0x142C8, bytes.fromhex(" ".join([
+    RomPatch("hudRoomCounterCode", None, 0x142C8, [
         "E2 20",       # 02/C2C8: SEP #$20
         "A5 21",       # 02/C2CA: LDA $21
         "4A",          # 02/C2CC: LSR
@@ -1338,124 +1590,35 @@ def modifyROM(romBytes, titleString, mapNumbers, initialLives, zantetsuken):
         "EA",          # 02/C2E5: NOP
         "EA",          # 02/C2E6: NOP
         "EA",          # 02/C2E7: NOP
-    ])))
+    ]),
 
     # Update the HUD's fixed content to replace "[ACT]" with the person icon
     # and two reserved spaces for the room counter's digits.
-    struct.pack_into("<6H", romByteArray, 0x10E7E, *[
+    RomPatch("hudRoomCounterIcon", None, 0x10E7E, struct.pack("<6H", *[
         0x0000,
         0x003A, # Person icon, left half
         0x003B, # Person icon, right half
         0x0030, # Room counter, tens digit placeholder
         0x0030, # Room counter, ones digit placeholder
         0x0000,
-    ])
-
-    # Handle the "extra lives", "unlimited lives", and "death count" cases.
-    if initialLives is None:
-        pass
-    elif initialLives == INITIAL_LIVES___EXTRA:
-        # The value in memory is BCD and one less than the displayed value.
-        # e.g. 0x09 --> 9 decimal --> 10 lives shown on the HUD
-        writeHelper(romByteArray, 0x12B13, bytes.fromhex(" ".join([
-            "A9 09",       # 02/AB13: LDA #$09 ; Initial number of lives (was #$04)
-        ])))
-    elif initialLives == INITIAL_LIVES___UNLIMITED:
-        # The value in memory is BCD and one less than the displayed value.
-        # e.g. 0x98 --> 98 decimal --> 99 lives shown on the HUD
-        writeHelper(romByteArray, 0x12B13, bytes.fromhex(" ".join([
-            "A9 98",       # 02/AB13: LDA #$98 ; Initial number of lives (was #$04)
-        ])))
-        # Upon death, don't lose a life.
-        writeHelper(romByteArray, 0x2AD, bytes.fromhex(" ".join([
-            "EA",          # 00/82AD: NOP
-            "EA",          # 00/82AE: NOP
-            "EA",          # 00/82AF: NOP
-            "EA",          # 00/82B0: NOP
-            "EA",          # 00/82B1: NOP
-            "EA",          # 00/82B2: NOP
-            "EA",          # 00/82B3: NOP
-            "EA",          # 00/82B4: NOP
-            "EA",          # 00/82B5: NOP
-        ])))
-        # If you collect a 1-Up, don't gain a life.
-        writeHelper(romByteArray, 0x7C7, bytes.fromhex(" ".join([
-            "EA",          # 00/87C7: NOP
-            "EA",          # 00/87C8: NOP
-            "EA",          # 00/87C9: NOP
-        ])))
-    elif initialLives == INITIAL_LIVES___DEATHCOUNT:
-        # On the HUD, replace the heart icon with a slash.
-        # (Visual indicator of deathcount mode.)
-        struct.pack_into("<H", romByteArray, 0x10E8A, *[
-            0x0C2F, # Red slash (was 0x0C7B, red heart)
-        ])
-        # On the HUD, display "deathcount" instead of "deathcount + 1".
-        writeHelper(romByteArray, 0x14285, bytes.fromhex(" ".join([
-            "EA",          # 02/C285: NOP ; Tens digit
-            "EA",          # 02/C286: NOP
-            "EA",          # 02/C287: NOP
-        ])))
-        writeHelper(romByteArray, 0x14297, bytes.fromhex(" ".join([
-            "EA",          # 02/C297: NOP ; Ones digit
-            "EA",          # 02/C298: NOP
-            "EA",          # 02/C299: NOP
-        ])))
-        # Start with zero deaths.
-        writeHelper(romByteArray, 0x12B13, bytes.fromhex(" ".join([
-            "A9 00",       # 02/AB13: LDA #$00 ; Initial number of lives in vanilla (was #$04)
-        ])))
-        # Don't "prepare for Game Over" if you die with zero deaths.
-        writeHelper(romByteArray, 0x13D1B, bytes.fromhex(" ".join([
-            "80 1C",       # 02/BD1B: BRA $BD39 ; Always branch (was BNE)
-        ])))
-        # Upon death, increment the death count.
-        # The function we're calling is the "gain a life" function used
-        # by 1-Ups in vanilla. It gracefully handles the "99 + 1" case.
-        writeHelper(romByteArray, 0x2AD, bytes.fromhex(" ".join([
-            "20 50 88",    # 00/82AD: JSR $8850
-            "EA",          # 00/82B0: NOP
-            "EA",          # 00/82B1: NOP
-            "EA",          # 00/82B2: NOP
-            "EA",          # 00/82B3: NOP
-            "EA",          # 00/82B4: NOP
-            "EA",          # 00/82B5: NOP
-        ])))
-        # If you collect a 1-Up, don't change the death count.
-        writeHelper(romByteArray, 0x7C7, bytes.fromhex(" ".join([
-            "EA",          # 00/87C7: NOP
-            "EA",          # 00/87C8: NOP
-            "EA",          # 00/87C9: NOP
-        ])))
-    else:
-        raise ValueError(f"Unexpected initialLives value: {initialLives!r}")
+    ])),
 
     # Update the HUD's fixed content to not show ten MP scrolls.
     # For some reason, the fixed content has the variable fields filled in
     # (mostly with zeroes, but for MP, with ten scroll icons). Without the
     # scroll-drawing code, there's nothing to erase them, so let's remove
     # them here.
-    struct.pack_into("<10H", romByteArray, 0x10EE8, *[0x0000] * 10)
-
-    # Write the list of map numbers to ROM.
-    # Prepend 0x801 to roll the credits after completing room 99.
-    # (The room counter overflows, so it reads room 00 after room 99.)
-    # Append 0x801 to roll the credits after completing the last room.
-    struct.pack_into(
-        f"<{1+len(mapNumbers)+1}H",
-        romByteArray,
-        0xF9800,
-        *[0x801, *mapNumbers, 0x801],
-    )
+    RomPatch("hudNoScrolls", None, 0x10EE8, struct.pack("<10H", *[0x0000] * 10)),
 
     # Update the map-changing function to use and update the room counter.
     # There's not enough space in the map-changing function for all of the
     # new code, so let's put in a subroutine call to some unused space...
-    writeHelper(romByteArray, 0x26C, bytes.fromhex(" ".join([
+    RomPatch("mapChangerCall", None, 0x26C, [
         "22 00 97 1F", # 00/826C: JSL $1F9700
-    ])))
+    ]),
     # ...and write the new code in that unused space.
-    writeHelper(romByteArray, 0xF9700, bytes.fromhex(" ".join([
+    # (The list of map numbers it reads from 0xF9800 is written by modifyROM.)
+    RomPatch("mapChangerCode", None, 0xF9700, [
         # Check if the room counter is zero (start of a new game).
         # If so, skip ahead to advancing the room counter.
         "A5 21",       # 1F/9700: LDA $21
@@ -1544,49 +1707,33 @@ def modifyROM(romBytes, titleString, mapNumbers, initialLives, zantetsuken):
         "85 19",       # 1F/978D: STA $19
         # Return.
         "6B",          # 1F/978F: RTL
-    ])))
+    ]),
 
     # Skip the "descending ball of light brings statue to life" animation.
     # On some maps, it causes the player to take unavoidable damage.
-    writeHelper(romByteArray, 0x12B0D, bytes.fromhex(" ".join([
+    RomPatch("skipStatueAnimation", None, 0x12B0D, [
         "9C FC 00",    # 02/AB0D: STZ $00FC
-    ])))
-
-    # Handle the "permanent sword upgrade" case.
-    if zantetsuken:
-        # Check-if-sword-upgraded helper function: Sword is always upgraded
-        writeHelper(romByteArray, 0x8CE, bytes.fromhex(" ".join([
-            "EA",          # 00/88CE: NOP
-            "EA",          # 00/88CF: NOP
-        ])))
-        # Sword attack power: Always 2
-        writeHelper(romByteArray, 0x1DD9, bytes.fromhex(" ".join([
-            "80 01",       # 00/9DD9: BRA $9DDC ; Always branch (was BNE)
-        ])))
-
-    # Prevent animated tiles from glitching.
-    for offset in range(0x1093E + 0x18, 0x10E7E, 0x1C):
-        romByteArray[offset] &= 0x7F
+    ]),
 
     # When entering the Death Heim hub room:
     # - Always show the "warp in" visual effect
-    writeHelper(romByteArray, 0x74FE, bytes.fromhex(" ".join([
+    RomPatch("hubWarpInVisual", None, 0x74FE, [
         "EA",          # 00/F4FE: NOP
         "EA",          # 00/F4FF: NOP
-    ])))
+    ]),
     # - Always play the "warp in" sound effect
-    writeHelper(romByteArray, 0x7677, bytes.fromhex(" ".join([
+    RomPatch("hubWarpInSound", None, 0x7677, [
         "EA",          # 00/F677: NOP
         "EA",          # 00/F678: NOP
-    ])))
+    ]),
     # - Always play the "gem shatter" sound effect
-    writeHelper(romByteArray, 0x7687, bytes.fromhex(" ".join([
+    RomPatch("hubGemShatterSound", None, 0x7687, [
         "EA",          # 00/F687: NOP
         "EA",          # 00/F688: NOP
-    ])))
+    ]),
 
     # Update the "boss eyes and gems" animation in the Death Heim hub room.
-    writeHelper(romByteArray, 0x7534, bytes.fromhex(" ".join([
+    RomPatch("hubBossEyesAndGems", None, 0x7534, [
         # Hide all of the boss eyes and gems, except for those of the
         # boss you're about to fight.
         "A0 00 00",    # 00/F534: LDY #$0000
@@ -1609,21 +1756,21 @@ def modifyROM(romBytes, titleString, mapNumbers, initialLives, zantetsuken):
         "C9 07 00",    # 00/F556: CMP #$0007
         "F0 4E",       # 00/F559: BEQ $F5A9
         "80 20",       # 00/F55B: BRA $F57D
-    ])))
+    ]),
 
     # Upon defeating a boss-rush boss:
     # - Don't change the "number of boss-rush bosses defeated" value
     # - Take away the sword upgrade, so you don't keep it after defeating Tanzra
     # Let's overwrite the code for the former with code for the latter.
-    writeHelper(romByteArray, 0x7EEE, bytes.fromhex(" ".join([
+    RomPatch("bossRushRemoveSword", None, 0x7EEE, [
         "E2 20",       # 00/FEEE: SEP #$20
         "64 E4",       # 00/FEF0: STZ $E4
         "C2 20",       # 00/FEF0: REP #$20
-    ])))
+    ]),
     # - Stop playing Tanzra's theme after leaving Tanzra's boss room
-    writeHelper(romByteArray, 0x7F00, bytes.fromhex(" ".join([
+    RomPatch("bossRushStopTanzraTheme", None, 0x7F00, [
         "80 05",       # 00/FF00: BRA $FF07 ; Always branch (was BNE)
-    ])))
+    ]),
 
     # Update detection of "roll credits" vs "Game Over".
     # Map 0x801 is used for both the end credits and the Game Over screen.
@@ -1640,15 +1787,14 @@ def modifyROM(romBytes, titleString, mapNumbers, initialLives, zantetsuken):
     # - 19 rooms = 0x19 highest room number = 0x1A credits threshold
     # If the room counter is below the threshold, show the Game Over screen.
     # Otherwise, roll the credits.
-    creditsThreshold = ((len(mapNumbers) // 10) << 4) + (len(mapNumbers) % 10) + 1
-    writeHelper(romByteArray, 0x12AA4, bytes.fromhex(" ".join([
+    # (The threshold depends on the number of rooms, so modifyROM writes it.)
+    RomPatch("creditsCheck", None, 0x12AA4, [
         "EA",          # 02/AAA4: NOP
         "A5 21",       # 02/AAA5: LDA $21
         "F0 04",       # 02/AAA7: BEQ $AAAD ; Roll credits if in room 00 (overflow after room 99)
-        f"C9 {creditsThreshold:02X}",
-                       # 02/AAA9: CMP #$--  ; Threshold is #$49 for a normal 48-room game
+        "C9 49",       # 02/AAA9: CMP #$--  ; Threshold is #$49 for a normal 48-room game
         "90 3C",       # 02/AAAB: BCC $AAE9 ; Game Over if below the credits threshold
-    ])))
+    ]),
 
     # After clearing an Act, keep the "current Act" counter at 1.
     # In vanilla, the "current Act" counter is used to select the next
@@ -1662,16 +1808,761 @@ def modifyROM(romBytes, titleString, mapNumbers, initialLives, zantetsuken):
     # Consequently: After clearing the 13th end-of-Act room in the
     # shuffle, we get an unexpected Game Over.
     # Solution: Prevent the "current Act" counter from counting up.
-    writeHelper(romByteArray, 0x788, bytes.fromhex(" ".join([
+    RomPatch("keepCurrentAct", None, 0x788, [
         "A9 01 00",    # 00/8788: LDA #$0001
         "8D 49 03",    # 00/878B: STA $0349
-    ])))
+    ]),
+
+    # Handle the "extra lives" case.
+    # The value in memory is BCD and one less than the displayed value.
+    # e.g. 0x09 --> 9 decimal --> 10 lives shown on the HUD
+    RomPatch("extraLivesInitial", "E", 0x12B13, [
+        "A9 09",       # 02/AB13: LDA #$09 ; Initial number of lives (was #$04)
+    ]),
+
+    # Handle the "unlimited lives" case.
+    # The value in memory is BCD and one less than the displayed value.
+    # e.g. 0x98 --> 98 decimal --> 99 lives shown on the HUD
+    RomPatch("unlimitedLivesInitial", "U", 0x12B13, [
+        "A9 98",       # 02/AB13: LDA #$98 ; Initial number of lives (was #$04)
+    ]),
+    # Upon death, don't lose a life.
+    RomPatch("unlimitedLivesOnDeath", "U", 0x2AD, [
+        "EA",          # 00/82AD: NOP
+        "EA",          # 00/82AE: NOP
+        "EA",          # 00/82AF: NOP
+        "EA",          # 00/82B0: NOP
+        "EA",          # 00/82B1: NOP
+        "EA",          # 00/82B2: NOP
+        "EA",          # 00/82B3: NOP
+        "EA",          # 00/82B4: NOP
+        "EA",          # 00/82B5: NOP
+    ]),
+    # If you collect a 1-Up, don't gain a life.
+    RomPatch("unlimitedLivesOn1Up", "U", 0x7C7, [
+        "EA",          # 00/87C7: NOP
+        "EA",          # 00/87C8: NOP
+        "EA",          # 00/87C9: NOP
+    ]),
+
+    # Handle the "death count" case.
+    # On the HUD, replace the heart icon with a slash.
+    # (Visual indicator of deathcount mode.)
+    RomPatch("deathCountIcon", "D", 0x10E8A, struct.pack("<H", *[
+        0x0C2F, # Red slash (was 0x0C7B, red heart)
+    ])),
+    # On the HUD, display "deathcount" instead of "deathcount + 1".
+    RomPatch("deathCountTensDigit", "D", 0x14285, [
+        "EA",          # 02/C285: NOP ; Tens digit
+        "EA",          # 02/C286: NOP
+        "EA",          # 02/C287: NOP
+    ]),
+    RomPatch("deathCountOnesDigit", "D", 0x14297, [
+        "EA",          # 02/C297: NOP ; Ones digit
+        "EA",          # 02/C298: NOP
+        "EA",          # 02/C299: NOP
+    ]),
+    # Start with zero deaths.
+    RomPatch("deathCountInitial", "D", 0x12B13, [
+        "A9 00",       # 02/AB13: LDA #$00 ; Initial number of lives in vanilla (was #$04)
+    ]),
+    # Don't "prepare for Game Over" if you die with zero deaths.
+    RomPatch("deathCountNoGameOver", "D", 0x13D1B, [
+        "80 1C",       # 02/BD1B: BRA $BD39 ; Always branch (was BNE)
+    ]),
+    # Upon death, increment the death count.
+    # The function we're calling is the "gain a life" function used
+    # by 1-Ups in vanilla. It gracefully handles the "99 + 1" case.
+    RomPatch("deathCountOnDeath", "D", 0x2AD, [
+        "20 50 88",    # 00/82AD: JSR $8850
+        "EA",          # 00/82B0: NOP
+        "EA",          # 00/82B1: NOP
+        "EA",          # 00/82B2: NOP
+        "EA",          # 00/82B3: NOP
+        "EA",          # 00/82B4: NOP
+        "EA",          # 00/82B5: NOP
+    ]),
+    # If you collect a 1-Up, don't change the death count.
+    RomPatch("deathCountOn1Up", "D", 0x7C7, [
+        "EA",          # 00/87C7: NOP
+        "EA",          # 00/87C8: NOP
+        "EA",          # 00/87C9: NOP
+    ]),
+
+    # Handle the "permanent sword upgrade" case.
+    # Check-if-sword-upgraded helper function: Sword is always upgraded
+    RomPatch("zantetsukenAlwaysUpgraded", "Z", 0x8CE, [
+        "EA",          # 00/88CE: NOP
+        "EA",          # 00/88CF: NOP
+    ]),
+    # Sword attack power: Always 2
+    RomPatch("zantetsukenAttackPower", "Z", 0x1DD9, [
+        "80 01",       # 00/9DD9: BRA $9DDC ; Always branch (was BNE)
+    ]),
+]
+
+
 
+# Compile the ROM patches into (offset, data) pairs, sorted by offset and
+# grouped by flag, so applying them doesn't involve parsing any hex strings.
+def compileRomPatches(romPatches):
+    compiledPatches = {}
+    for patch in romPatches:
+        if isinstance(patch.data, list):
+            data = bytes.fromhex(" ".join(patch.data))
+        else:
+            data = bytes(patch.data)
+        compiledPatches.setdefault(patch.flag, []).append((patch.offset, memoryview(data), patch.patchID))
+
+    # Patches that can be applied together must not overlap.
+    # (The unflagged patches can be applied with any flag.)
+    for flag, patches in compiledPatches.items():
+        combinedPatches = patches if flag is None else [*compiledPatches.get(None, []), *patches]
+        combinedPatches = sorted(combinedPatches, key=lambda x: x[0])
+        for (offset, data, patchID), (nextOffset, _, nextPatchID) in itertools.pairwise(combinedPatches):
+            if offset + len(data) > nextOffset:
+                raise ValueError(f"Overlapping ROM patches: {patchID!r} and {nextPatchID!r}")
+
+    return {
+        flag: tuple(sorted([(offset, data) for offset, data, _ in patches], key=lambda x: x[0]))
+        for flag, patches in compiledPatches.items()
+    }
+compiledRomPatches = compileRomPatches(romPatches)
+
+
+
+# Get the compiled ROM patches for a flag string, as a single sorted tuple.
+# Pass None to get the unflagged (seed-independent) patches.
+@functools.cache
+def getRomPatches(flagString):
+    if flagString is None:
+        return compiledRomPatches.get(None, ())
+    return tuple(sorted(
+        [patch for flag in flagString for patch in compiledRomPatches.get(flag, ())],
+        key=lambda x: x[0],
+    ))
+
+
+
+# Merge a list of (offset, data) patches into sorted, non-overlapping runs.
+# Overlapping and adjacent patches are combined into a single run.
+# Where patches overlap, later patches in the list take precedence.
+def mergePatches(patches):
+    # Find the ranges covered by the patches.
+    runs = []
+    for start, end in sorted([(offset, offset + len(data)) for offset, data in patches]):
+        if runs and start <= runs[-1][1]:
+            runs[-1][1] = max(runs[-1][1], end)
+        else:
+            runs.append([start, end])
+
+    # Apply the patches to a buffer for each range, in order.
+    runStarts = [start for start, _ in runs]
+    runBuffers = [bytearray(end - start) for start, end in runs]
+    for offset, data in patches:
+        runIndex = bisect.bisect_right(runStarts, offset) - 1
+        writeHelper(runBuffers[runIndex], offset - runStarts[runIndex], data)
+
+    return [(start, bytes(buffer)) for start, buffer in zip(runStarts, runBuffers)]
+
+
+
+# A patched ROM image that doesn't copy the unpatched parts of the ROM.
+# It's made of the unmodified ROM (e.g. a read-only mmap of the input file)
+# and a list of patches, which must be sorted and non-overlapping, as from
+# mergePatches. It only takes as much memory as the patches, and can be
+# written out with scatter writes, straight from the patches and the ROM.
+class RomOverlay:
+    def __init__(self, sourceBytes, patchList):
+        self.sourceBytes = sourceBytes
+        self.patchList = patchList
+        self.patchOffsets = [offset for offset, _ in patchList]
+
+    def __len__(self):
+        return len(self.sourceBytes)
+
+    # Read a single byte.
+    def __getitem__(self, offset):
+        patchIndex = bisect.bisect_right(self.patchOffsets, offset) - 1
+        if patchIndex >= 0:
+            patchOffset, data = self.patchList[patchIndex]
+            if offset < patchOffset + len(data):
+                return data[offset - patchOffset]
+        return self.sourceBytes[offset]
+
+    # The image as a list of pieces: unpatched ranges of the ROM, and patches.
+    def getSegments(self):
+        sourceView = memoryview(self.sourceBytes)
+        segments = []
+        position = 0
+        for offset, data in self.patchList:
+            if offset > position:
+                segments.append(sourceView[position:offset])
+            segments.append(memoryview(data))
+            position = offset + len(data)
+        if position < len(sourceView):
+            segments.append(sourceView[position:])
+        return segments
+
+    def __bytes__(self):
+        return b"".join(self.getSegments())
+
+    def writeTo(self, outFile):
+        segments = self.getSegments()
+        if not hasattr(os, "writev"):
+            for segment in segments:
+                outFile.write(segment)
+            return
+        outFile.flush()
+        fileDescriptor = outFile.fileno()
+        # os.writev can write less than it was given, and can only take a
+        # limited number of segments at a time, so keep going until it's done.
+        segmentIndex = 0
+        while segmentIndex < len(segments):
+            writtenSize = os.writev(fileDescriptor, segments[segmentIndex:segmentIndex+1024])
+            while segmentIndex < len(segments) and writtenSize >= len(segments[segmentIndex]):
+                writtenSize -= len(segments[segmentIndex])
+                segmentIndex += 1
+            if writtenSize:
+                segments[segmentIndex] = segments[segmentIndex][writtenSize:]
+
+
+
+# The animated-tile fixes in BasePatch clear bit 7 of these bytes.
+ANIMATED_TILE_FIX_OFFSETS = range(0x1093E + 0x18, 0x10E7E, 0x1C)
+
+# The seed-independent part of the ROM modifications.
+# Most of what the randomizer changes is the same for every seed, so let's
+# work those changes out once per input ROM.
+# The changes are kept as a list of (offset, data) patches, so that
+# makePatch can produce an IPS or BPS patch without comparing ROM images,
+# and overlayROM can produce a ROM without copying the unchanged parts.
+# The patched image is also kept (once it's needed), so that modifyROM
+# only has to write the parts that vary from seed to seed.
+class BasePatch:
+    def __init__(self, romBytes):
+        # Make sure we're modifying an 'ActRaiser (USA)' ROM.
+        validateROM(romBytes)
+
+        # Keep the unmodified ROM. BPS patches need it for the gaps
+        # between patched ranges, and for the source checksum.
+        self.sourceBytes = romBytes
+
+        # Write the extended map metadata to 0xF8000,
+        # and apply the unflagged ROM patches.
+        patchList = [(0xF8000, extendedMapMetadata), *getRomPatches(None)]
+
+        # Prevent animated tiles from glitching.
+        patchedBytes = RomOverlay(romBytes, mergePatches(patchList))
+        for offset in ANIMATED_TILE_FIX_OFFSETS:
+            patchList.append((offset, bytes([patchedBytes[offset] & 0x7F])))
+
+        self.patchList = mergePatches(patchList)
+
+    # The patched image. modifyROM starts each seed from a copy of it.
+    # It's only made when it's needed: RomOverlay output doesn't need it.
+    @functools.cached_property
+    def romBytes(self):
+        romByteArray = bytearray(self.sourceBytes)
+        for offset, data in self.patchList:
+            writeHelper(romByteArray, offset, data)
+        return bytes(romByteArray)
+
+    # SHA-256 of the unmodified ROM, for GenerateCache.
+    @functools.cached_property
+    def sourceSHA256(self):
+        return hashlib.sha256(self.sourceBytes).hexdigest()
+
+
+
+# Timing instrumentation
+# generate() and the functions it calls can report how long each of their
+# stages takes. To collect the timings, set timingHook to a function that
+# takes (stageName, startTime, endTime), with times in nanoseconds from
+# time.perf_counter_ns(). A stage that starts and ends within another stage
+# is part of that stage, e.g. "randomize" is part of "generate".
+# timingHook is None by default, and then nothing is timed: each stage only
+# costs a check of timingHook.
+timingHook = None
+
+# Report a finished stage to timingHook, and return its end time.
+# (That's usually the start time of the next stage.)
+def endStage(stageName, startTime):
+    endTime = time.perf_counter_ns()
+    timingHook(stageName, startTime, endTime)
+    return endTime
+
+
+
+# A timingHook that keeps a list of the reported stages.
+class TimingSpans:
+    def __init__(self):
+        self.spans = []
+
+    def __call__(self, stageName, startTime, endTime):
+        self.spans.append((stageName, startTime, endTime))
+
+    # Returns the stages in the order they started, as a list of dicts:
+    # - stage: The stage name.
+    # - depth: How many other stages this stage is part of.
+    # - start: Nanoseconds from the start of the first stage.
+    # - duration: Nanoseconds from the start to the end of this stage.
+    def getBreakdown(self):
+        breakdown = []
+        if not self.spans:
+            return breakdown
+        firstStartTime = min(startTime for stageName, startTime, endTime in self.spans)
+        openEndTimes = []
+        for stageName, startTime, endTime in sorted(self.spans, key=lambda x: (x[1], -x[2])):
+            while openEndTimes and openEndTimes[-1] <= startTime:
+                openEndTimes.pop()
+            breakdown.append({
+                "stage": stageName,
+                "depth": len(openEndTimes),
+                "start": startTime - firstStartTime,
+                "duration": endTime - startTime,
+            })
+            openEndTimes.append(endTime)
+        return breakdown
+
+    # Returns the breakdown as lines of text, with durations in milliseconds.
+    def formatBreakdown(self):
+        breakdown = self.getBreakdown()
+        nameWidth = max([len("  " * x["depth"] + x["stage"]) for x in breakdown], default=0)
+        return [
+            f"{'  ' * x['depth'] + x['stage']:<{nameWidth}}  {x['duration'] / 1e6:10.3f} ms"
+            for x in breakdown
+        ]
+
+
+
+# Get the seed-dependent ROM modifications, as a list of (offset, data) patches.
+# These are applied on top of the BasePatch changes.
+def getSeedPatches(titleString, mapNumbers, initialLives, zantetsuken):
+    # Limit the number of rooms.
+    # (The room counter uses BCD and cannot store values higher than 99.)
+    mapNumbersLimit = 99
+    if len(mapNumbers) > mapNumbersLimit:
+        raise ValueError(f"Too many map numbers: {len(mapNumbers)!r} # Limit: {mapNumbersLimit!r}")
+    if initialLives not in [None, INITIAL_LIVES___EXTRA, INITIAL_LIVES___UNLIMITED, INITIAL_LIVES___DEATHCOUNT]:
+        raise ValueError(f"Unexpected initialLives value: {initialLives!r}")
+
+    seedPatches = []
+
+    # Write the seed-and-flags string to the repurposed menu-cursor space.
+    menuOptionBytes = f"{'> ' + titleString[:25]:^32.32s}\x00".encode("ascii")
+    seedPatches.append((0x12A34, menuOptionBytes))
+
+    # Write the seed hash and randomizer version line.
+    hashString = getHashString(mapNumbers)
+    hvLineBytes = f"  {hashString:<8.8s}  {'v.' + randomizerVersion[:15]:>17.17s}\x0D\x0D".encode("ascii")
+    seedPatches.append((0x129BF, hvLineBytes))
+
+    # Apply the ROM patches for the "extra lives", "unlimited lives",
+    # "death count", and "permanent sword upgrade" options.
+    seedPatches.extend(getRomPatches(getFlagString(initialLives, zantetsuken, None, None)))
+
+    # Write the list of map numbers to ROM.
+    # Prepend 0x801 to roll the credits after completing room 99.
+    # (The room counter overflows, so it reads room 00 after room 99.)
+    # Append 0x801 to roll the credits after completing the last room.
+    seedPatches.append((0xF9800, struct.pack(
+        f"<{1+len(mapNumbers)+1}H",
+        *[0x801, *mapNumbers, 0x801],
+    )))
+
+    # Write the credits threshold used by the "creditsCheck" patch.
+    creditsThreshold = ((len(mapNumbers) // 10) << 4) + (len(mapNumbers) % 10) + 1
+    seedPatches.append((0x12AAA, bytes([creditsThreshold])))
+
+    return seedPatches
+
+
+
+def modifyROM(romBytes, titleString, mapNumbers, initialLives, zantetsuken):
+    if timingHook:
+        startTime = time.perf_counter_ns()
+
+    seedPatches = getSeedPatches(titleString, mapNumbers, initialLives, zantetsuken)
+    if timingHook:
+        startTime = endStage("seedPatches", startTime)
+
+    # Apply the seed-independent changes, unless that's already been done.
+    basePatch = romBytes if isinstance(romBytes, BasePatch) else BasePatch(romBytes)
+    baseRomBytes = basePatch.romBytes
+    if timingHook:
+        startTime = endStage("basePatch", startTime)
+
+    # Create a mutable copy of the base-patched ROM, and apply the
+    # seed-dependent changes to it.
+    romByteArray = bytearray(baseRomBytes)
+    for offset, data in seedPatches:
+        romByteArray[offset:offset+len(data)] = data
+    if timingHook:
+        endStage("applyPatches", startTime)
+
+    return romByteArray
+
+
+
+# Like modifyROM, but produce a RomOverlay instead of a new copy of the ROM.
+def overlayROM(romBytes, titleString, mapNumbers, initialLives, zantetsuken):
+    if timingHook:
+        startTime = time.perf_counter_ns()
+    seedPatches = getSeedPatches(titleString, mapNumbers, initialLives, zantetsuken)
+    if timingHook:
+        startTime = endStage("seedPatches", startTime)
+    basePatch = romBytes if isinstance(romBytes, BasePatch) else BasePatch(romBytes)
+    if timingHook:
+        startTime = endStage("basePatch", startTime)
+    romOverlay = RomOverlay(basePatch.sourceBytes, mergePatches([*basePatch.patchList, *seedPatches]))
+    if timingHook:
+        endStage("mergePatches", startTime)
+    return romOverlay
+
+
+
+# IPS patches
+# Format: "PATCH", then records, then "EOF".
+# Each record is a 24-bit offset, a 16-bit size, and that many bytes of data.
+# (A size of zero means an RLE record: a 16-bit count, then one byte.)
+# All values are big-endian.
+def encodeIPS(patchList):
+    ipsBytes = bytearray(b"PATCH")
+    for offset, data in patchList:
+        # Records are limited to 0xFFFF bytes, so split longer runs.
+        for chunkOffset in range(0, len(data), 0xFFFF):
+            chunk = data[chunkOffset:chunkOffset+0xFFFF]
+            recordOffset = offset + chunkOffset
+            if recordOffset > 0xFFFFFF or recordOffset == 0x454F46:
+                raise ValueError(f"Offset cannot be stored in an IPS patch: 0x{recordOffset:X}")
+            ipsBytes += recordOffset.to_bytes(3, "big")
+            ipsBytes += len(chunk).to_bytes(2, "big")
+            ipsBytes += chunk
+    ipsBytes += b"EOF"
+    return bytes(ipsBytes)
+
+# Read the records from an IPS patch.
+# Returns a list of (offset, data) patches, and the size to truncate the
+# output to (or None).
+def decodeIPS(ipsBytes):
+    if ipsBytes[:5] != b"PATCH":
+        raise ValueError("Not an IPS patch")
+    patchList = []
+    position = 5
+    while ipsBytes[position:position+3] != b"EOF":
+        if position + 5 > len(ipsBytes):
+            raise ValueError("Truncated IPS patch")
+        offset = int.from_bytes(ipsBytes[position:position+3], "big")
+        size = int.from_bytes(ipsBytes[position+3:position+5], "big")
+        position += 5
+        if size:
+            data = ipsBytes[position:position+size]
+            position += size
+        else:
+            count = int.from_bytes(ipsBytes[position:position+2], "big")
+            data = ipsBytes[position+2:position+3] * count
+            position += 3
+        patchList.append((offset, data))
+    position += 3
+    # Optional: A 24-bit size to truncate the output to.
+    truncateSize = None
+    if len(ipsBytes) >= position + 3:
+        truncateSize = int.from_bytes(ipsBytes[position:position+3], "big")
+    return patchList, truncateSize
+
+def applyIPS(romBytes, ipsBytes):
+    patchList, truncateSize = decodeIPS(ipsBytes)
+    romByteArray = bytearray(romBytes)
+    for offset, data in patchList:
+        if offset > len(romByteArray):
+            romByteArray.extend(bytes(offset - len(romByteArray)))
+        writeHelper(romByteArray, offset, data)
+    if truncateSize is not None:
+        del romByteArray[truncateSize:]
     return romByteArray
 
 
 
-def generate(romBytes, isRaceSeed, seed, initialLives, zantetsuken, marahnaPath, bossRushType):
+# BPS patches
+# Format: "BPS1", then the source size, target size, and metadata size
+# (as variable-length integers), then actions, then the CRC32 checksums of
+# the source, target, and patch (as 32-bit little-endian values).
+# Each action is a variable-length integer: ((length - 1) << 2) | command.
+#   0 = SourceRead: Copy bytes from the source, at the output offset.
+#   1 = TargetRead: Copy bytes from the patch.
+#   2 = SourceCopy: Copy bytes from the source, at a relative offset.
+#   3 = TargetCopy: Copy bytes from the target, at a relative offset.
+def encodeBPSNumber(number):
+    numberBytes = bytearray()
+    while True:
+        x = number & 0x7F
+        number >>= 7
+        if number == 0:
+            numberBytes.append(0x80 | x)
+            return numberBytes
+        numberBytes.append(x)
+        number -= 1
+
+def decodeBPSNumber(bpsBytes, position):
+    number = 0
+    shift = 1
+    while True:
+        x = bpsBytes[position]
+        position += 1
+        number += (x & 0x7F) * shift
+        if x & 0x80:
+            return number, position
+        shift <<= 7
+        number += shift
+
+def encodeBPS(sourceBytes, patchList):
+    bpsBytes = bytearray(b"BPS1")
+    bpsBytes += encodeBPSNumber(len(sourceBytes))
+    bpsBytes += encodeBPSNumber(len(sourceBytes))
+    bpsBytes += encodeBPSNumber(0)
+
+    # Use SourceRead for the unpatched ranges, and TargetRead for the
+    # patched ranges. Calculate the target checksum as we go, so we don't
+    # need to build the target.
+    sourceView = memoryview(sourceBytes)
+    targetCRC32 = 0
+    outputOffset = 0
+    for offset, data in [*patchList, (len(sourceBytes), b"")]:
+        if offset > outputOffset:
+            bpsBytes += encodeBPSNumber(((offset - outputOffset - 1) << 2) | 0)
+            targetCRC32 = zlib.crc32(sourceView[outputOffset:offset], targetCRC32)
+        if data:
+            bpsBytes += encodeBPSNumber(((len(data) - 1) << 2) | 1)
+            bpsBytes += data
+            targetCRC32 = zlib.crc32(data, targetCRC32)
+        outputOffset = offset + len(data)
+
+    bpsBytes += struct.pack("<2I", zlib.crc32(sourceView), targetCRC32)
+    bpsBytes += struct.pack("<I", zlib.crc32(bpsBytes))
+    return bytes(bpsBytes)
+
+def applyBPS(romBytes, bpsBytes):
+    if bpsBytes[:4] != b"BPS1":
+        raise ValueError("Not a BPS patch")
+    sourceCRC32, targetCRC32, patchCRC32 = struct.unpack("<3I", bpsBytes[-12:])
+    if zlib.crc32(bpsBytes[:-4]) != patchCRC32:
+        raise ValueError("BPS patch checksum mismatch")
+    if zlib.crc32(romBytes) != sourceCRC32:
+        raise ValueError("BPS source checksum mismatch: The patch is for a different ROM")
+
+    position = 4
+    sourceSize, position = decodeBPSNumber(bpsBytes, position)
+    targetSize, position = decodeBPSNumber(bpsBytes, position)
+    metadataSize, position = decodeBPSNumber(bpsBytes, position)
+    position += metadataSize
+    if len(romBytes) != sourceSize:
+        raise ValueError(f"BPS source size mismatch: {len(romBytes)!r} # Expected: {sourceSize!r}")
+
+    romByteArray = bytearray(targetSize)
+    outputOffset = 0
+    sourceRelativeOffset = 0
+    targetRelativeOffset = 0
+    while position < len(bpsBytes) - 12:
+        action, position = decodeBPSNumber(bpsBytes, position)
+        command = action & 3
+        length = (action >> 2) + 1
+        if command == 0:
+            writeHelper(romByteArray, outputOffset, romBytes[outputOffset:outputOffset+length])
+        elif command == 1:
+            writeHelper(romByteArray, outputOffset, bpsBytes[position:position+length])
+            position += length
+        else:
+            relativeOffset, position = decodeBPSNumber(bpsBytes, position)
+            relativeOffset = (-1 if relativeOffset & 1 else 1) * (relativeOffset >> 1)
+            if command == 2:
+                sourceRelativeOffset += relativeOffset
+                writeHelper(romByteArray, outputOffset, romBytes[sourceRelativeOffset:sourceRelativeOffset+length])
+                sourceRelativeOffset += length
+            else:
+                # TargetCopy can overlap its own output, so copy byte by byte.
+                targetRelativeOffset += relativeOffset
+                for i in range(length):
+                    romByteArray[outputOffset+i] = romByteArray[targetRelativeOffset+i]
+                targetRelativeOffset += length
+        outputOffset += length
+
+    if zlib.crc32(romByteArray) != targetCRC32:
+        raise ValueError("BPS target checksum mismatch")
+    return romByteArray
+
+
+
+# Apply an IPS or BPS patch, depending on the patch's header.
+def applyPatch(romBytes, patchBytes):
+    if patchBytes[:5] == b"PATCH":
+        return applyIPS(romBytes, patchBytes)
+    if patchBytes[:4] == b"BPS1":
+        return applyBPS(romBytes, patchBytes)
+    raise ValueError("Unrecognized patch format: Expected IPS or BPS")
+
+
+
+# Like modifyROM, but produce an IPS or BPS patch instead of a ROM.
+# The patch is built directly from the BasePatch and seed patch lists.
+def makePatch(romBytes, titleString, mapNumbers, initialLives, zantetsuken, patchFormat):
+    if timingHook:
+        startTime = time.perf_counter_ns()
+
+    seedPatches = getSeedPatches(titleString, mapNumbers, initialLives, zantetsuken)
+    if timingHook:
+        startTime = endStage("seedPatches", startTime)
+
+    # Apply the seed-independent changes, unless that's already been done.
+    basePatch = romBytes if isinstance(romBytes, BasePatch) else BasePatch(romBytes)
+    if timingHook:
+        startTime = endStage("basePatch", startTime)
+
+    patchList = mergePatches([*basePatch.patchList, *seedPatches])
+    if patchFormat == OUTPUT_FORMAT___IPS:
+        patchBytes = encodeIPS(patchList)
+    elif patchFormat == OUTPUT_FORMAT___BPS:
+        patchBytes = encodeBPS(basePatch.sourceBytes, patchList)
+    else:
+        raise ValueError(f"Unexpected patchFormat value: {patchFormat!r}")
+    if timingHook:
+        endStage("encodePatch", startTime)
+
+    return patchBytes
+
+
+
+# Generated seed cache
+# Generating the same seed with the same flags and input ROM always gives the
+# same output, so it can be stored and reused. Each entry is stored as an IPS
+# patch for the input ROM (much smaller than a randomized ROM), in a file
+# named after a hash of the randomizer version, seed, flags and the input
+# ROM's SHA-256. The seed details (map order, etc.) aren't stored, since
+# randomize() is quick.
+# Entries are written to a temporary file and then renamed, so a reader
+# never sees a partial entry, even with several processes sharing the cache.
+# When the cache grows past its maximum size, the least recently used
+# entries (by modification time, which is updated on each use) are removed.
+# Scanning the whole cache for each new entry would be slow for big batches,
+# so its total size is kept track of here, and it's only scanned when that
+# goes past the maximum size, or every GENERATE_CACHE_SCAN_INTERVAL stores
+# (to notice what other processes and threads have stored; the total is
+# only an estimate between scans).
+GENERATE_CACHE_SCAN_INTERVAL = 256
+
+class GenerateCache:
+    def __init__(self, directory, maxSize=256 * 1024 * 1024):
+        self.directory = directory
+        self.maxSize = maxSize
+        os.makedirs(directory, exist_ok=True)
+        self.totalSize = None
+        self.storeCount = 0
+
+    def getFileName(self, romBytes, seed, flagString):
+        if isinstance(romBytes, BasePatch):
+            romSHA256 = romBytes.sourceSHA256
+        else:
+            romSHA256 = hashlib.sha256(romBytes).hexdigest()
+        keyString = "\n".join([randomizerVersion, str(seed), flagString, romSHA256])
+        key = hashlib.sha256(keyString.encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}.ips")
+
+    # Returns the IPS patch for the given seed, or None if it isn't cached.
+    def load(self, romBytes, seed, flagString):
+        fileName = self.getFileName(romBytes, seed, flagString)
+        try:
+            with open(fileName, "rb") as inFile:
+                ipsBytes = inFile.read()
+            os.utime(fileName)
+        except FileNotFoundError:
+            return None
+        return ipsBytes
+
+    def store(self, romBytes, seed, flagString, ipsBytes):
+        # Like concurrent.futures in generateMany, tempfile is only imported
+        # when it's needed.
+        import tempfile
+
+        fileName = self.getFileName(romBytes, seed, flagString)
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        # The temporary file's name is unique, even between threads.
+        with tempfile.NamedTemporaryFile(
+            dir = os.path.dirname(fileName),
+            prefix = f"{os.path.basename(fileName)}.",
+            suffix = ".tmp",
+            delete = False,
+        ) as outFile:
+            outFile.write(ipsBytes)
+        try:
+            oldSize = os.stat(fileName).st_size
+        except FileNotFoundError:
+            oldSize = 0
+        os.replace(outFile.name, fileName)
+
+        if self.totalSize is not None:
+            self.totalSize += len(ipsBytes) - oldSize
+        self.storeCount += 1
+        if (
+            self.totalSize is None
+            or self.totalSize > self.maxSize
+            or self.storeCount >= GENERATE_CACHE_SCAN_INTERVAL
+        ):
+            self.evict()
+
+    # If the cache is too big, remove the least recently used entries, until
+    # it's down to 90% of its maximum size (so that a full cache isn't
+    # scanned again for every store). This scans the whole cache, and updates
+    # the total size.
+    def evict(self):
+        entries = []
+        totalSize = 0
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                if entry.name.endswith(".ips"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    totalSize += stat.st_size
+        entries.sort()
+        targetSize = self.maxSize if totalSize <= self.maxSize else self.maxSize * 9 // 10
+        for mtime, size, path in entries:
+            if totalSize <= targetSize:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            totalSize -= size
+        self.totalSize = totalSize
+        self.storeCount = 0
+
+    # Turn a cached IPS patch into output in the given format.
+    def getOutput(self, romBytes, ipsBytes, outputFormat, overlay=False):
+        sourceBytes = romBytes.sourceBytes if isinstance(romBytes, BasePatch) else romBytes
+        if outputFormat in [None, OUTPUT_FORMAT___SFC] and overlay:
+            return RomOverlay(sourceBytes, mergePatches(decodeIPS(ipsBytes)[0]))
+        elif outputFormat in [None, OUTPUT_FORMAT___SFC]:
+            return applyIPS(sourceBytes, ipsBytes)
+        elif outputFormat == OUTPUT_FORMAT___IPS:
+            return ipsBytes
+        elif outputFormat == OUTPUT_FORMAT___BPS:
+            return encodeBPS(sourceBytes, mergePatches(decodeIPS(ipsBytes)[0]))
+        else:
+            raise ValueError(f"Unexpected outputFormat value: {outputFormat!r}")
+
+
+
+# If a GenerateCache is given, the output is taken from the cache if it's
+# there, and stored in the cache if it isn't. (Race seeds aren't cached.)
+# If overlay is True, a ROM is returned as a RomOverlay instead of a bytearray.
+def generate(romBytes, isRaceSeed, seed, initialLives, zantetsuken, marahnaPath, bossRushType, outputFormat=None, cache=None, overlay=False):
+    if timingHook:
+        generateStartTime = startTime = time.perf_counter_ns()
+
     # If we're generating a race seed, override the seed argument
     if isRaceSeed:
         seed = None
@@ -1681,21 +2572,615 @@ def generate(romBytes, isRaceSeed, seed, initialLives, zantetsuken, marahnaPath,
 
     # Randomize
     mapNumbers, chosenMarahnaPath, chosenBossRushType = randomize(seed, marahnaPath, bossRushType)
+    if timingHook:
+        startTime = endStage("randomize", startTime)
 
     # Title string
     titleString = f"{'RACE!' if isRaceSeed else seed}"
     if flagString:
         titleString += f" -{flagString}"
 
-    # Modify ROM
+    # Modify ROM (or make a patch, for the IPS and BPS output formats)
     romByteArray = None
-    if romBytes:
-        romByteArray = modifyROM(romBytes, titleString, mapNumbers, initialLives, zantetsuken)
+    if romBytes and cache is not None and not isRaceSeed:
+        ipsBytes = cache.load(romBytes, seed, flagString)
+        if timingHook:
+            startTime = endStage("cacheLoad", startTime)
+        if ipsBytes is None:
+            ipsBytes = makePatch(romBytes, titleString, mapNumbers, initialLives, zantetsuken, OUTPUT_FORMAT___IPS)
+            if timingHook:
+                startTime = endStage("makePatch", startTime)
+            cache.store(romBytes, seed, flagString, ipsBytes)
+            if timingHook:
+                startTime = endStage("cacheStore", startTime)
+        romByteArray = cache.getOutput(romBytes, ipsBytes, outputFormat, overlay)
+        if timingHook:
+            endStage("cacheOutput", startTime)
+    elif romBytes:
+        if outputFormat in [None, OUTPUT_FORMAT___SFC] and overlay:
+            romByteArray = overlayROM(romBytes, titleString, mapNumbers, initialLives, zantetsuken)
+            stageName = "overlayROM"
+        elif outputFormat in [None, OUTPUT_FORMAT___SFC]:
+            romByteArray = modifyROM(romBytes, titleString, mapNumbers, initialLives, zantetsuken)
+            stageName = "modifyROM"
+        else:
+            romByteArray = makePatch(romBytes, titleString, mapNumbers, initialLives, zantetsuken, outputFormat)
+            stageName = "makePatch"
+        if timingHook:
+            endStage(stageName, startTime)
+
+    if timingHook:
+        endStage("generate", generateStartTime)
 
     return romByteArray, mapNumbers, chosenMarahnaPath, chosenBossRushType
 
 
 
+# Seed verification
+# Check that a randomized ROM really is the seed its title screen says it is,
+# e.g. for ROMs submitted for a race. Only the parts of the ROM written by
+# the randomizer are read, not the whole ROM:
+# - The seed and flags, from the title screen menu text (0x12A34)
+# - The hash and randomizer version, from the title screen (0x129BF)
+# - The list of map numbers (0xF9800) and the credits threshold (0x12AAA)
+# - The extended map metadata (0xF8000) and the unflagged ROM patches
+# - The ROM patches for the "E", "U", "D" and "Z" flags: each flag's patches
+#   must all be there if the flag is set, and not all there if it isn't.
+# The map numbers are checked against randomize() for the seed and flags,
+# and the hash against the map numbers. A race seed's seed value isn't
+# known, so its map numbers are only checked for being a possible shuffle.
+# (The animated-tile fixes in BasePatch depend on the original ROM, so
+# they aren't checked.)
+# If expectedSeed or expectedFlagString is given, the ROM must match it too.
+# Returns a VerifyResult. The seed is None for a race seed, or if the title
+# screen couldn't be read. The ROM passed if the list of problems is empty.
+VerifyResult = collections.namedtuple("VerifyResult", ["seed", "flagString", "hashString", "mapNumbers", "problems"])
+
+def verifyROM(romBytes, expectedSeed=None, expectedFlagString=None):
+    try:
+        validateROM(romBytes)
+    except ValueError as e:
+        return VerifyResult(None, None, None, None, [str(e)])
+
+    # Seed and flags
+    menuOptionBytes = bytes(romBytes[0x12A34:0x12A34+33])
+    titleString = menuOptionBytes[:32].decode("ascii", errors="replace").strip()
+    if menuOptionBytes[32] != 0x00 or not titleString.startswith("> "):
+        return VerifyResult(None, None, None, None, [f"Unexpected title screen text: {menuOptionBytes!r}"])
+    seedString, _, flagString = titleString[2:].partition(" -")
+    isRaceSeed = (seedString == "RACE!")
+    seed = None
+    if not isRaceSeed:
+        if not seedString.isdigit() or int(seedString) >= 2**32:
+            return VerifyResult(None, flagString, None, None, [f"Unexpected seed on title screen: {seedString!r}"])
+        seed = int(seedString)
+    try:
+        initialLives, zantetsuken, marahnaPath, bossRushType = parseFlagString(flagString)
+    except ValueError as e:
+        return VerifyResult(seed, flagString, None, None, [str(e)])
+
+    # Hash and randomizer version
+    hvLineBytes = bytes(romBytes[0x129BF:0x129BF+31])
+    hashString = hvLineBytes[2:10].decode("ascii", errors="replace")
+    versionString = hvLineBytes[12:29].decode("ascii", errors="replace").strip()
+    if versionString != f"v.{randomizerVersion[:15]}":
+        return VerifyResult(seed, flagString, hashString, None, [
+            f"Made with a different randomizer version: {versionString!r} # Expected: {'v.' + randomizerVersion[:15]!r}"
+        ])
+
+    problems = []
+    if expectedSeed is not None and seed != expectedSeed:
+        problems.append(f"Unexpected seed: {'(race seed)' if isRaceSeed else seed} # Expected: {expectedSeed}")
+    if expectedFlagString is not None and flagString != expectedFlagString:
+        problems.append(f"Unexpected flags: {flagString or '-'} # Expected: {expectedFlagString or '-'}")
+
+    # Map numbers: Everything between the two 0x801 entries.
+    mapTableBytes = bytes(romBytes[0xF9800:0xF9800+2*(1+99+1)])
+    mapTable = struct.unpack(f"<{len(mapTableBytes) // 2}H", mapTableBytes)
+    mapNumbers = None
+    if mapTable[0] != 0x801 or 0x801 not in mapTable[1:]:
+        problems.append("Unexpected map number list")
+    else:
+        mapNumbers = list(mapTable[1:mapTable.index(0x801, 1)])
+        creditsThreshold = ((len(mapNumbers) // 10) << 4) + (len(mapNumbers) % 10) + 1
+        if romBytes[0x12AAA] != creditsThreshold:
+            problems.append(f"Unexpected credits threshold: 0x{romBytes[0x12AAA]:02X} # Expected: 0x{creditsThreshold:02X}")
+        if getHashString(mapNumbers) != hashString:
+            problems.append(f"Hash doesn't match the map numbers: {hashString} # Expected: {getHashString(mapNumbers)}")
+
+        if not isRaceSeed:
+            if randomize(seed, marahnaPath, bossRushType)[0] != mapNumbers:
+                problems.append(f"Map numbers don't match seed {seed} with flags {flagString or '-'}")
+        else:
+            chosenMarahnaPath, chosenBossRushType = getShuffleOptions(mapNumbers)
+            possibleMapNumbers = [
+                *[x for x in getUnshuffledMapNumbers(chosenMarahnaPath) if x != BOSS_RUSH_PLACEHOLDER],
+                *getUnshuffledBossRush(),
+                0x701,
+            ]
+            if sorted(mapNumbers) != sorted(possibleMapNumbers):
+                problems.append("Map numbers aren't a possible shuffle")
+            elif marahnaPath is not None and marahnaPath != chosenMarahnaPath:
+                problems.append(f"Map numbers don't match flags {flagString}")
+            elif [x for x in mapNumbers if x & 0xF00 == 0x700][-1] != 0x701:
+                problems.append("Map numbers aren't a possible shuffle")
+            elif bossRushType == BOSS_RUSH_TYPE___CONSECUTIVE and chosenBossRushType != bossRushType:
+                problems.append(f"Map numbers don't match flags {flagString}")
+
+    # Seed-independent changes
+    if romBytes[0xF8000:0xF8000+len(extendedMapMetadata)] != extendedMapMetadata:
+        problems.append("Extended map metadata is missing or modified")
+    for offset, data in getRomPatches(None):
+        if romBytes[offset:offset+len(data)] != data:
+            problems.append(f"ROM patch at 0x{offset:X} is missing or modified")
+
+    # Flag-dependent changes
+    for flag in "EUDZ":
+        isApplied = all(
+            romBytes[offset:offset+len(data)] == data
+            for offset, data in getRomPatches(flag)
+        )
+        if isApplied != (flag in flagString):
+            problems.append(f"ROM patches for flag {flag} are {'present' if isApplied else 'missing'}")
+
+    return VerifyResult(seed, flagString, hashString, mapNumbers, problems)
+
+
+
+# Flag updates
+# Change the flags of an already randomized ROM, without generating it again
+# from the original ROM. The map order for a seed doesn't depend on the
+# lives and sword options, and only depends on the Marahna II path and boss
+# rush type options if they differ from the seed's own coin flips (see
+# randomize), so usually only the flag-dependent ROM patches and the title
+# screen text need to change.
+# Returns (patchList, seed, mapNumbers, chosenMarahnaPath, chosenBossRushType)
+# where patchList is a sorted list of (offset, data) patches that turns the
+# randomized ROM into one with the new flags. Only the changed parts are in
+# it, and only the parts of the randomized ROM written by the randomizer
+# are read. Apply it in place, or with a RomOverlay.
+# The seed is None for a race seed. A race seed's seed value isn't known,
+# so its Marahna II path and boss rush type can't be changed.
+# Removing a flag's ROM patches (e.g. going from -E to no lives flag)
+# restores the original bytes: for that, sourceBytes must be the original
+# 'ActRaiser (USA)' ROM. (Only those bytes are read from it.)
+def updateFlags(romBytes, initialLives, zantetsuken, marahnaPath, bossRushType, sourceBytes=None):
+    # Make sure the ROM is an unmodified randomized ROM.
+    result = verifyROM(romBytes)
+    if result.problems:
+        raise ValueError(f"Not an unmodified randomized ROM: {result.problems[0]}")
+    isRaceSeed = (result.seed is None)
+    oldFlagString = result.flagString
+    oldInitialLives, oldZantetsuken, oldMarahnaPath, oldBossRushType = parseFlagString(oldFlagString)
+    flagString = getFlagString(initialLives, zantetsuken, marahnaPath, bossRushType)
+
+    # Map numbers
+    if not isRaceSeed:
+        mapNumbers, chosenMarahnaPath, chosenBossRushType = randomize(result.seed, marahnaPath, bossRushType)
+    else:
+        mapNumbers = result.mapNumbers
+        chosenMarahnaPath, chosenBossRushType = getShuffleOptions(mapNumbers)
+        if oldBossRushType is not None:
+            chosenBossRushType = oldBossRushType
+        if marahnaPath not in [None, chosenMarahnaPath] or bossRushType not in [None, chosenBossRushType]:
+            raise ValueError("Cannot change the Marahna II path or boss rush type of a race seed")
+
+    # Title string
+    titleString = f"{'RACE!' if isRaceSeed else result.seed}"
+    if flagString:
+        titleString += f" -{flagString}"
+    seedPatches = getSeedPatches(titleString, mapNumbers, initialLives, zantetsuken)
+
+    # Restore the original bytes under any old flag-dependent ROM patches
+    # that the new ones don't cover.
+    newFlagPatches = getRomPatches(getFlagString(initialLives, zantetsuken, None, None))
+    newCoveredOffsets = set(itertools.chain.from_iterable(
+        range(offset, offset + len(data)) for offset, data in newFlagPatches
+    ))
+    restorePatches = []
+    for offset, data in getRomPatches(getFlagString(oldInitialLives, oldZantetsuken, None, None)):
+        if newCoveredOffsets.issuperset(range(offset, offset + len(data))):
+            continue
+        if sourceBytes is None:
+            raise ValueError(f"The original ROM is needed to change the flags from {oldFlagString or '-'} to {flagString or '-'}")
+        restorePatches.append((offset, bytes(sourceBytes[offset:offset+len(data)])))
+    if restorePatches:
+        validateROM(sourceBytes, "Original ROM")
+
+    # Keep only the patches that change something.
+    patchList = [
+        (offset, data)
+        for offset, data in mergePatches([*restorePatches, *seedPatches])
+        if romBytes[offset:offset+len(data)] != data
+    ]
+
+    return patchList, result.seed, mapNumbers, chosenMarahnaPath, chosenBossRushType
+
+
+
+# Construct an output file name by adding the seed details to the input
+# file name, e.g. "ActRaiser (USA).sfc" --> "ActRaiser (USA)_12345_EZ.sfc"
+# If an extension is given, it replaces the input file name's extension.
+def getOutputFileName(inFileName, isRaceSeed, seed, flagString, hashString, extension=None):
+    suffix = f"_{'RACE' if isRaceSeed else seed}"
+    if flagString:
+        suffix += f"_{flagString}"
+    if isRaceSeed:
+        suffix += f"_{hashString}"
+
+    basename, dot, inExtension = inFileName.rpartition(".")
+    if basename and inExtension:
+        basename += suffix
+    else:
+        inExtension += suffix
+    if extension is not None:
+        if basename:
+            inExtension = extension
+        else:
+            basename, dot, inExtension = inExtension, ".", extension
+    return basename + dot + inExtension
+
+
+
+# Parse a list of seed values and ranges, e.g. "1000-1999" or "5,10-20".
+# Ranges include both endpoints. Returns a list of range objects.
+def parseSeedRanges(seedsString):
+    seedRanges = []
+    for part in seedsString.split(","):
+        first, dash, last = part.strip().partition("-")
+        try:
+            first = int(first)
+            last = int(last) if dash else first
+        except ValueError:
+            raise ValueError(f"Unexpected seed range: {part!r}") from None
+        if last < first:
+            raise ValueError(f"Unexpected seed range: {part!r} # Range is empty")
+        seedRanges.append(range(first, last + 1))
+    return seedRanges
+
+# As parseSeedRanges, but returns an iterable of seed values.
+def parseSeeds(seedsString):
+    return itertools.chain.from_iterable(parseSeedRanges(seedsString))
+
+
+
+# Read seed values from a file, one per line.
+# Blank lines and lines starting with "#" are ignored.
+def readSeedFile(seedFileName):
+    with open(seedFileName, "r") as seedFile:
+        for line in seedFile:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield int(line)
+
+
+
+# Print the details of a generated seed, as shown by the command line interface.
+def printSeedDetails(seedLabel, flagString, hashString, mapNumbers, chosenMarahnaPath, chosenBossRushType, spoilerLog):
+    # Print the basic seed details.
+    print(f"Version: {randomizerVersion}")
+    print(f"Seed: {seedLabel}")
+    print(f"Flags: {flagString if flagString else '-'}")
+    print(f"Hash: {hashString}")
+
+    # Optional: Print the spoiler log.
+    if spoilerLog:
+        print("---------------------------------------")
+        print(f"Marahna II path: {chosenMarahnaPath}")
+        print(f"Boss rush type: {chosenBossRushType}")
+        for row in itertools.batched(mapNumbers, 10):
+            print(" ".join([format(x, "X") for x in row]))
+        print("---------------------------------------")
+
+    # Print a trailing newline.
+    print()
+
+
+
+# Write the details of a generated seed to a manifest file, as one line of
+# JSON (the JSON Lines format), e.g.
+#   {"version": "2025-03-14", "seed": 5, "flags": "EZ", "hash": "5C1A4AC2",
+#    "marahnaPath": "left", "bossRushType": "scattered",
+#    "maps": [769, 1793, ...], "outputFile": "ActRaiser (USA)_5_EZ.sfc"}
+# (all on one line). A race seed's "seed" is null, as is "outputFile" when
+# no output file was written. Each line is written as soon as the seed is
+# generated; the file object's buffer bounds the memory used.
+def writeManifestLine(manifestFile, seed, flagString, hashString, mapNumbers, chosenMarahnaPath, chosenBossRushType, outFileName):
+    manifestFile.write(json.dumps({
+        "version": randomizerVersion,
+        "seed": seed,
+        "flags": flagString,
+        "hash": hashString,
+        "marahnaPath": chosenMarahnaPath,
+        "bossRushType": chosenBossRushType,
+        "maps": list(mapNumbers),
+        "outputFile": outFileName,
+    }) + "\n")
+
+
+
+# Batch generation
+# Each worker process gets the input ROM once, when it starts, and builds
+# its own BasePatch from it. After that, each task only has to send the
+# seed and options to the worker, and get the seed details back.
+generateManyBasePatch = None
+generateManyCache = None
+
+def generateManyInit(romBytes, cacheDirectory, cacheSize):
+    global generateManyBasePatch, generateManyCache
+    generateManyBasePatch = BasePatch(romBytes) if romBytes else None
+    generateManyCache = GenerateCache(cacheDirectory, cacheSize) if cacheDirectory else None
+
+def generateManyTask(seed, initialLives, zantetsuken, marahnaPath, bossRushType, outputFormat, inFileName, outputDirectory):
+    (
+        romByteArray,
+        mapNumbers,
+        chosenMarahnaPath,
+        chosenBossRushType,
+    ) = generate(
+        generateManyBasePatch,
+        False,
+        seed,
+        initialLives,
+        zantetsuken,
+        marahnaPath,
+        bossRushType,
+        outputFormat,
+        generateManyCache,
+        overlay = True,
+    )
+
+    # If there's somewhere to put it, write the output file.
+    outFileName = None
+    if romByteArray is not None and outputDirectory is not None:
+        flagString = getFlagString(initialLives, zantetsuken, marahnaPath, bossRushType)
+        outFileName = getOutputFileName(
+            os.path.join(outputDirectory, os.path.basename(inFileName)),
+            False,
+            seed,
+            flagString,
+            getHashString(mapNumbers),
+            None if outputFormat in [None, OUTPUT_FORMAT___SFC] else outputFormat,
+        )
+        writeOutputFile(outFileName, romByteArray)
+
+    return seed, outFileName, mapNumbers, chosenMarahnaPath, chosenBossRushType
+
+
+
+# Generate many seeds with the same options, using a pool of worker processes.
+# This is a generator: it yields (seed, outFileName, mapNumbers,
+# chosenMarahnaPath, chosenBossRushType) for each seed, in the order they
+# finish, so results (and output files) are available as soon as possible.
+# If romBytes or outputDirectory is None, no output files are written.
+# The outputFormat is as for generate: a ROM by default, or an IPS or BPS patch.
+# If cacheDirectory is given, the workers share a GenerateCache there.
+# Race seeds aren't supported, since their seed values are never known.
+def generateMany(
+    romBytes,
+    seeds,
+    initialLives,
+    zantetsuken,
+    marahnaPath,
+    bossRushType,
+    outputFormat = None,
+    outputDirectory = None,
+    inFileName = "actraiser.sfc",
+    workers = None,
+    cacheDirectory = None,
+    cacheSize = 256 * 1024 * 1024,
+):
+    # Importing concurrent.futures takes a noticeable fraction of the
+    # module's import time, so only do it when it's needed.
+    import concurrent.futures
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Don't queue up more tasks than needed to keep the workers busy.
+    # That way, the memory used doesn't depend on the number of seeds.
+    maxPending = 4 * workers
+    seedIterator = iter(seeds)
+
+    # The ROM is sent to each worker process once. An mmap can't be sent to
+    # another process, so make a copy.
+    if romBytes and not isinstance(romBytes, bytes):
+        romBytes = bytes(romBytes)
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers = workers,
+        initializer = generateManyInit,
+        initargs = (romBytes, cacheDirectory, cacheSize),
+    ) as executor:
+        pending = set()
+        while True:
+            for seed in itertools.islice(seedIterator, maxPending - len(pending)):
+                pending.add(executor.submit(
+                    generateManyTask,
+                    seed,
+                    initialLives,
+                    zantetsuken,
+                    marahnaPath,
+                    bossRushType,
+                    outputFormat,
+                    inFileName,
+                    outputDirectory,
+                ))
+            if not pending:
+                break
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+
+# Seed search
+# Scan seeds for ones whose shuffle matches a Python expression, e.g.
+#   "at(1) == 0x301"                        (start in Fillmore Act 1)
+#   "all(room(x) >= 20 for x in act(7))"    (no boss-rush boss before room 20)
+#   "rush == 'consecutive' and room(0x701) > len(maps) - 10"
+# Only randomize() is run for each seed, so no ROM is needed.
+# The expression is evaluated with a restricted set of built-in functions,
+# but it's still Python code: don't use expressions from untrusted sources.
+FIND_BUILTINS = {
+    x: getattr(builtins, x)
+    for x in [
+        "abs", "all", "any", "bool", "enumerate", "filter", "format", "hex",
+        "int", "len", "list", "map", "max", "min", "range", "reversed", "set",
+        "sorted", "str", "sum", "tuple", "zip",
+    ]
+}
+
+# Names available to the expression, for one seed:
+# - seed: The seed value
+# - maps: The shuffled map numbers, in order (maps[0] is room 1)
+# - path: The Marahna II path ("left" or "right")
+# - rush: The boss rush type ("consecutive" or "scattered")
+# - at(n): The map number in room n (rooms are numbered from 1, as on the HUD)
+# - room(x): The room number of map x, or 0 if map x isn't in the shuffle
+# - act(n): The map numbers of act n in the shuffle, e.g. act(7) is the
+#   boss rush (Death Heim), act(3) is Kasandora
+def getFindNamespace(seed, mapNumbers, chosenMarahnaPath, chosenBossRushType):
+    rooms = {x: i for i, x in enumerate(mapNumbers, start=1)}
+    return {
+        "__builtins__": FIND_BUILTINS,
+        "seed": seed,
+        "maps": tuple(mapNumbers),
+        "path": chosenMarahnaPath,
+        "rush": chosenBossRushType,
+        "at": lambda n: mapNumbers[n - 1],
+        "room": lambda x: rooms.get(x, 0),
+        "act": lambda n: [x for x in mapNumbers if x >> 8 == n],
+    }
+
+# Compile a search expression, and try it on seed 0,
+# so that mistakes are reported before any workers are started.
+def compileFindExpression(expression, marahnaPath, bossRushType):
+    code = compile(expression, "<find expression>", "eval")
+    eval(code, getFindNamespace(0, *randomize(0, marahnaPath, bossRushType)))
+    return code
+
+findSeedsCode = None
+
+def findSeedsInit(expression):
+    global findSeedsCode
+    findSeedsCode = compile(expression, "<find expression>", "eval")
+
+# Returns the number of seeds scanned, and the details of each matching seed.
+def findSeedsTask(seeds, marahnaPath, bossRushType):
+    matches = []
+    for seed in seeds:
+        mapNumbers, chosenMarahnaPath, chosenBossRushType = randomize(seed, marahnaPath, bossRushType)
+        if eval(findSeedsCode, getFindNamespace(seed, mapNumbers, chosenMarahnaPath, chosenBossRushType)):
+            matches.append((seed, mapNumbers, chosenMarahnaPath, chosenBossRushType))
+    return len(seeds), matches
+
+# Scan seeds using a pool of worker processes. Seeds are split into chunks,
+# and this generator yields (seedsScanned, matches) for each chunk, in seed
+# order, so the first matches found are always the same.
+# To stop early, stop iterating: Unstarted chunks are cancelled.
+def findSeeds(seeds, expression, marahnaPath, bossRushType, workers=None, chunkSize=1000):
+    import concurrent.futures
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    maxPending = 4 * workers
+    seedIterator = iter(seeds)
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers = workers,
+        initializer = findSeedsInit,
+        initargs = (expression,),
+    )
+    try:
+        pending = collections.deque()
+        while True:
+            while len(pending) < maxPending:
+                chunk = list(itertools.islice(seedIterator, chunkSize))
+                if not chunk:
+                    break
+                pending.append(executor.submit(findSeedsTask, chunk, marahnaPath, bossRushType))
+            if not pending:
+                break
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+
+# Web engine data
+# The web interface can generate seeds without Python, using the JavaScript
+# port of the seed-dependent work in web_engine.js. Everything it needs apart
+# from the code itself is exported from this module as web_engine_data.json,
+# so there's only one copy of the patches and the shuffle's inputs:
+# - The ROM size and internal name checked by validateROM
+# - basePatches: The extended map metadata and the unflagged ROM patches,
+#   as applied by BasePatch, followed by its animated-tile fixes
+# - flagPatches: The ROM patches for each flag letter
+# - seedLayout: Where getSeedPatches writes the title screen text, the map
+#   numbers and the credits threshold
+# - shuffle: The inputs to randomize(), and the order in which it calls the
+#   random.Random methods. The engine reproduces CPython's Mersenne Twister
+#   and its choice(), shuffle() and randint() exactly (see randomizeMany in
+#   actraiser_tools.py for the details).
+# Patch data is stored as hex strings.
+# If anything here changes, regenerate the file with writeWebEngineData.
+# "py actraiser_tools.py enginecheck" checks that the file is up to date, and
+# that the engine's output is byte-identical to generate()'s.
+webEngineDataFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), "web_engine_data.json")
+
+def getWebEngineData():
+    return {
+        "randomizerVersion": randomizerVersion,
+        "romSize": 1048576,
+        "romNameOffset": 0x7FC0,
+        "romName": "ACTRAISER-USA        ",
+        "basePatches": [
+            [offset, bytes(data).hex()]
+            for offset, data in [(0xF8000, extendedMapMetadata), *getRomPatches(None)]
+        ],
+        "tileFixOffsets": list(ANIMATED_TILE_FIX_OFFSETS),
+        "tileFixMask": 0x7F,
+        "flagPatches": {
+            flag: [[offset, bytes(data).hex()] for offset, data in getRomPatches(flag)]
+            for flag in "EUDZ"
+        },
+        "seedLayout": {
+            "titleOffset": 0x12A34,
+            "hashVersionOffset": 0x129BF,
+            "mapNumbersOffset": 0xF9800,
+            "mapNumbersLimit": 99,
+            "creditsMapNumber": 0x801,
+            "creditsThresholdOffset": 0x12AAA,
+        },
+        "shuffle": {
+            "marahnaPathChoices": MARAHNA_PATH_CHOICES,
+            "bossRushTypeChoices": BOSS_RUSH_TYPE_CHOICES,
+            "unshuffledMapNumbers": {
+                marahnaPath: getUnshuffledMapNumbers(marahnaPath)
+                for marahnaPath in MARAHNA_PATH_CHOICES
+            },
+            "bossRushPlaceholder": BOSS_RUSH_PLACEHOLDER,
+            "unshuffledBossRush": getUnshuffledBossRush(),
+            "bossRushEnd": 0x701,
+            "steps": [
+                "marahnaCoinFlip = choice(marahnaPathChoices)",
+                "bossRushTypeCoinFlip = choice(bossRushTypeChoices)",
+                "shuffle(unshuffledMapNumbers[marahnaPath])",
+                "shuffle(unshuffledBossRush), then append bossRushEnd",
+                "consecutive: remove the placeholders, insert the boss rush at randint(0, len(mapNumbers))",
+                "scattered: replace the placeholders with the boss rush, in order",
+            ],
+        },
+    }
+
+def writeWebEngineData():
+    with open(webEngineDataFileName, "w") as dataFile:
+        json.dump(getWebEngineData(), dataFile, separators=(",", ":"))
+        dataFile.write("\n")
+
+
+
 if __name__ == "__main__":
     # Process the command line arguments.
     parser = argparse.ArgumentParser(
@@ -1721,6 +3206,19 @@ if __name__ == "__main__":
         action = "store_true",
         help = "generate a race seed with a hidden seed value",
     )
+    seedGroup.add_argument(
+        "--seeds",
+        type = str,
+        help = textwrap.dedent("""\
+            generate one ROM for each of the given seed values,
+            e.g. "1000-1999" or "5,10-20" (ranges are inclusive)"""
+        ),
+    )
+    seedGroup.add_argument(
+        "--seed-file",
+        type = str,
+        help = "generate one ROM for each seed value in a file",
+    )
     parser.add_argument(
         "-l", "--spoiler-log",
         action = "store_true",
@@ -1811,12 +3309,125 @@ if __name__ == "__main__":
         type = str,
         help = "output file name"
     )
+    parser.add_argument(
+        "-f", "--format",
+        choices = OUTPUT_FORMAT_CHOICES,
+        default = OUTPUT_FORMAT___SFC,
+        help = textwrap.dedent("""\
+            output format: a randomized ROM (sfc, the default),
+            or an IPS or BPS patch for the input ROM"""
+        ),
+    )
+    parser.add_argument(
+        "--apply-patch",
+        type = str,
+        metavar = "PATCH_FILE",
+        help = textwrap.dedent("""\
+            apply an IPS or BPS patch to the input file, instead
+            of generating a seed (use -o to name the output file)"""
+        ),
+    )
+    parser.add_argument(
+        "--update-flags",
+        type = str,
+        metavar = "RANDOMIZED_ROM",
+        help = textwrap.dedent("""\
+            change the flags of a randomized ROM to the given
+            flags, instead of generating a seed (the input file
+            is only needed when removing lives or sword flags)"""
+        ),
+    )
+    parser.add_argument(
+        "--output-dir",
+        type = str,
+        help = "output directory for --seeds and --seed-file"
+    )
+    parser.add_argument(
+        "-j", "--workers",
+        type = int,
+        help = "number of worker processes for --seeds, --seed-file and --find"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type = str,
+        help = textwrap.dedent("""\
+            keep generated seeds in this directory, and reuse
+            them when the same seed, flags and input file are
+            used again (race seeds aren't cached)"""
+        ),
+    )
+    parser.add_argument(
+        "--cache-size",
+        type = int,
+        default = 256,
+        help = "maximum size of the cache, in MiB (default: 256)"
+    )
+    parser.add_argument(
+        "--find",
+        type = str,
+        metavar = "EXPRESSION",
+        help = textwrap.dedent("""\
+            search for seeds whose shuffle matches a Python
+            expression, e.g. "at(1) == 0x301", instead of
+            generating a seed (no input file is needed; use
+            --seeds or --seed-file to choose the seeds to scan)"""
+        ),
+    )
+    parser.add_argument(
+        "--count",
+        type = int,
+        default = 1,
+        help = "number of matching seeds to find with --find (default: 1)"
+    )
+    parser.add_argument(
+        "--manifest",
+        type = str,
+        metavar = "MANIFEST_FILE",
+        help = textwrap.dedent("""\
+            also write the details of each seed to this file,
+            as one line of JSON per seed (use "-" to write
+            them to standard output instead of the usual
+            seed details)"""
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        action = "store_true",
+        help = "print how long each stage of generating a seed took",
+    )
     args = parser.parse_args()
 
+    isBatch = args.seeds is not None or args.seed_file is not None
     if args.race_seed and args.spoiler_log:
         parser.error("You cannot print a spoiler log when generating a race seed")
-    if args.input_file is None and not args.dry_run:
-        parser.error("Argument 'input-file' is required when not in dry-run mode")
+    if isBatch and args.output_file is not None:
+        parser.error("You cannot specify an output file name when generating multiple seeds")
+    if args.update_flags is not None:
+        if args.seed is not None or args.race_seed or isBatch or args.find is not None or args.apply_patch is not None:
+            parser.error("You cannot use '--update-flags' with '--seed', '--race-seed', '--seeds', '--seed-file', '--find' or '--apply-patch'")
+        if args.format != OUTPUT_FORMAT___SFC or args.cache_dir is not None:
+            parser.error("You cannot use '--format' or '--cache-dir' with '--update-flags'")
+    if args.find is not None:
+        if args.seed is not None or args.race_seed:
+            parser.error("You cannot use '--find' with '--seed' or '--race-seed'")
+        if args.output_file is not None or args.output_dir is not None or args.apply_patch is not None:
+            parser.error("You cannot write any files when using '--find'")
+        if args.count < 1:
+            parser.error("Argument '--count' must be at least 1")
+    else:
+        if args.input_file is None and args.update_flags is None and (args.apply_patch is not None or not args.dry_run):
+            parser.error("Argument 'input-file' is required when not in dry-run mode")
+        if not isBatch and (args.output_dir is not None or args.workers is not None):
+            parser.error("Arguments '--output-dir' and '--workers' require '--seeds' or '--seed-file'")
+    if args.profile and (isBatch or args.find is not None or args.apply_patch is not None or args.update_flags is not None):
+        parser.error("Argument '--profile' only works when generating a single seed")
+    if args.manifest is not None and (args.apply_patch is not None or args.update_flags is not None):
+        parser.error("You cannot write a manifest when using '--apply-patch' or '--update-flags'")
+
+    # Stage timings, for --profile
+    if args.profile:
+        timingHook = TimingSpans()
+        startTime = time.perf_counter_ns()
 
     # Seed
     seed = args.seed
@@ -1824,6 +3435,17 @@ if __name__ == "__main__":
         seed = random.getrandbits(32)
     seed %= 2**32
 
+    # Seeds for batch generation
+    if args.seeds is not None:
+        try:
+            batchSeeds = parseSeeds(args.seeds)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.seed_file is not None:
+        batchSeeds = readSeedFile(args.seed_file)
+    elif args.find is not None:
+        batchSeeds = range(2**32)
+
     # Flag string
     flagString = getFlagString(
         args.initial_lives,
@@ -1834,73 +3456,285 @@ if __name__ == "__main__":
 
     # If there's an input file, read it.
     romBytes = None
-    if args.input_file:
-        # Read the input file.
+    if args.input_file and args.find is None:
+        # Open the input file.
         inFileName = args.input_file
-        with open(inFileName, "rb") as inFile:
-            romBytes = inFile.read()
+        romBytes = openROM(inFileName)
 
         # Sanity-check the input file.
-        if len(romBytes) != 1048576:
-            raise ValueError(f"Input file {inFileName!r} is not 1048576 bytes in size")
-        romName = romBytes[0x7FC0:0x7FD5]
-        goodName = b"ACTRAISER-USA        "
-        if romName != goodName:
-            raise ValueError(f"Unexpected internal ROM name: {romName!r} # Expected: {goodName!r}")
-
-    # Generate the seed.
-    (
-        romByteArray,
-        mapNumbers,
-        chosenMarahnaPath,
-        chosenBossRushType,
-    ) = generate(
-        romBytes,
-        args.race_seed,
-        seed,
-        args.initial_lives,
-        args.zantetsuken,
-        args.marahna_path,
-        args.boss_rush_type,
-    )
-
-    # Hash string
-    hashString = getHashString(mapNumbers)
+        validateROM(romBytes, f"Input file {inFileName!r}")
+        if timingHook:
+            startTime = endStage("readInputFile", startTime)
+
+    # Check the expression before starting the search.
+    if args.find is not None:
+        try:
+            compileFindExpression(args.find, args.marahna_path, args.boss_rush_type)
+        except Exception as e:
+            parser.error(f"Unusable expression for '--find': {e!r}")
+
+    # Manifest file
+    # When the manifest goes to standard output, it replaces the usual
+    # seed details there. It's only opened once the arguments and the input
+    # file have been checked, so a mistake doesn't create or truncate it.
+    manifestFile = None
+    printDetails = True
+    if args.manifest == "-":
+        manifestFile = sys.stdout
+        printDetails = False
+    elif args.manifest is not None:
+        manifestFile = open(args.manifest, "w", buffering=64 * 1024)
+
+    if args.find is not None:
+        # Scan the seeds in order, printing the details of each match,
+        # until we've found enough of them.
+        seedsScanned = 0
+        matchCount = 0
+        startTime = time.perf_counter()
+        for chunkSeedsScanned, matches in findSeeds(
+            (x % 2**32 for x in batchSeeds),
+            args.find,
+            args.marahna_path,
+            args.boss_rush_type,
+            workers = args.workers,
+        ):
+            seedsScanned += chunkSeedsScanned
+            for (
+                seed,
+                mapNumbers,
+                chosenMarahnaPath,
+                chosenBossRushType,
+            ) in matches[:args.count - matchCount]:
+                hashString = getHashString(mapNumbers)
+                if printDetails:
+                    printSeedDetails(
+                        seed,
+                        flagString,
+                        hashString,
+                        mapNumbers,
+                        chosenMarahnaPath,
+                        chosenBossRushType,
+                        args.spoiler_log,
+                    )
+                if manifestFile:
+                    writeManifestLine(
+                        manifestFile,
+                        seed,
+                        flagString,
+                        hashString,
+                        mapNumbers,
+                        chosenMarahnaPath,
+                        chosenBossRushType,
+                        None,
+                    )
+                matchCount += 1
+            if matchCount >= args.count:
+                break
+        elapsedTime = time.perf_counter() - startTime
+        print(
+            f"Found {matchCount} matching seed(s) in {seedsScanned} seeds scanned, "
+            f"{elapsedTime:.2f} s ({seedsScanned / elapsedTime:.0f} seeds/s)",
+            file = sys.stderr,
+        )
+
+    elif args.apply_patch is not None:
+        # Apply the patch. Name the output file after the patch file.
+        with open(args.apply_patch, "rb") as patchFile:
+            patchBytes = patchFile.read()
+        romByteArray = applyPatch(romBytes, patchBytes)
+        if not args.dry_run:
+            outFileName = args.output_file
+            if outFileName is None:
+                basename, dot, extension = args.apply_patch.rpartition(".")
+                outFileName = (basename if dot else extension) + ".sfc"
+            with open(outFileName, "xb") as outFile:
+                outFile.write(romByteArray)
+
+    elif args.update_flags is not None:
+        # Work out the changes, reading only the parts of the randomized ROM
+        # (and the input file, if any) that are needed.
+        randomizedRomBytes = openROM(args.update_flags)
+        try:
+            (
+                patchList,
+                seed,
+                mapNumbers,
+                chosenMarahnaPath,
+                chosenBossRushType,
+            ) = updateFlags(
+                randomizedRomBytes,
+                args.initial_lives,
+                args.zantetsuken,
+                args.marahna_path,
+                args.boss_rush_type,
+                romBytes,
+            )
+        except ValueError as e:
+            parser.error(f"Cannot update flags of {args.update_flags!r}: {e}")
+        hashString = getHashString(mapNumbers)
+        if args.spoiler_log and seed is None:
+            parser.error("You cannot print a spoiler log for a race seed")
+
+        printSeedDetails(
+            "(race seed)" if seed is None else seed,
+            flagString,
+            hashString,
+            mapNumbers,
+            chosenMarahnaPath,
+            chosenBossRushType,
+            args.spoiler_log,
+        )
+
+        # If we're not in dry-run mode, write the output file: the
+        # randomized ROM with the changes.
+        if not args.dry_run:
+            outFileName = args.output_file
+            if outFileName is None:
+                outFileName = getOutputFileName(
+                    inFileName if args.input_file else "actraiser.sfc",
+                    seed is None,
+                    seed,
+                    flagString,
+                    hashString,
+                )
+            writeOutputFile(outFileName, RomOverlay(randomizedRomBytes, patchList))
+
+    elif isBatch:
+        # Generate the seeds, printing the details of each one as it finishes.
+        # Output files go in the output directory, if one was given.
+        # Otherwise, they go next to the input file.
+        outputDirectory = None
+        if not args.dry_run:
+            outputDirectory = args.output_dir
+            if outputDirectory is None:
+                outputDirectory = os.path.dirname(inFileName)
+            os.makedirs(outputDirectory or ".", exist_ok=True)
+        for (
+            seed,
+            outFileName,
+            mapNumbers,
+            chosenMarahnaPath,
+            chosenBossRushType,
+        ) in generateMany(
+            romBytes if not args.dry_run else None,
+            (x % 2**32 for x in batchSeeds),
+            args.initial_lives,
+            args.zantetsuken,
+            args.marahna_path,
+            args.boss_rush_type,
+            outputFormat = args.format,
+            outputDirectory = outputDirectory,
+            inFileName = inFileName if args.input_file else "actraiser.sfc",
+            workers = args.workers,
+            cacheDirectory = args.cache_dir,
+            cacheSize = args.cache_size * 1024 * 1024,
+        ):
+            hashString = getHashString(mapNumbers)
+            if printDetails:
+                printSeedDetails(
+                    seed,
+                    flagString,
+                    hashString,
+                    mapNumbers,
+                    chosenMarahnaPath,
+                    chosenBossRushType,
+                    args.spoiler_log,
+                )
+            if manifestFile:
+                writeManifestLine(
+                    manifestFile,
+                    seed,
+                    flagString,
+                    hashString,
+                    mapNumbers,
+                    chosenMarahnaPath,
+                    chosenBossRushType,
+                    outFileName,
+                )
 
-    # Print the basic seed details.
-    print(f"Version: {randomizerVersion}")
-    print(f"Seed: {'(race seed)' if args.race_seed else seed}")
-    print(f"Flags: {flagString if flagString else '-'}")
-    print(f"Hash: {hashString}")
-
-    # Optional: Print the spoiler log.
-    if args.spoiler_log:
-        print("---------------------------------------")
-        print(f"Marahna II path: {chosenMarahnaPath}")
-        print(f"Boss rush type: {chosenBossRushType}")
-        for row in itertools.batched(mapNumbers, 10):
-            print(" ".join([format(x, "X") for x in row]))
-        print("---------------------------------------")
-
-    # Print a trailing newline.
-    print()
-
-    # If we're not in dry-run mode, write the output file.
-    if not args.dry_run:
-        outFileName = args.output_file
-        if outFileName is None:
-            suffix = f"_{'RACE' if args.race_seed else seed}"
-            if flagString:
-                suffix += f"_{flagString}"
-            if args.race_seed:
-                suffix += f"_{hashString}"
-
-            basename, dot, extension = inFileName.rpartition(".")
-            if basename and extension:
-                basename += suffix
-            else:
-                extension += suffix
-            outFileName = basename + dot + extension
-
-        with open(outFileName, "xb") as outFile:
-            outFile.write(romByteArray)
+    else:
+        # Generate the seed.
+        (
+            romByteArray,
+            mapNumbers,
+            chosenMarahnaPath,
+            chosenBossRushType,
+        ) = generate(
+            romBytes,
+            args.race_seed,
+            seed,
+            args.initial_lives,
+            args.zantetsuken,
+            args.marahna_path,
+            args.boss_rush_type,
+            args.format,
+            GenerateCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None,
+            overlay = True,
+        )
+
+        if timingHook:
+            startTime = time.perf_counter_ns()
+
+        # Hash string
+        hashString = getHashString(mapNumbers)
+        if timingHook:
+            startTime = endStage("hashString", startTime)
+
+        # Print the seed details.
+        if printDetails:
+            printSeedDetails(
+                "(race seed)" if args.race_seed else seed,
+                flagString,
+                hashString,
+                mapNumbers,
+                chosenMarahnaPath,
+                chosenBossRushType,
+                args.spoiler_log,
+            )
+
+        # If we're not in dry-run mode, write the output file.
+        outFileName = None
+        if not args.dry_run:
+            if timingHook:
+                startTime = time.perf_counter_ns()
+            outFileName = args.output_file
+            if outFileName is None:
+                outFileName = getOutputFileName(
+                    inFileName,
+                    args.race_seed,
+                    seed,
+                    flagString,
+                    hashString,
+                    None if args.format == OUTPUT_FORMAT___SFC else args.format,
+                )
+
+            writeOutputFile(outFileName, romByteArray)
+            if timingHook:
+                endStage("writeOutputFile", startTime)
+
+        # Write the seed details to the manifest.
+        # (A race seed's seed value isn't written anywhere.)
+        if manifestFile:
+            writeManifestLine(
+                manifestFile,
+                None if args.race_seed else seed,
+                flagString,
+                hashString,
+                mapNumbers,
+                chosenMarahnaPath,
+                chosenBossRushType,
+                outFileName,
+            )
+
+        # Print the stage timings.
+        if timingHook:
+            print(file=sys.stderr)
+            print("Stage timings:", file=sys.stderr)
+            for line in timingHook.formatBreakdown():
+                print(f"  {line}", file=sys.stderr)
+
+    # Finish writing the manifest.
+    if manifestFile is sys.stdout:
+        manifestFile.flush()
+    elif manifestFile:
+        manifestFile.close()
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+#
+# ActRaiser Randomizer for Professional Mode: Synthetic ROM
+# A stand-in for the 'ActRaiser (USA)' ROM, shared by actraiser_tools.py
+# and the benchmarks. Kept separate so the benchmarks don't have to import
+# all of actraiser_tools.py to get it.
+
+import random
+
+
+
+# 1 MiB of pseudorandom bytes, with the right internal ROM name. The
+# randomizer only checks the size and name, so it can be used anywhere a
+# real ROM's output doesn't matter.
+def makeSyntheticROM():
+    romByteArray = bytearray(random.Random(0).randbytes(1048576))
+    romByteArray[0x7FC0:0x7FD5] = b"ACTRAISER-USA        "
+    return bytes(romByteArray)
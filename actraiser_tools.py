@@ -0,0 +1,1448 @@
+#!/usr/bin/env python3
+#
+# ActRaiser Randomizer for Professional Mode: Tools
+# Command line tools built on top of actraiser_randomizer.py.
+# Run "py actraiser_tools.py -h" for the list of tools.
+
+import argparse
+import asyncio
+import concurrent.futures
+import csv
+import hashlib
+import heapq
+import http
+import itertools
+import json
+import mmap
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import zlib
+
+import actraiser_randomizer
+from actraiser_synthetic_rom import makeSyntheticROM
+
+# NumPy is only needed by some of the tools.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+
+# Helper function for tools that need NumPy.
+def requireNumPy(toolName):
+    if numpy is None:
+        raise RuntimeError(f"The {toolName!r} tool requires NumPy: https://numpy.org/install/")
+
+
+
+# Split seed ranges into chunks of at most chunkSize seeds, as ranges.
+# Seed values are mapped into 0 to 2**32 - 1, as with the randomizer's "-s".
+def chunkSeedRanges(seedRanges, chunkSize):
+    for seedRange in seedRanges:
+        for chunkStart in range(0, len(seedRange), chunkSize):
+            chunk = seedRange[chunkStart:chunkStart+chunkSize]
+            if chunk.start >= 0 and chunk.stop <= 2**32:
+                yield chunk
+            else:
+                yield [seed % 2**32 for seed in chunk]
+
+
+
+# Run function(*taskArguments) in the executor for each item of
+# taskArgumentsIterable, yielding the results in the order they finish.
+# Only a few tasks are queued at a time, so that memory use doesn't depend
+# on the number of tasks.
+def mapUnordered(executor, function, taskArgumentsIterable, maxPending):
+    taskArgumentsIterator = iter(taskArgumentsIterable)
+    pending = set()
+    while True:
+        for taskArguments in itertools.islice(taskArgumentsIterator, maxPending - len(pending)):
+            pending.add(executor.submit(function, *taskArguments))
+        if not pending:
+            break
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+
+# Add the Marahna II path and boss rush type options to a parser.
+# These are the only options that affect the shuffled map order.
+def addShuffleArguments(parser):
+    marahnaPathGroup = parser.add_mutually_exclusive_group()
+    marahnaPathGroup.add_argument(
+        "-L", "--left-path",
+        action = "store_const",
+        const = actraiser_randomizer.MARAHNA_PATH___LEFT,
+        dest = "marahna_path",
+        help = "use the left path in Marahna II",
+    )
+    marahnaPathGroup.add_argument(
+        "-R", "--right-path",
+        action = "store_const",
+        const = actraiser_randomizer.MARAHNA_PATH___RIGHT,
+        dest = "marahna_path",
+        help = "use the right path in Marahna II",
+    )
+    bossRushTypeGroup = parser.add_mutually_exclusive_group()
+    bossRushTypeGroup.add_argument(
+        "-C", "--consecutive-boss-rush",
+        action = "store_const",
+        const = actraiser_randomizer.BOSS_RUSH_TYPE___CONSECUTIVE,
+        dest = "boss_rush_type",
+        help = "use a consecutive boss rush",
+    )
+    bossRushTypeGroup.add_argument(
+        "-S", "--scattered-boss-rush",
+        action = "store_const",
+        const = actraiser_randomizer.BOSS_RUSH_TYPE___SCATTERED,
+        dest = "boss_rush_type",
+        help = "use a scattered boss rush",
+    )
+
+
+
+# Seed statistics
+# Run randomize over many seeds (no ROM needed) and count:
+# - How often each map appears in each room
+#   (From this: which map opens the run, which maps appear early, etc.)
+# - Which room the boss rush starts in, for consecutive boss rushes
+# - Which Marahna II path and boss rush type were chosen
+# Each worker process counts a chunk of seeds at a time, in NumPy arrays,
+# and the main process adds up the chunks' counts.
+
+# Every map that can appear in the shuffle, in a fixed order.
+seedStatsMapNumbers = sorted(
+    set(actraiser_randomizer.randomize(0, actraiser_randomizer.MARAHNA_PATH___LEFT, None)[0])
+    | set(actraiser_randomizer.randomize(0, actraiser_randomizer.MARAHNA_PATH___RIGHT, None)[0])
+)
+seedStatsRoomCount = len(actraiser_randomizer.randomize(0, None, None)[0])
+seedStatsBossRushMapNumbers = [x for x in seedStatsMapNumbers if x & 0xF00 == 0x700]
+
+def seedStatsTask(seeds, marahnaPath, bossRushType):
+    mapIndexes = {mapNumber: i for i, mapNumber in enumerate(seedStatsMapNumbers)}
+    mapRooms = numpy.zeros((len(seeds), seedStatsRoomCount), dtype=numpy.int64)
+    leftPath = numpy.zeros(len(seeds), dtype=bool)
+    consecutive = numpy.zeros(len(seeds), dtype=bool)
+
+    for i, seed in enumerate(seeds):
+        mapNumbers, chosenMarahnaPath, chosenBossRushType = actraiser_randomizer.randomize(seed, marahnaPath, bossRushType)
+        mapRooms[i] = [mapIndexes[x] for x in mapNumbers]
+        leftPath[i] = (chosenMarahnaPath == actraiser_randomizer.MARAHNA_PATH___LEFT)
+        consecutive[i] = (chosenBossRushType == actraiser_randomizer.BOSS_RUSH_TYPE___CONSECUTIVE)
+
+    return seedStatsCount(mapRooms, leftPath, consecutive)
+
+# Count the results for a chunk of seeds.
+# mapRooms: (seeds, rooms) array of indexes into seedStatsMapNumbers.
+def seedStatsCount(mapRooms, leftPath, consecutive):
+    mapCount = len(seedStatsMapNumbers)
+    roomCount = seedStatsRoomCount
+
+    # Count each (map, room) pair.
+    mapRoomCounts = numpy.bincount(
+        (mapRooms * roomCount + numpy.arange(roomCount)).ravel(),
+        minlength = mapCount * roomCount,
+    ).reshape(mapCount, roomCount)
+
+    # For consecutive boss rushes, find the first boss-rush room.
+    bossRushIndexes = [seedStatsMapNumbers.index(x) for x in seedStatsBossRushMapNumbers]
+    isBossRushRoom = numpy.isin(mapRooms[consecutive], bossRushIndexes)
+    bossRushStartCounts = numpy.bincount(isBossRushRoom.argmax(axis=1), minlength=roomCount)
+
+    return {
+        "mapRoomCounts": mapRoomCounts,
+        "bossRushStartCounts": bossRushStartCounts,
+        "leftPathCount": int(leftPath.sum()),
+        "consecutiveCount": int(consecutive.sum()),
+    }
+
+def seedStats(seedRanges, marahnaPath, bossRushType, workers=None, chunkSize=10000):
+    requireNumPy("seedstats")
+
+    # Preallocate the totals.
+    totals = {
+        "mapRoomCounts": numpy.zeros((len(seedStatsMapNumbers), seedStatsRoomCount), dtype=numpy.int64),
+        "bossRushStartCounts": numpy.zeros(seedStatsRoomCount, dtype=numpy.int64),
+        "leftPathCount": 0,
+        "consecutiveCount": 0,
+    }
+    seedCount = 0
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    startTime = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in mapUnordered(
+            executor,
+            seedStatsTask,
+            ((chunk, marahnaPath, bossRushType) for chunk in chunkSeedRanges(seedRanges, chunkSize)),
+            4 * workers,
+        ):
+            totals["mapRoomCounts"] += result["mapRoomCounts"]
+            totals["bossRushStartCounts"] += result["bossRushStartCounts"]
+            totals["leftPathCount"] += result["leftPathCount"]
+            totals["consecutiveCount"] += result["consecutiveCount"]
+            seedCount += int(result["mapRoomCounts"][:, 0].sum())
+    elapsedTime = time.perf_counter() - startTime
+
+    return totals, seedCount, elapsedTime
+
+def seedStatsReport(totals, seedCount, marahnaPath, bossRushType):
+    mapRoomCounts = totals["mapRoomCounts"]
+    return {
+        "randomizerVersion": actraiser_randomizer.randomizerVersion,
+        "flags": actraiser_randomizer.getFlagString(None, False, marahnaPath, bossRushType),
+        "seedCount": seedCount,
+        "marahnaPath": {
+            actraiser_randomizer.MARAHNA_PATH___LEFT: totals["leftPathCount"],
+            actraiser_randomizer.MARAHNA_PATH___RIGHT: seedCount - totals["leftPathCount"],
+        },
+        "bossRushType": {
+            actraiser_randomizer.BOSS_RUSH_TYPE___CONSECUTIVE: totals["consecutiveCount"],
+            actraiser_randomizer.BOSS_RUSH_TYPE___SCATTERED: seedCount - totals["consecutiveCount"],
+        },
+        # Room numbers start at 1, as on the HUD.
+        "consecutiveBossRushStartRoom": {
+            str(room + 1): int(count)
+            for room, count in enumerate(totals["bossRushStartCounts"])
+            if count
+        },
+        "firstRoom": {
+            format(mapNumber, "X"): int(mapRoomCounts[i, 0])
+            for i, mapNumber in enumerate(seedStatsMapNumbers)
+        },
+        "firstTenRooms": {
+            format(mapNumber, "X"): int(mapRoomCounts[i, :10].sum())
+            for i, mapNumber in enumerate(seedStatsMapNumbers)
+        },
+        "mapRoomCounts": {
+            format(mapNumber, "X"): [int(x) for x in mapRoomCounts[i]]
+            for i, mapNumber in enumerate(seedStatsMapNumbers)
+        },
+    }
+
+# JSON output: The whole report.
+# CSV output: One row per map, with its count for each room.
+def writeSeedStatsReport(report, reportFormat, outFile):
+    if reportFormat == "csv":
+        writer = csv.writer(outFile)
+        writer.writerow(["map", "first_ten_rooms", *[f"room_{room:02d}" for room in range(1, seedStatsRoomCount + 1)]])
+        for mapNumber, roomCounts in report["mapRoomCounts"].items():
+            writer.writerow([mapNumber, report["firstTenRooms"][mapNumber], *roomCounts])
+    else:
+        json.dump(report, outFile, indent=2)
+        outFile.write("\n")
+
+def runSeedStats(args):
+    totals, seedCount, elapsedTime = seedStats(
+        actraiser_randomizer.parseSeedRanges(args.seeds),
+        args.marahna_path,
+        args.boss_rush_type,
+        workers = args.workers,
+    )
+    report = seedStatsReport(totals, seedCount, args.marahna_path, args.boss_rush_type)
+
+    if args.output_file is None:
+        writeSeedStatsReport(report, args.format, sys.stdout)
+    else:
+        with open(args.output_file, "x", newline="") as outFile:
+            writeSeedStatsReport(report, args.format, outFile)
+
+    print(f"{seedCount} seeds in {elapsedTime:.2f} s ({seedCount / elapsedTime:.0f} seeds/s)", file=sys.stderr)
+
+
+
+# Hash index
+# The hash shown on the title screen depends only on the randomizer version
+# and the shuffled map order, which in turn depends only on the seed and the
+# Marahna II path and boss rush type options. So for a given version and
+# options, we can compute the hash for every seed ahead of time, and later
+# find the seed(s) that match a reported hash.
+#
+# The index is a directory containing:
+# - index.json: The randomizer version, flags, and seeds that were indexed
+# - chunks/: The records for each chunk of seeds, sorted (while building)
+# - merge/: Partly-merged records (while merging, if there are many chunks)
+# - index.bin: All of the records, sorted (once the build is finished)
+# Each record is 8 bytes: the hash as a big-endian 32-bit integer, followed
+# by the seed as a big-endian 32-bit integer. With big-endian numbers, the
+# records sort the same way as bytes and as integers, so index.bin can be
+# binary-searched in place through mmap without reading the whole file.
+#
+# Building is resumable: each chunk file is only written once it's complete,
+# and chunks that already exist are skipped.
+#
+# A big index has thousands of chunks, more than can be open at once, so
+# they're merged in passes of up to HASH_INDEX_MERGE_FAN_IN files at a time.
+#
+# Note that race seeds ("-r") are chosen from the operating system's source
+# of randomness, not from the 0 to 2**32 - 1 range, so they can't be found.
+
+HASH_INDEX_RECORD = struct.Struct(">II")
+HASH_INDEX_MERGE_FAN_IN = 128
+
+def hashIndexTask(chunkFileName, seeds, marahnaPath, bossRushType):
+    records = []
+    for seed in seeds:
+        mapNumbers = actraiser_randomizer.randomize(seed, marahnaPath, bossRushType)[0]
+        hashValue = int(actraiser_randomizer.getHashString(mapNumbers), 16)
+        records.append((hashValue << 32) | seed)
+    records.sort()
+
+    # Write to a temporary file, then rename, so that a chunk file only
+    # exists once it's complete.
+    temporaryFileName = f"{chunkFileName}.tmp"
+    with open(temporaryFileName, "wb") as outFile:
+        outFile.write(struct.pack(f">{len(records)}Q", *records))
+    os.replace(temporaryFileName, chunkFileName)
+    return len(records)
+
+# Read the records from a sorted file, a block at a time.
+def readHashIndexRecords(fileName, blockSize=65536):
+    with open(fileName, "rb") as inFile:
+        while block := inFile.read(blockSize - blockSize % HASH_INDEX_RECORD.size):
+            yield from HASH_INDEX_RECORD.iter_unpack(block)
+
+# Merge the records from sorted files into a new sorted file.
+def mergeHashIndexFiles(inFileNames, outFileName):
+    temporaryFileName = f"{outFileName}.tmp"
+    with open(temporaryFileName, "wb") as outFile:
+        block = []
+        for record in heapq.merge(*[readHashIndexRecords(x) for x in inFileNames]):
+            block.append(HASH_INDEX_RECORD.pack(*record))
+            if len(block) == 8192:
+                outFile.write(b"".join(block))
+                block.clear()
+        outFile.write(b"".join(block))
+    os.replace(temporaryFileName, outFileName)
+
+def buildHashIndex(directory, seedsString, marahnaPath, bossRushType, workers=None, chunkSize=1000000):
+    settings = {
+        "randomizerVersion": actraiser_randomizer.randomizerVersion,
+        "flags": actraiser_randomizer.getFlagString(None, False, marahnaPath, bossRushType),
+        "seeds": seedsString,
+        "chunkSize": chunkSize,
+    }
+
+    # Starting a new build, or resuming an old one?
+    # The chunks are only valid if the settings are the same.
+    os.makedirs(directory, exist_ok=True)
+    settingsFileName = os.path.join(directory, "index.json")
+    if os.path.exists(settingsFileName):
+        with open(settingsFileName, "r") as inFile:
+            oldSettings = json.load(inFile)
+        if oldSettings != settings:
+            raise ValueError(f"Existing index in {directory!r} was built with different settings: {oldSettings}")
+    else:
+        with open(settingsFileName, "x") as outFile:
+            json.dump(settings, outFile, indent=2)
+            outFile.write("\n")
+
+    # Already finished?
+    indexFileName = os.path.join(directory, "index.bin")
+    if os.path.exists(indexFileName):
+        print(f"Index in {directory!r} is already complete", file=sys.stderr)
+        return
+
+    chunkDirectory = os.path.join(directory, "chunks")
+    os.makedirs(chunkDirectory, exist_ok=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # The chunks are numbered in order, so the same settings always give
+    # the same chunk files.
+    chunkFileNames = []
+    taskArgumentsList = []
+    for chunkNumber, chunk in enumerate(chunkSeedRanges(actraiser_randomizer.parseSeedRanges(seedsString), chunkSize)):
+        chunkFileName = os.path.join(chunkDirectory, f"{chunkNumber:06d}.bin")
+        chunkFileNames.append(chunkFileName)
+        if not os.path.exists(chunkFileName):
+            taskArgumentsList.append((chunkFileName, chunk, marahnaPath, bossRushType))
+
+    startTime = time.perf_counter()
+    seedCount = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for finishedCount, chunkSeedCount in enumerate(
+            mapUnordered(executor, hashIndexTask, taskArgumentsList, 4 * workers),
+            start = 1,
+        ):
+            seedCount += chunkSeedCount
+            print(f"Chunk {finishedCount}/{len(taskArgumentsList)} done ({seedCount} seeds)", file=sys.stderr)
+    elapsedTime = time.perf_counter() - startTime
+    if seedCount:
+        print(f"{seedCount} seeds in {elapsedTime:.2f} s ({seedCount / elapsedTime:.0f} seeds/s)", file=sys.stderr)
+
+    # Merge the sorted chunks into the final index. If there are too many
+    # chunks to open at once, merge them in groups first, then merge those.
+    # The chunks are kept until the end, in case the merge is interrupted.
+    mergeDirectory = os.path.join(directory, "merge")
+    shutil.rmtree(mergeDirectory, ignore_errors=True)
+    os.makedirs(mergeDirectory)
+    mergeFileNames = chunkFileNames
+    mergePassNumber = 0
+    while len(mergeFileNames) > HASH_INDEX_MERGE_FAN_IN:
+        mergePassNumber += 1
+        nextMergeFileNames = []
+        for groupStart in range(0, len(mergeFileNames), HASH_INDEX_MERGE_FAN_IN):
+            groupFileNames = mergeFileNames[groupStart:groupStart+HASH_INDEX_MERGE_FAN_IN]
+            groupFileName = os.path.join(mergeDirectory, f"{mergePassNumber:02d}_{len(nextMergeFileNames):06d}.bin")
+            mergeHashIndexFiles(groupFileNames, groupFileName)
+            nextMergeFileNames.append(groupFileName)
+        print(f"Merge pass {mergePassNumber} done ({len(mergeFileNames)} files into {len(nextMergeFileNames)})", file=sys.stderr)
+
+        # The previous pass's files aren't needed anymore (unless they're chunks).
+        if mergeFileNames is not chunkFileNames:
+            for mergeFileName in mergeFileNames:
+                os.remove(mergeFileName)
+        mergeFileNames = nextMergeFileNames
+    mergeHashIndexFiles(mergeFileNames, indexFileName)
+
+    # The chunks and merge files aren't needed anymore.
+    shutil.rmtree(mergeDirectory)
+    for chunkFileName in chunkFileNames:
+        os.remove(chunkFileName)
+    os.rmdir(chunkDirectory)
+
+class HashIndex:
+    def __init__(self, directory):
+        with open(os.path.join(directory, "index.json"), "r") as inFile:
+            self.settings = json.load(inFile)
+        with open(os.path.join(directory, "index.bin"), "rb") as inFile:
+            # mmap can't map an empty file.
+            if os.fstat(inFile.fileno()).st_size:
+                self.indexBytes = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.indexBytes = b""
+        self.recordCount = len(self.indexBytes) // HASH_INDEX_RECORD.size
+
+    def close(self):
+        if isinstance(self.indexBytes, mmap.mmap):
+            self.indexBytes.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def getHashValue(self, recordNumber):
+        return HASH_INDEX_RECORD.unpack_from(self.indexBytes, recordNumber * HASH_INDEX_RECORD.size)[0]
+
+    # Return all of the seeds with the given hash string, in order.
+    def lookup(self, hashString):
+        if len(hashString) != 8:
+            raise ValueError(f"Hash string should be 8 hex digits: {hashString!r}")
+        hashValue = int(hashString, 16)
+
+        # Binary search for the first record with this hash.
+        low, high = 0, self.recordCount
+        while low < high:
+            middle = (low + high) // 2
+            if self.getHashValue(middle) < hashValue:
+                low = middle + 1
+            else:
+                high = middle
+
+        seeds = []
+        for recordNumber in range(low, self.recordCount):
+            recordHashValue, seed = HASH_INDEX_RECORD.unpack_from(self.indexBytes, recordNumber * HASH_INDEX_RECORD.size)
+            if recordHashValue != hashValue:
+                break
+            seeds.append(seed)
+        return seeds
+
+def runHashIndexBuild(args):
+    buildHashIndex(
+        args.index_directory,
+        args.seeds,
+        args.marahna_path,
+        args.boss_rush_type,
+        workers = args.workers,
+        chunkSize = args.chunk_size,
+    )
+
+def runHashIndexLookup(args):
+    with HashIndex(args.index_directory) as hashIndex:
+        if hashIndex.settings["randomizerVersion"] != actraiser_randomizer.randomizerVersion:
+            print(f"Warning: Index is for randomizer version {hashIndex.settings['randomizerVersion']}, not {actraiser_randomizer.randomizerVersion}", file=sys.stderr)
+        flagString = hashIndex.settings["flags"]
+        for hashString in args.hash_strings:
+            for seed in hashIndex.lookup(hashString.upper()):
+                print(f"{hashString.upper()}  Seed: {seed}  Flags: {flagString or '(none)'}")
+
+
+
+# Seed verification
+# Check submitted ROMs with verifyROM(): each file is mapped into memory,
+# and only the parts that the randomizer writes are read.
+
+def runVerify(args):
+    if args.flags is not None:
+        try:
+            actraiser_randomizer.parseFlagString(args.flags)
+        except ValueError as e:
+            sys.exit(f"Error: {e}")
+
+    failureCount = 0
+    for fileName in args.input_files:
+        try:
+            romBytes = actraiser_randomizer.openROM(fileName)
+        except OSError as e:
+            problems = [str(e)]
+        else:
+            result = actraiser_randomizer.verifyROM(romBytes, args.seed, args.flags)
+            if isinstance(romBytes, mmap.mmap):
+                romBytes.close()
+            problems = result.problems
+        if problems:
+            failureCount += 1
+            print(f"FAIL  {fileName}")
+            for problem in problems:
+                print(f"      {problem}")
+        elif not args.quiet:
+            seedLabel = "(race seed)" if result.seed is None else result.seed
+            print(f"OK    {fileName}  Seed: {seedLabel}  Flags: {result.flagString or '-'}  Hash: {result.hashString}")
+
+    print(f"Verified {len(args.input_files)} file(s): {failureCount} failed", file=sys.stderr)
+    if failureCount:
+        sys.exit(1)
+
+
+
+# Web engine check
+# Check web_engine.js, which generates seeds in the web interface without
+# Pyodide, against generate(). The engine is run with Node.js, through
+# web_engine_check.js.
+# - web_engine_data.json must be the same as getWebEngineData()'s output.
+# - For each seed, every combination of options, and every output format,
+#   the engine's output must be byte-identical to generate()'s, and its map
+#   order, hash and chosen options must be the same.
+# - Race seeds can't be compared, so the engine's race seeds are checked
+#   with verifyROM() instead.
+# No 'ActRaiser (USA)' ROM is needed: a synthetic stand-in is used unless
+# an input file is given.
+
+# Every combination of the options that change the output.
+def getOptionCombinations():
+    return list(itertools.product(
+        [None, actraiser_randomizer.INITIAL_LIVES___EXTRA, actraiser_randomizer.INITIAL_LIVES___UNLIMITED, actraiser_randomizer.INITIAL_LIVES___DEATHCOUNT],
+        [False, True],
+        [None, *actraiser_randomizer.MARAHNA_PATH_CHOICES],
+        [None, *actraiser_randomizer.BOSS_RUSH_TYPE_CHOICES],
+    ))
+
+
+
+# Find Node.js, for the tools that run web_engine.js.
+def requireNode(toolName):
+    nodeCommand = shutil.which("node")
+    if nodeCommand is None:
+        raise RuntimeError(f"The {toolName!r} tool requires Node.js: https://nodejs.org/")
+    return nodeCommand
+
+
+
+# Run test cases (dicts of engineGenerate arguments) through
+# web_engine_check.js, and return its results, in the same order.
+def runEngineCases(nodeCommand, romFileName, testCases):
+    completed = subprocess.run(
+        [nodeCommand, os.path.join(os.path.dirname(os.path.abspath(__file__)), "web_engine_check.js"), romFileName],
+        input = "".join(json.dumps(testCase) + "\n" for testCase in testCases),
+        capture_output = True,
+        text = True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"web_engine_check.js failed:\n{completed.stderr}")
+    engineResults = [json.loads(line) for line in completed.stdout.splitlines()]
+    if len(engineResults) != len(testCases):
+        raise RuntimeError(f"Expected {len(testCases)} results from web_engine_check.js, got {len(engineResults)}")
+    return engineResults
+
+
+
+def runEngineCheck(args):
+    nodeCommand = requireNode("enginecheck")
+
+    failureCount = 0
+    with open(actraiser_randomizer.webEngineDataFileName) as dataFile:
+        if json.load(dataFile) != json.loads(json.dumps(actraiser_randomizer.getWebEngineData())):
+            failureCount += 1
+            print("FAIL  web_engine_data.json is out of date: regenerate it with actraiser_randomizer.writeWebEngineData()")
+
+    if args.input_file:
+        with open(args.input_file, "rb") as inFile:
+            romBytes = inFile.read()
+    else:
+        romBytes = makeSyntheticROM()
+    basePatch = actraiser_randomizer.BasePatch(romBytes)
+
+    # The lowest and highest seeds, some that need more than one 32-bit
+    # word of key, and a random sample.
+    sampleRNG = random.Random(args.sample_seed)
+    seeds = [0, 1, 2**32 - 1, 2**32, 2**53 - 1, -12345]
+    seeds.extend(sampleRNG.randrange(2**32) for _ in range(args.sample_size))
+
+    with tempfile.TemporaryDirectory() as directory:
+        romFileName = os.path.join(directory, "input.sfc")
+        with open(romFileName, "wb") as romFile:
+            romFile.write(romBytes)
+
+        testCases = []
+        for seed in seeds:
+            for initialLives, zantetsuken, marahnaPath, bossRushType in getOptionCombinations():
+                for outputFormat in actraiser_randomizer.OUTPUT_FORMAT_CHOICES:
+                    testCases.append({
+                        "isRaceSeed": False,
+                        "seed": seed,
+                        "initialLives": initialLives,
+                        "zantetsuken": zantetsuken,
+                        "marahnaPath": marahnaPath,
+                        "bossRushType": bossRushType,
+                        "outputFormat": outputFormat,
+                        "outputFile": None,
+                    })
+        for raceIndex, (initialLives, zantetsuken, marahnaPath, bossRushType) in enumerate(getOptionCombinations()):
+            testCases.append({
+                "isRaceSeed": True,
+                "seed": None,
+                "initialLives": initialLives,
+                "zantetsuken": zantetsuken,
+                "marahnaPath": marahnaPath,
+                "bossRushType": bossRushType,
+                "outputFormat": actraiser_randomizer.OUTPUT_FORMAT___SFC,
+                "outputFile": os.path.join(directory, f"race_{raceIndex}.sfc"),
+            })
+
+        startTime = time.perf_counter()
+        engineResults = runEngineCases(nodeCommand, romFileName, testCases)
+        engineTime = time.perf_counter() - startTime
+
+        startTime = time.perf_counter()
+        for testCase, engineResult in zip(testCases, engineResults):
+            problems = []
+            if "error" in engineResult:
+                problems.append(engineResult["error"])
+            elif testCase["isRaceSeed"]:
+                with open(testCase["outputFile"], "rb") as raceFile:
+                    result = actraiser_randomizer.verifyROM(raceFile.read())
+                problems.extend(result.problems)
+                if result.seed is not None or result.hashString != engineResult["hash"]:
+                    problems.append(f"Not the race seed that was generated: {result.seed!r}, {result.hashString!r}")
+            else:
+                (
+                    outputBytes,
+                    mapNumbers,
+                    chosenMarahnaPath,
+                    chosenBossRushType,
+                ) = actraiser_randomizer.generate(
+                    basePatch,
+                    False,
+                    testCase["seed"],
+                    testCase["initialLives"],
+                    testCase["zantetsuken"],
+                    testCase["marahnaPath"],
+                    testCase["bossRushType"],
+                    testCase["outputFormat"],
+                )
+                expected = {
+                    "flags": actraiser_randomizer.getFlagString(
+                        testCase["initialLives"],
+                        testCase["zantetsuken"],
+                        testCase["marahnaPath"],
+                        testCase["bossRushType"],
+                    ),
+                    "hash": actraiser_randomizer.getHashString(mapNumbers),
+                    "marahnaPath": chosenMarahnaPath,
+                    "bossRushType": chosenBossRushType,
+                    "maps": mapNumbers,
+                    "sha256": hashlib.sha256(outputBytes).hexdigest(),
+                }
+                for key, value in expected.items():
+                    if engineResult[key] != value:
+                        problems.append(f"{key}: {engineResult[key]!r} # Expected: {value!r}")
+            if problems:
+                failureCount += 1
+                seedLabel = "(race seed)" if testCase["isRaceSeed"] else testCase["seed"]
+                print(f"FAIL  Seed: {seedLabel}  Options: {testCase['initialLives']}, {testCase['zantetsuken']}, {testCase['marahnaPath']}, {testCase['bossRushType']}  Format: {testCase['outputFormat']}")
+                for problem in problems:
+                    print(f"      {problem}")
+        pythonTime = time.perf_counter() - startTime
+
+    print(f"Checked {len(testCases)} case(s): {failureCount} failed", file=sys.stderr)
+    print(f"Time: {engineTime:.2f}s (web_engine.js), {pythonTime:.2f}s (actraiser_randomizer.py)", file=sys.stderr)
+    if failureCount:
+        sys.exit(1)
+
+
+
+# Golden corpus
+# A record of what the randomizer generates for many seeds, so that a change
+# to the randomizer (or another implementation of it, like web_engine.js)
+# can be checked for changing the output of seeds that are already in use.
+# For each seed, and each of the 72 flag strings that getFlagString can
+# return, the corpus holds:
+# - The map order and hash. (These only depend on the "L", "R", "C" and "S"
+#   flags, so they're stored once for each of the 9 combinations of those.)
+# - A digest of the IPS patch: the first 4 bytes of its SHA-256. The patch
+#   is made for a synthetic stand-in ROM (see actraiser_synthetic_rom.py),
+#   so no real ROM is needed to build or check the corpus.
+# The file (golden_corpus.bin) is columnar: a header, then one column per
+# field, each one zlib-compressed. The header is "ARGC", then the header
+# size (32-bit little-endian), then the header itself, which is JSON:
+#   randomizerVersion, flagStrings (the 72), shuffleFlagStrings (the 9),
+#   mapNumbers (every map that can be shuffled, in order: the maps column
+#   stores indexes into this), mapCount, seedCount, and columns (the name,
+#   offset from the end of the header, and size of each column).
+# Columns, in seed order:
+# - seeds: 32-bit little-endian seed values
+# - maps: For each seed and shuffleFlagString, mapCount 8-bit map indexes
+# - hashes: For each seed and shuffleFlagString, the hash as a 32-bit
+#   little-endian integer
+# - patchDigests: For each seed and flagString, 4 bytes of SHA-256
+# The hashes and patch digests include the randomizer version (it's on the
+# title screen), so if the version has changed, only the map orders are
+# checked. Build a new corpus for each release.
+goldenCorpusFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden_corpus.bin")
+goldenCorpusColumnNames = ["seeds", "maps", "hashes", "patchDigests"]
+goldenCorpusDigestSize = 4
+
+def getCorpusFlagStrings():
+    return [actraiser_randomizer.getFlagString(*options) for options in getOptionCombinations()]
+
+def getCorpusShuffleFlagStrings():
+    return [
+        actraiser_randomizer.getFlagString(None, False, marahnaPath, bossRushType)
+        for marahnaPath in [None, *actraiser_randomizer.MARAHNA_PATH_CHOICES]
+        for bossRushType in [None, *actraiser_randomizer.BOSS_RUSH_TYPE_CHOICES]
+    ]
+
+def getCorpusMapNumbers():
+    return sorted(set([
+        *actraiser_randomizer.getUnshuffledMapNumbers(actraiser_randomizer.MARAHNA_PATH___LEFT),
+        *actraiser_randomizer.getUnshuffledMapNumbers(actraiser_randomizer.MARAHNA_PATH___RIGHT),
+        *actraiser_randomizer.getUnshuffledBossRush(),
+        0x701,
+    ]) - {actraiser_randomizer.BOSS_RUSH_PLACEHOLDER})
+
+
+
+# Turn the generated seeds for one seed value into corpus rows.
+# results maps each flag string to (mapNumbers, hashString, the SHA-256
+# digest of the IPS patch).
+def getCorpusRows(results, mapIndexes):
+    maps = bytearray()
+    hashes = []
+    for flagString in getCorpusShuffleFlagStrings():
+        mapNumbers, hashString, _ = results[flagString]
+        maps += bytes(mapIndexes[x] for x in mapNumbers)
+        hashes.append(int(hashString, 16))
+    patchDigests = b"".join(
+        results[flagString][2][:goldenCorpusDigestSize]
+        for flagString in getCorpusFlagStrings()
+    )
+    return bytes(maps), hashes, patchDigests
+
+# Each worker process builds the synthetic ROM's BasePatch once.
+corpusBasePatch = None
+
+def corpusInit():
+    global corpusBasePatch
+    corpusBasePatch = actraiser_randomizer.BasePatch(makeSyntheticROM())
+
+# Returns the corpus rows for a chunk of seeds, as a list of (maps, hashes,
+# patchDigests) for each seed.
+def corpusTask(seeds):
+    mapIndexes = {x: i for i, x in enumerate(getCorpusMapNumbers())}
+    chunkRows = []
+    for seed in seeds:
+        results = {}
+        for flagString in getCorpusFlagStrings():
+            ipsBytes, mapNumbers, _, _ = actraiser_randomizer.generate(
+                corpusBasePatch,
+                False,
+                seed,
+                *actraiser_randomizer.parseFlagString(flagString),
+                actraiser_randomizer.OUTPUT_FORMAT___IPS,
+            )
+            results[flagString] = (
+                mapNumbers,
+                actraiser_randomizer.getHashString(mapNumbers),
+                hashlib.sha256(ipsBytes).digest(),
+            )
+        chunkRows.append(getCorpusRows(results, mapIndexes))
+    return chunkRows
+
+# Run corpusTask for chunks of seeds in a pool of worker processes.
+# Yields the rows for each seed, in seed order.
+def runCorpusTasks(seeds, workers=None, chunkSize=64):
+    chunks = [seeds[i:i+chunkSize] for i in range(0, len(seeds), chunkSize)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=corpusInit) as executor:
+        for chunkRows in executor.map(corpusTask, chunks):
+            yield from chunkRows
+
+
+
+# Choose the corpus's seeds: the lowest and highest seeds, and a sample of
+# the rest, chosen with a fixed seed, so a rebuilt corpus has the same seeds.
+def getCorpusSeeds(seedCount):
+    sampleRNG = random.Random(0)
+    seeds = [0, 1, 2, 2**32 - 2, 2**32 - 1]
+    while len(seeds) < seedCount:
+        seeds.append(sampleRNG.randrange(2**32))
+    return seeds[:seedCount]
+
+def buildCorpus(fileName, seedCount, workers=None):
+    seeds = getCorpusSeeds(seedCount)
+    maps = bytearray()
+    hashes = []
+    patchDigests = bytearray()
+    for seedMaps, seedHashes, seedPatchDigests in runCorpusTasks(seeds, workers):
+        maps += seedMaps
+        hashes.extend(seedHashes)
+        patchDigests += seedPatchDigests
+
+    columnData = [
+        struct.pack(f"<{len(seeds)}I", *seeds),
+        bytes(maps),
+        struct.pack(f"<{len(hashes)}I", *hashes),
+        bytes(patchDigests),
+    ]
+    columns = []
+    compressedData = []
+    columnOffset = 0
+    for columnName, data in zip(goldenCorpusColumnNames, columnData):
+        compressed = zlib.compress(data, 9)
+        columns.append({"name": columnName, "offset": columnOffset, "size": len(compressed)})
+        compressedData.append(compressed)
+        columnOffset += len(compressed)
+
+    header = json.dumps({
+        "randomizerVersion": actraiser_randomizer.randomizerVersion,
+        "flagStrings": getCorpusFlagStrings(),
+        "shuffleFlagStrings": getCorpusShuffleFlagStrings(),
+        "mapNumbers": getCorpusMapNumbers(),
+        "mapCount": len(maps) // len(seeds) // len(getCorpusShuffleFlagStrings()),
+        "seedCount": len(seeds),
+        "columns": columns,
+    }, separators=(",", ":")).encode()
+    with open(fileName, "wb") as corpusFile:
+        corpusFile.write(b"ARGC")
+        corpusFile.write(struct.pack("<I", len(header)))
+        corpusFile.write(header)
+        for data in compressedData:
+            corpusFile.write(data)
+
+# Read a corpus file. Returns the header, and a dict of decompressed columns.
+def readCorpus(fileName):
+    with open(fileName, "rb") as corpusFile:
+        corpusBytes = corpusFile.read()
+    if corpusBytes[:4] != b"ARGC":
+        raise ValueError(f"Not a golden corpus file: {fileName!r}")
+    (headerSize,) = struct.unpack_from("<I", corpusBytes, 4)
+    header = json.loads(corpusBytes[8:8+headerSize])
+    columnsStart = 8 + headerSize
+    columnData = {}
+    for column in header["columns"]:
+        columnStart = columnsStart + column["offset"]
+        columnData[column["name"]] = zlib.decompress(corpusBytes[columnStart:columnStart+column["size"]])
+    return header, columnData
+
+
+
+# Compare the rows for one seed with the corpus's.
+# Returns a list of problems.
+def checkCorpusRows(header, columnData, seedIndex, maps, hashes, patchDigests, checkVersioned):
+    problems = []
+    shuffleCount = len(header["shuffleFlagStrings"])
+    mapCount = header["mapCount"]
+    seedMaps = columnData["maps"][seedIndex*shuffleCount*mapCount:(seedIndex+1)*shuffleCount*mapCount]
+    seedHashes = struct.unpack_from(f"<{shuffleCount}I", columnData["hashes"], seedIndex*shuffleCount*4)
+    for i, flagString in enumerate(header["shuffleFlagStrings"]):
+        expectedMaps = seedMaps[i*mapCount:(i+1)*mapCount]
+        if maps[i*mapCount:(i+1)*mapCount] != expectedMaps:
+            expectedMapNumbers = [header["mapNumbers"][x] for x in expectedMaps]
+            problems.append(f"Flags: {flagString or '-'}  Map order differs # Expected: {' '.join(f'{x:03X}' for x in expectedMapNumbers)}")
+        elif checkVersioned and hashes[i] != seedHashes[i]:
+            problems.append(f"Flags: {flagString or '-'}  Hash: {hashes[i]:08X} # Expected: {seedHashes[i]:08X}")
+    if checkVersioned:
+        digestSize = goldenCorpusDigestSize
+        flagCount = len(header["flagStrings"])
+        seedPatchDigests = columnData["patchDigests"][seedIndex*flagCount*digestSize:(seedIndex+1)*flagCount*digestSize]
+        for i, flagString in enumerate(header["flagStrings"]):
+            patchDigest = patchDigests[i*digestSize:(i+1)*digestSize]
+            expectedPatchDigest = seedPatchDigests[i*digestSize:(i+1)*digestSize]
+            if patchDigest != expectedPatchDigest:
+                problems.append(f"Flags: {flagString or '-'}  Patch digest: {patchDigest.hex()} # Expected: {expectedPatchDigest.hex()}")
+    return problems
+
+# Generate the corpus's seeds with web_engine.js instead of the randomizer,
+# using several Node.js processes at once. Yields the rows for each seed,
+# in seed order, as runCorpusTasks does.
+def runCorpusEngineTasks(seeds, workers=None, chunkSize=64):
+    nodeCommand = requireNode("corpus")
+    mapIndexes = {x: i for i, x in enumerate(getCorpusMapNumbers())}
+    flagStrings = getCorpusFlagStrings()
+
+    with tempfile.TemporaryDirectory() as directory:
+        romFileName = os.path.join(directory, "input.sfc")
+        with open(romFileName, "wb") as romFile:
+            romFile.write(makeSyntheticROM())
+
+        def engineTask(chunk):
+            testCases = []
+            for seed in chunk:
+                for flagString in flagStrings:
+                    initialLives, zantetsuken, marahnaPath, bossRushType = actraiser_randomizer.parseFlagString(flagString)
+                    testCases.append({
+                        "isRaceSeed": False,
+                        "seed": seed,
+                        "initialLives": initialLives,
+                        "zantetsuken": zantetsuken,
+                        "marahnaPath": marahnaPath,
+                        "bossRushType": bossRushType,
+                        "outputFormat": actraiser_randomizer.OUTPUT_FORMAT___IPS,
+                        "outputFile": None,
+                    })
+            engineResults = iter(runEngineCases(nodeCommand, romFileName, testCases))
+            chunkRows = []
+            for seed in chunk:
+                results = {}
+                for flagString in flagStrings:
+                    engineResult = next(engineResults)
+                    if "error" in engineResult:
+                        raise RuntimeError(f"Seed {seed}, flags {flagString or '-'}: {engineResult['error']}")
+                    results[flagString] = (engineResult["maps"], engineResult["hash"], bytes.fromhex(engineResult["sha256"]))
+                chunkRows.append(getCorpusRows(results, mapIndexes))
+            return chunkRows
+
+        chunks = [seeds[i:i+chunkSize] for i in range(0, len(seeds), chunkSize)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            for chunkRows in executor.map(engineTask, chunks):
+                yield from chunkRows
+
+def runCorpusBuild(args):
+    startTime = time.perf_counter()
+    buildCorpus(args.corpus_file, args.seed_count, args.workers)
+    print(f"Wrote {args.corpus_file!r}: {args.seed_count} seeds x {len(getCorpusFlagStrings())} flag strings, {os.path.getsize(args.corpus_file)} bytes", file=sys.stderr)
+    print(f"Time: {time.perf_counter() - startTime:.2f}s", file=sys.stderr)
+
+def runCorpusCheck(args):
+    header, columnData = readCorpus(args.corpus_file)
+    if header["flagStrings"] != getCorpusFlagStrings() or header["mapNumbers"] != getCorpusMapNumbers():
+        sys.exit("Error: The corpus's flag strings or map numbers don't match the randomizer's")
+    checkVersioned = (header["randomizerVersion"] == actraiser_randomizer.randomizerVersion)
+    if not checkVersioned:
+        print(f"Note: The corpus is for version {header['randomizerVersion']!r}, not {actraiser_randomizer.randomizerVersion!r}, so only the map orders are checked", file=sys.stderr)
+
+    seeds = list(struct.unpack(f"<{header['seedCount']}I", columnData["seeds"]))
+    startTime = time.perf_counter()
+    if args.engine:
+        seedRows = runCorpusEngineTasks(seeds, args.workers)
+    else:
+        seedRows = runCorpusTasks(seeds, args.workers)
+
+    failureCount = 0
+    for seedIndex, (seed, (maps, hashes, patchDigests)) in enumerate(zip(seeds, seedRows)):
+        problems = checkCorpusRows(header, columnData, seedIndex, maps, hashes, patchDigests, checkVersioned)
+        if problems:
+            failureCount += 1
+            print(f"FAIL  Seed: {seed}")
+            for problem in problems:
+                print(f"      {problem}")
+
+    implementation = "web_engine.js" if args.engine else "actraiser_randomizer.py"
+    print(f"Checked {len(seeds)} seeds x {len(header['flagStrings'])} flag strings ({implementation}): {failureCount} seeds failed", file=sys.stderr)
+    print(f"Time: {time.perf_counter() - startTime:.2f}s", file=sys.stderr)
+    if failureCount:
+        sys.exit(1)
+
+
+
+# Generation server
+# A small HTTP server that generates seeds on request, so that other
+# programs (e.g. chat bots) don't have to start the randomizer each time.
+# The input ROM is read and checked once, when the server starts. Each worker
+# process builds its BasePatch once, and then only does the per-seed work.
+#
+# Requests:
+# - GET /version: Returns {"randomizerVersion": ...} as JSON.
+# - POST /generate: Takes a JSON object with any of these fields:
+#     seed (integer; random if not given), race (true/false),
+#     initialLives ("extra", "unlimited", "deathcount"), zantetsuken
+#     (true/false), marahnaPath ("left", "right"), bossRushType
+#     ("consecutive", "scattered"), format ("sfc", "ips", "bps")
+#   Returns the ROM or patch, with the seed details in the X-Randomizer-*
+#   headers. (For race seeds, the seed isn't included.)
+# Errors are returned as JSON: {"error": "..."}
+# Each connection handles one request. Requests are handled concurrently, up
+# to the number of workers; any more wait for a worker to be free.
+
+SERVE_MAX_REQUEST_SIZE = 65536
+SERVE_CHUNK_SIZE = 65536
+
+SERVE_OPTION_CHOICES = {
+    "initialLives": [
+        None,
+        actraiser_randomizer.INITIAL_LIVES___EXTRA,
+        actraiser_randomizer.INITIAL_LIVES___UNLIMITED,
+        actraiser_randomizer.INITIAL_LIVES___DEATHCOUNT,
+    ],
+    "marahnaPath": [None, *actraiser_randomizer.MARAHNA_PATH_CHOICES],
+    "bossRushType": [None, *actraiser_randomizer.BOSS_RUSH_TYPE_CHOICES],
+    "format": [None, *actraiser_randomizer.OUTPUT_FORMAT_CHOICES],
+}
+
+class ServeError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def getServeErrorResponse(status, message):
+    headers = {"Content-Type": "application/json"}
+    responseBytes = (json.dumps({"error": message}) + "\n").encode()
+    return status, headers, responseBytes
+
+# Runs in a worker process, after actraiser_randomizer.generateManyInit.
+def serveTask(isRaceSeed, seed, initialLives, zantetsuken, marahnaPath, bossRushType, outputFormat):
+    (
+        romByteArray,
+        mapNumbers,
+        chosenMarahnaPath,
+        chosenBossRushType,
+    ) = actraiser_randomizer.generate(
+        actraiser_randomizer.generateManyBasePatch,
+        isRaceSeed,
+        seed,
+        initialLives,
+        zantetsuken,
+        marahnaPath,
+        bossRushType,
+        outputFormat,
+        actraiser_randomizer.generateManyCache,
+    )
+    return bytes(romByteArray), actraiser_randomizer.getHashString(mapNumbers)
+
+# Check a generation request, and turn it into arguments for serveTask.
+def getServeTaskArguments(request):
+    if not isinstance(request, dict):
+        raise ServeError(400, "Request must be a JSON object")
+    unknownFields = set(request) - {"seed", "race", *SERVE_OPTION_CHOICES, "zantetsuken"}
+    if unknownFields:
+        raise ServeError(400, f"Unknown fields: {', '.join(sorted(unknownFields))}")
+    for field, choices in SERVE_OPTION_CHOICES.items():
+        if request.get(field) not in choices:
+            raise ServeError(400, f"Unexpected {field} value: {request[field]!r}")
+    for field in ["race", "zantetsuken"]:
+        if not isinstance(request.get(field, False), bool):
+            raise ServeError(400, f"Unexpected {field} value: {request[field]!r}")
+
+    isRaceSeed = request.get("race", False)
+    seed = request.get("seed")
+    if seed is not None and isRaceSeed:
+        raise ServeError(400, "You cannot specify a seed for a race seed")
+    if seed is not None and type(seed) is not int:
+        raise ServeError(400, f"Unexpected seed value: {seed!r}")
+    if seed is None:
+        seed = random.getrandbits(32)
+    return (
+        isRaceSeed,
+        seed % 2**32,
+        request.get("initialLives"),
+        request.get("zantetsuken", False),
+        request.get("marahnaPath"),
+        request.get("bossRushType"),
+        request.get("format") or actraiser_randomizer.OUTPUT_FORMAT___SFC,
+    )
+
+class GenerationServer:
+    def __init__(self, romBytes, inFileName, workers=None, cacheDirectory=None, cacheSize=256 * 1024 * 1024):
+        actraiser_randomizer.validateROM(romBytes, f"Input file {inFileName!r}")
+        self.inFileName = os.path.basename(inFileName)
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers = self.workers,
+            initializer = actraiser_randomizer.generateManyInit,
+            initargs = (romBytes, cacheDirectory, cacheSize),
+        )
+        self.semaphore = asyncio.Semaphore(self.workers)
+
+    async def handleConnection(self, reader, writer):
+        try:
+            try:
+                method, path, body = await self.readRequest(reader)
+                status, headers, responseBytes = await self.handleRequest(method, path, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                raise
+            except ServeError as e:
+                status, headers, responseBytes = getServeErrorResponse(e.status, str(e))
+            except Exception:
+                # Anything else is a bug (or a broken worker). Log it, and
+                # still send the client an answer.
+                print(f"Error handling request from {writer.get_extra_info('peername')}:", file=sys.stderr)
+                traceback.print_exc()
+                status, headers, responseBytes = getServeErrorResponse(500, "Internal server error")
+            await self.writeResponse(writer, status, headers, responseBytes)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def readRequest(self, reader):
+        try:
+            headerBytes = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise ServeError(431, "Request headers too large") from None
+        requestLine, *headerLines = headerBytes.decode("latin-1").split("\r\n")
+        try:
+            method, path, version = requestLine.split(" ")
+        except ValueError:
+            raise ServeError(400, "Malformed request line") from None
+        headers = {}
+        for line in headerLines:
+            name, colon, value = line.partition(":")
+            if colon:
+                headers[name.strip().lower()] = value.strip()
+        try:
+            contentLength = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise ServeError(400, "Malformed Content-Length") from None
+        if not 0 <= contentLength <= SERVE_MAX_REQUEST_SIZE:
+            raise ServeError(413, "Request too large")
+        body = await reader.readexactly(contentLength)
+        return method, path, body
+
+    async def handleRequest(self, method, path, body):
+        if path == "/version" and method == "GET":
+            responseBytes = json.dumps({"randomizerVersion": actraiser_randomizer.randomizerVersion}).encode()
+            return 200, {"Content-Type": "application/json"}, responseBytes
+        if path != "/generate":
+            raise ServeError(404, f"Not found: {path}")
+        if method != "POST":
+            raise ServeError(405, f"Method not allowed: {method}")
+
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError as e:
+            raise ServeError(400, f"Malformed JSON: {e}") from None
+        taskArguments = getServeTaskArguments(request)
+        isRaceSeed, seed, initialLives, zantetsuken, marahnaPath, bossRushType, outputFormat = taskArguments
+
+        async with self.semaphore:
+            outputBytes, hashString = await asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                serveTask,
+                *taskArguments,
+            )
+
+        flagString = actraiser_randomizer.getFlagString(initialLives, zantetsuken, marahnaPath, bossRushType)
+        outFileName = actraiser_randomizer.getOutputFileName(
+            self.inFileName,
+            isRaceSeed,
+            seed,
+            flagString,
+            hashString,
+            None if outputFormat == actraiser_randomizer.OUTPUT_FORMAT___SFC else outputFormat,
+        )
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "Content-Disposition": f"attachment; filename=\"{outFileName}\"",
+            "X-Randomizer-Version": actraiser_randomizer.randomizerVersion,
+            "X-Randomizer-Flags": flagString or "-",
+            "X-Randomizer-Hash": hashString,
+        }
+        if not isRaceSeed:
+            headers["X-Randomizer-Seed"] = str(seed)
+        return 200, headers, outputBytes
+
+    async def writeResponse(self, writer, status, headers, responseBytes):
+        reason = http.HTTPStatus(status).phrase
+        headerLines = [
+            f"HTTP/1.1 {status} {reason}",
+            *[f"{name}: {value}" for name, value in headers.items()],
+            f"Content-Length: {len(responseBytes)}",
+            "Connection: close",
+            "",
+            "",
+        ]
+        writer.write("\r\n".join(headerLines).encode("latin-1"))
+        # Send the body a piece at a time, so a slow client doesn't make
+        # the server buffer the whole response.
+        responseView = memoryview(responseBytes)
+        for offset in range(0, len(responseView), SERVE_CHUNK_SIZE):
+            writer.write(responseView[offset:offset+SERVE_CHUNK_SIZE])
+            await writer.drain()
+        await writer.drain()
+
+    async def serve(self, host, port, unixSocket):
+        if unixSocket is not None:
+            server = await asyncio.start_unix_server(self.handleConnection, unixSocket)
+        else:
+            server = await asyncio.start_server(self.handleConnection, host, port)
+        addresses = ", ".join(str(x.getsockname()) for x in server.sockets)
+        print(f"Serving on {addresses} with {self.workers} worker(s)", file=sys.stderr)
+        with self.executor:
+            async with server:
+                await server.serve_forever()
+
+def runServe(args):
+    with open(args.input_file, "rb") as inFile:
+        romBytes = inFile.read()
+    generationServer = GenerationServer(
+        romBytes,
+        args.input_file,
+        workers = args.workers,
+        cacheDirectory = args.cache_dir,
+        cacheSize = args.cache_size * 1024 * 1024,
+    )
+    try:
+        asyncio.run(generationServer.serve(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description = "ActRaiser Randomizer for Professional Mode: Tools",
+    )
+    subparsers = parser.add_subparsers(dest="tool", required=True)
+
+    seedStatsParser = subparsers.add_parser(
+        "seedstats",
+        help = "count where maps and the boss rush land, over many seeds",
+    )
+    seedStatsParser.add_argument(
+        "--seeds",
+        type = str,
+        default = "0-999999",
+        help = "seed values and inclusive ranges, e.g. \"0-999999\" (the default)",
+    )
+    addShuffleArguments(seedStatsParser)
+    seedStatsParser.add_argument(
+        "-j", "--workers",
+        type = int,
+        help = "number of worker processes (default: one per CPU)",
+    )
+    seedStatsParser.add_argument(
+        "--format",
+        choices = ["json", "csv"],
+        default = "json",
+        help = "report format (default: json)",
+    )
+    seedStatsParser.add_argument(
+        "-o", "--output-file",
+        type = str,
+        help = "write the report to this file instead of standard output",
+    )
+    seedStatsParser.set_defaults(function=runSeedStats)
+
+    hashIndexParser = subparsers.add_parser(
+        "hashindex",
+        help = "find seeds from the hash shown on the title screen",
+    )
+    hashIndexSubparsers = hashIndexParser.add_subparsers(dest="action", required=True)
+
+    hashIndexBuildParser = hashIndexSubparsers.add_parser(
+        "build",
+        help = "build (or resume building) an index",
+    )
+    hashIndexBuildParser.add_argument(
+        "index_directory",
+        type = str,
+        help = "directory for the index",
+    )
+    hashIndexBuildParser.add_argument(
+        "--seeds",
+        type = str,
+        default = "0-4294967295",
+        help = "seed values and inclusive ranges to index (default: all of them)",
+    )
+    addShuffleArguments(hashIndexBuildParser)
+    hashIndexBuildParser.add_argument(
+        "-j", "--workers",
+        type = int,
+        help = "number of worker processes (default: one per CPU)",
+    )
+    hashIndexBuildParser.add_argument(
+        "--chunk-size",
+        type = int,
+        default = 1000000,
+        help = "seeds per chunk file (default: 1000000)",
+    )
+    hashIndexBuildParser.set_defaults(function=runHashIndexBuild)
+
+    hashIndexLookupParser = hashIndexSubparsers.add_parser(
+        "lookup",
+        help = "look up seeds in an index",
+    )
+    hashIndexLookupParser.add_argument(
+        "index_directory",
+        type = str,
+        help = "directory of the index",
+    )
+    hashIndexLookupParser.add_argument(
+        "hash_strings",
+        type = str,
+        nargs = "+",
+        metavar = "hash_string",
+        help = "8-digit hash string(s) from the title screen",
+    )
+    hashIndexLookupParser.set_defaults(function=runHashIndexLookup)
+
+    verifyParser = subparsers.add_parser(
+        "verify",
+        help = "check that randomized ROMs are the seeds their title screens say",
+    )
+    verifyParser.add_argument(
+        "input_files",
+        metavar = "input-file",
+        nargs = "+",
+        help = "randomized ROM file names",
+    )
+    verifyParser.add_argument(
+        "-s", "--seed",
+        type = int,
+        help = "also check that each ROM is this seed",
+    )
+    verifyParser.add_argument(
+        "--flags",
+        type = str,
+        help = "also check that each ROM has these flags, e.g. \"EZ\" (use \"\" for none)",
+    )
+    verifyParser.add_argument(
+        "-q", "--quiet",
+        action = "store_true",
+        help = "only print the ROMs that fail",
+    )
+    verifyParser.set_defaults(function=runVerify)
+
+    engineCheckParser = subparsers.add_parser(
+        "enginecheck",
+        help = "check that the web interface's JavaScript engine gives the same output as the randomizer",
+    )
+    engineCheckParser.add_argument(
+        "input_file",
+        metavar = "input-file",
+        nargs = "?",
+        help = "an 'ActRaiser (USA)' ROM to use (default: a synthetic stand-in)",
+    )
+    engineCheckParser.add_argument(
+        "--sample-size",
+        type = int,
+        default = 20,
+        help = "number of random seeds to check, as well as a few fixed ones (default: 20)",
+    )
+    engineCheckParser.add_argument(
+        "--sample-seed",
+        type = int,
+        help = "seed for choosing the random sample (default: a different sample each time)",
+    )
+    engineCheckParser.set_defaults(function=runEngineCheck)
+
+    corpusParser = subparsers.add_parser(
+        "corpus",
+        help = "check that seeds still generate the same output, against a golden corpus",
+    )
+    corpusSubparsers = corpusParser.add_subparsers(dest="action", required=True)
+
+    corpusBuildParser = corpusSubparsers.add_parser(
+        "build",
+        help = "build a corpus from the current randomizer",
+    )
+    corpusBuildParser.add_argument(
+        "--corpus-file",
+        type = str,
+        default = goldenCorpusFileName,
+        help = "corpus file name (default: golden_corpus.bin)",
+    )
+    corpusBuildParser.add_argument(
+        "--seed-count",
+        type = int,
+        default = 512,
+        help = "number of seeds (default: 512)",
+    )
+    corpusBuildParser.add_argument(
+        "-j", "--workers",
+        type = int,
+        help = "number of worker processes (default: one per CPU)",
+    )
+    corpusBuildParser.set_defaults(function=runCorpusBuild)
+
+    corpusCheckParser = corpusSubparsers.add_parser(
+        "check",
+        help = "check the randomizer (or web_engine.js) against a corpus",
+    )
+    corpusCheckParser.add_argument(
+        "--corpus-file",
+        type = str,
+        default = goldenCorpusFileName,
+        help = "corpus file name (default: golden_corpus.bin)",
+    )
+    corpusCheckParser.add_argument(
+        "--engine",
+        action = "store_true",
+        help = "check web_engine.js (using Node.js) instead of the randomizer",
+    )
+    corpusCheckParser.add_argument(
+        "-j", "--workers",
+        type = int,
+        help = "number of worker processes (default: one per CPU)",
+    )
+    corpusCheckParser.set_defaults(function=runCorpusCheck)
+
+    serveParser = subparsers.add_parser(
+        "serve",
+        help = "run an HTTP server that generates seeds on request",
+    )
+    serveParser.add_argument(
+        "input_file",
+        metavar = "input-file",
+        help = "input file name: an 'ActRaiser (USA)' ROM",
+    )
+    serveParser.add_argument(
+        "--host",
+        type = str,
+        default = "127.0.0.1",
+        help = "address to listen on (default: 127.0.0.1)",
+    )
+    serveParser.add_argument(
+        "--port",
+        type = int,
+        default = 8080,
+        help = "port to listen on (default: 8080)",
+    )
+    serveParser.add_argument(
+        "--unix-socket",
+        type = str,
+        help = "listen on this Unix socket instead of a TCP port",
+    )
+    serveParser.add_argument(
+        "-j", "--workers",
+        type = int,
+        help = "number of worker processes (default: one per CPU)",
+    )
+    serveParser.add_argument(
+        "--cache-dir",
+        type = str,
+        help = "keep generated seeds in this directory, and reuse them",
+    )
+    serveParser.add_argument(
+        "--cache-size",
+        type = int,
+        default = 256,
+        help = "maximum size of the cache, in MiB (default: 256)",
+    )
+    serveParser.set_defaults(function=runServe)
+
+    args = parser.parse_args()
+    args.function(args)
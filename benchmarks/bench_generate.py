@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# ActRaiser Randomizer: Generation benchmark
+#
+# Measures the parts of generating a seed, and the whole thing:
+# - randomize(), for each Marahna II path and boss rush type option
+#   (the other options don't affect it)
+# - getHashString()
+# - BasePatch(): The seed-independent ROM changes, done once per input ROM
+# - modifyROM() and overlayROM(), with and without a prepared BasePatch
+# - generate(), for each output format, with a prepared BasePatch
+#   (as in batch generation) and without one (as in a single CLI run)
+#
+# The ROM is a synthetic stand-in (see actraiser_synthetic_rom.py),
+# so no real ROM is needed.
+#
+# Results are printed as JSON, and can optionally be written to a file.
+# Use compare.py to compare the results from two runs.
+
+import argparse
+import timeit
+
+from benchutil import actraiser_randomizer, makeSyntheticROM, summarize, writeReport
+
+
+
+# Time a function, returning the summary of the time per call.
+# Each sample is the average over enough calls to take about 0.05 seconds.
+def timeFunction(function, repeat):
+    timer = timeit.Timer(function)
+    numberOfCalls, _ = timer.autorange()
+    numberOfCalls = max(1, numberOfCalls // 4)
+    samples = timer.repeat(repeat=repeat, number=numberOfCalls)
+    return summarize([x / numberOfCalls * 1e9 for x in samples])
+
+
+
+def runBenchmarks(repeat):
+    results = {}
+    romBytes = makeSyntheticROM()
+    seed = 3816547290
+
+    for marahnaPath in [None, *actraiser_randomizer.MARAHNA_PATH_CHOICES]:
+        for bossRushType in [None, *actraiser_randomizer.BOSS_RUSH_TYPE_CHOICES]:
+            flagString = actraiser_randomizer.getFlagString(None, False, marahnaPath, bossRushType)
+            results[f"randomize_{flagString or 'noflags'}"] = timeFunction(
+                lambda: actraiser_randomizer.randomize(seed, marahnaPath, bossRushType),
+                repeat,
+            )
+
+    mapNumbers = actraiser_randomizer.randomize(seed, None, None)[0]
+    results["getHashString"] = timeFunction(lambda: actraiser_randomizer.getHashString(mapNumbers), repeat)
+
+    # BasePatch: Don't let it keep its patched image between runs.
+    results["BasePatch"] = timeFunction(lambda: actraiser_randomizer.BasePatch(romBytes), repeat)
+    basePatch = actraiser_randomizer.BasePatch(romBytes)
+    basePatch.romBytes
+
+    titleString = f"{seed} -EZ"
+    seedOptions = (titleString, mapNumbers, actraiser_randomizer.INITIAL_LIVES___EXTRA, True)
+    results["modifyROM_cold"] = timeFunction(lambda: actraiser_randomizer.modifyROM(romBytes, *seedOptions), repeat)
+    results["modifyROM_warm"] = timeFunction(lambda: actraiser_randomizer.modifyROM(basePatch, *seedOptions), repeat)
+    results["overlayROM_warm"] = timeFunction(lambda: actraiser_randomizer.overlayROM(basePatch, *seedOptions), repeat)
+
+    for outputFormat in actraiser_randomizer.OUTPUT_FORMAT_CHOICES:
+        for name, source in [("cold", romBytes), ("warm", basePatch)]:
+            results[f"generate_{outputFormat}_{name}"] = timeFunction(
+                lambda: actraiser_randomizer.generate(
+                    source,
+                    False,
+                    seed,
+                    actraiser_randomizer.INITIAL_LIVES___EXTRA,
+                    True,
+                    None,
+                    None,
+                    outputFormat,
+                ),
+                repeat,
+            )
+
+    return results
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ActRaiser Randomizer: Generation benchmark")
+    parser.add_argument(
+        "-n", "--repeat",
+        type = int,
+        default = 20,
+        help = "number of samples per measurement (default: 20)",
+    )
+    parser.add_argument(
+        "-o", "--output-file",
+        type = str,
+        help = "also write the results to this JSON file",
+    )
+    args = parser.parse_args()
+
+    writeReport("generate", runBenchmarks(args.repeat), args.output_file)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# ActRaiser Randomizer: Import-time benchmark
+#
+# Measures how long it takes to get the randomizer module ready to use:
+# - Cold import: No cached bytecode, so the source is compiled first.
+#   (This is what happens on every page load in the web interface.)
+# - Warm import: Cached bytecode is available.
+#   (This is what usually happens with the command line interface.)
+# - Running "actraiser_randomizer.py -v" from start to finish.
+# - Loading the extended map metadata (part of the import): from the binary
+#   file shipped beside the module, and by decoding the annotated source form.
+#
+# Results are printed as JSON, and can optionally be written to a file.
+# Use compare.py to compare the results from two runs.
+
+import argparse
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+from benchutil import actraiser_randomizer, repoDirectory, summarize, writeReport
+
+
+
+# Make a copy of the randomizer in a new directory, so we can control
+# whether its bytecode is cached without affecting the standard library's.
+def copyRandomizer(directory):
+    for fileName in ["actraiser_randomizer.py", "extended_map_metadata.bin"]:
+        shutil.copy(os.path.join(repoDirectory, fileName), directory)
+
+
+
+# The environment for the interpreters we start. PYTHONDONTWRITEBYTECODE is
+# removed, since with it, the "warm" import would be a cold import as well.
+# (Cold imports use "-B" instead.)
+def getEnvironment():
+    environment = dict(os.environ)
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    return environment
+
+
+
+# Time "import actraiser_randomizer" in a fresh interpreter.
+# With writeBytecode=False, cached bytecode isn't written (or, in a fresh
+# copy, used), so the source is compiled every time.
+def timeImport(directory, writeBytecode):
+    importCode = "; ".join([
+        "import time",
+        "t = time.perf_counter_ns()",
+        "import actraiser_randomizer",
+        "print(time.perf_counter_ns() - t)",
+    ])
+    completed = subprocess.run(
+        [sys.executable, *([] if writeBytecode else ["-B"]), "-c", importCode],
+        cwd = directory,
+        env = getEnvironment(),
+        capture_output = True,
+        check = True,
+        text = True,
+    )
+    return int(completed.stdout)
+
+
+
+# Time a whole command line run in a fresh interpreter.
+def timeCommand(directory, arguments):
+    startTime = time.perf_counter_ns()
+    subprocess.run(
+        [sys.executable, os.path.join(directory, "actraiser_randomizer.py"), *arguments],
+        cwd = directory,
+        env = getEnvironment(),
+        capture_output = True,
+        check = True,
+    )
+    return time.perf_counter_ns() - startTime
+
+
+
+def runBenchmarks(repeat):
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        copyRandomizer(directory)
+
+        # Cold import: Don't write any bytecode, so there's never any to use.
+        results["import_cold"] = summarize([timeImport(directory, False) for _ in range(repeat)])
+
+        # Warm import: Write the bytecode on the first run, then reuse it.
+        # If it wasn't written (e.g. the directory isn't writable), this
+        # would be another cold import, so don't report it as a warm one.
+        timeImport(directory, True)
+        pycFileName = importlib.util.cache_from_source(os.path.join(directory, "actraiser_randomizer.py"))
+        if not os.path.exists(pycFileName):
+            sys.exit(f"Error: No cached bytecode was written ({pycFileName!r}), so warm imports can't be measured")
+        results["import_warm"] = summarize([timeImport(directory, True) for _ in range(repeat)])
+
+        # The "-v" command runs the script directly, which never uses cached
+        # bytecode for the script itself.
+        results["cli_version"] = summarize([timeCommand(directory, ["-v"]) for _ in range(repeat)])
+
+    # Extended map metadata: Call the loading functions directly, so each
+    # run does the work again.
+    numberOfCalls = 1000
+    for name, function in [
+        ("metadata_from_blob", actraiser_randomizer.loadExtendedMapMetadata),
+        ("metadata_from_source", actraiser_randomizer.decodeExtendedMapMetadataSource),
+    ]:
+        samples = timeit.repeat(function, number=numberOfCalls, repeat=repeat)
+        results[name] = summarize([x / numberOfCalls * 1e9 for x in samples])
+
+    return results
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ActRaiser Randomizer: Import-time benchmark")
+    parser.add_argument(
+        "-n", "--repeat",
+        type = int,
+        default = 20,
+        help = "number of runs per measurement (default: 20)",
+    )
+    parser.add_argument(
+        "-o", "--output-file",
+        type = str,
+        help = "also write the results to this JSON file",
+    )
+    args = parser.parse_args()
+
+    writeReport("import", runBenchmarks(args.repeat), args.output_file)
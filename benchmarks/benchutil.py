@@ -0,0 +1,36 @@
+# ActRaiser Randomizer: Shared helpers for the benchmarks
+
+import json
+import os
+import statistics
+import sys
+
+repoDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repoDirectory)
+import actraiser_randomizer
+from actraiser_synthetic_rom import makeSyntheticROM
+
+
+
+def summarize(samples):
+    return {
+        "median_ns": int(statistics.median(samples)),
+        "min_ns": int(min(samples)),
+        "samples": len(samples),
+    }
+
+
+
+# Print a report, and optionally write it to a file, as JSON.
+def writeReport(benchmarkName, results, outFileName=None):
+    report = {
+        "benchmark": benchmarkName,
+        "randomizerVersion": actraiser_randomizer.randomizerVersion,
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+    reportString = json.dumps(report, indent=2)
+    print(reportString)
+    if outFileName:
+        with open(outFileName, "w") as outFile:
+            outFile.write(reportString + "\n")
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+#
+# ActRaiser Randomizer: Compare benchmark results
+#
+# Compares two JSON files written by the benchmarks (e.g. from two releases),
+# showing the median time for each measurement and the change between them.
+# With --threshold, exits with status 1 if anything got slower by more than
+# that factor, so this can be used to catch regressions automatically.
+
+import argparse
+import json
+import sys
+
+
+
+def loadReport(fileName):
+    with open(fileName, "r") as inFile:
+        return json.load(inFile)
+
+
+
+def compareReports(oldReport, newReport):
+    rows = []
+    for name, newResult in newReport["results"].items():
+        oldResult = oldReport["results"].get(name)
+        if oldResult is None:
+            continue
+        rows.append((name, oldResult["median_ns"], newResult["median_ns"], newResult["median_ns"] / oldResult["median_ns"]))
+    return rows
+
+
+
+def formatTime(nanoseconds):
+    for unit, scale in [("s", 1e9), ("ms", 1e6), ("us", 1e3)]:
+        if nanoseconds >= scale:
+            return f"{nanoseconds / scale:.2f} {unit}"
+    return f"{nanoseconds} ns"
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ActRaiser Randomizer: Compare benchmark results")
+    parser.add_argument(
+        "old_file",
+        help = "results from the old version",
+    )
+    parser.add_argument(
+        "new_file",
+        help = "results from the new version",
+    )
+    parser.add_argument(
+        "--threshold",
+        type = float,
+        help = "fail if any measurement is slower by more than this factor, e.g. 1.1",
+    )
+    args = parser.parse_args()
+
+    oldReport = loadReport(args.old_file)
+    newReport = loadReport(args.new_file)
+    if oldReport["benchmark"] != newReport["benchmark"]:
+        parser.error(f"Different benchmarks: {oldReport['benchmark']!r} and {newReport['benchmark']!r}")
+
+    print(f"{oldReport['benchmark']}: {oldReport['randomizerVersion']} (Python {oldReport['python']}) -> {newReport['randomizerVersion']} (Python {newReport['python']})")
+    nameWidth = max([len(name) for name in newReport["results"]] + [4])
+    print(f"{'name':<{nameWidth}}  {'old':>10}  {'new':>10}  change")
+    regressions = []
+    for name, oldTime, newTime, ratio in compareReports(oldReport, newReport):
+        print(f"{name:<{nameWidth}}  {formatTime(oldTime):>10}  {formatTime(newTime):>10}  {ratio:.2f}x")
+        if args.threshold is not None and ratio > args.threshold:
+            regressions.append(name)
+
+    if regressions:
+        print(f"Slower than the threshold ({args.threshold}x): {', '.join(regressions)}")
+        sys.exit(1)
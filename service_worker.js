@@ -0,0 +1,112 @@
+"use strict";
+
+// Service worker for the web interface.
+// Everything the web interface normally needs is cached when the service
+// worker is installed: the page and its scripts, the randomizer and the
+// extended map metadata, the JavaScript engine's data, and Bootstrap. After
+// that, the page starts without waiting for the network, and works offline.
+// The Pyodide runtime is several megabytes, and is only used if the engine
+// can't be (see web_interface.js), so it isn't cached at install time.
+// Instead, it's cached the first time a web worker loads it.
+// The cache is named after the randomizer version, which the page passes
+// in the service worker's URL (e.g. "service_worker.js?version=2025-03-14").
+// A new version means a new service worker, which caches everything again
+// and then removes the old cache.
+// - The page's own files are served from the cache, and refreshed from the
+//   network in the background, so a new release shows up on the next visit.
+// - The CDN files (including Pyodide's) have the version in their URLs and
+//   never change, so they're only fetched if they're not already cached.
+
+const randomizerVersion = new URL(self.location.href).searchParams.get("version") ?? "unknown";
+const cacheNamePrefix = "actraiser_randomizer-";
+const cacheName = `${cacheNamePrefix}${randomizerVersion}`;
+
+// Keep these in sync with index.html and web_worker.js.
+const PYODIDE_BASE_URL = "https://cdn.jsdelivr.net/pyodide/v0.27.3/full/";
+const appFiles = [
+  "./",
+  "index.html",
+  "web_engine.js",
+  "web_engine_data.json",
+  "web_interface.js",
+  "web_storage.js",
+  "web_worker.js",
+  "web_zip.js",
+  "actraiser_randomizer.py",
+  "extended_map_metadata.bin",
+];
+const cdnFiles = [
+  "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css",
+  "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js",
+];
+
+
+
+self.addEventListener("install", (event) => {
+  event.waitUntil((async () => {
+    const cache = await caches.open(cacheName);
+    await cache.addAll([
+      ...appFiles,
+      ...cdnFiles.map((url) => new Request(url, { mode: "cors" })),
+    ]);
+    await self.skipWaiting();
+  })());
+});
+
+
+
+self.addEventListener("activate", (event) => {
+  event.waitUntil((async () => {
+    for (const keyName of await caches.keys()) {
+      if (keyName.startsWith(cacheNamePrefix) && keyName !== cacheName) {
+        await caches.delete(keyName);
+      }
+    }
+    await self.clients.claim();
+  })());
+});
+
+
+
+async function cacheThenRefresh(event) {
+  const cache = await caches.open(cacheName);
+  const cachedResponse = await cache.match(event.request);
+  const networkResponsePromise = fetch(event.request).then((response) => {
+    if (response.ok) {
+      cache.put(event.request, response.clone());
+    }
+    return response;
+  });
+  if (cachedResponse) {
+    event.waitUntil(networkResponsePromise.catch(() => null));
+    return cachedResponse;
+  }
+  return networkResponsePromise;
+}
+
+async function cacheFirst(event) {
+  const cache = await caches.open(cacheName);
+  const cachedResponse = await cache.match(event.request);
+  if (cachedResponse) {
+    return cachedResponse;
+  }
+  // Fetch with CORS, even for importScripts() (which doesn't use it), so
+  // the response isn't opaque and can be checked before it's cached.
+  const response = await fetch(new Request(event.request.url, { mode: "cors" }));
+  if (response.ok) {
+    cache.put(event.request, response.clone());
+  }
+  return response;
+}
+
+self.addEventListener("fetch", (event) => {
+  if (event.request.method !== "GET") {
+    return;
+  }
+  const url = new URL(event.request.url);
+  if (url.origin === self.location.origin) {
+    event.respondWith(cacheThenRefresh(event));
+  } else if (url.href.startsWith(PYODIDE_BASE_URL) || cdnFiles.includes(url.href)) {
+    event.respondWith(cacheFirst(event));
+  }
+});
@@ -0,0 +1,100 @@
+# ActRaiser Randomizer: Tests for randomize()
+# Run with: py -m unittest discover tests
+
+import os
+import random
+import sys
+import unittest
+
+repoDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repoDirectory)
+import actraiser_randomizer
+
+
+
+# A reference version of randomize(), using only the raw output of
+# random.Random(seed), through getrandbits(). It spells out what choice(),
+# shuffle() and randint() do with those numbers, which is what other
+# implementations (e.g. web_engine.js) have to reproduce:
+# - _randbelow(n) takes n.bit_length() bits, and tries again if the result
+#   isn't below n.
+# - choice() of a two-item list is _randbelow(2).
+# - shuffle() swaps each item, from the end, with a random earlier one.
+# - randint(0, n) is _randbelow(n + 1).
+def randBelow(rng, n):
+    bitCount = n.bit_length()
+    result = rng.getrandbits(bitCount)
+    while result >= n:
+        result = rng.getrandbits(bitCount)
+    return result
+
+def shuffle(rng, items):
+    for i in reversed(range(1, len(items))):
+        j = randBelow(rng, i + 1)
+        items[i], items[j] = items[j], items[i]
+
+def referenceRandomize(seed, marahnaPath, bossRushType):
+    rng = random.Random(seed)
+    marahnaCoinFlip = actraiser_randomizer.MARAHNA_PATH_CHOICES[randBelow(rng, 2)]
+    bossRushTypeCoinFlip = actraiser_randomizer.BOSS_RUSH_TYPE_CHOICES[randBelow(rng, 2)]
+    marahnaPath = marahnaPath or marahnaCoinFlip
+    bossRushType = bossRushType or bossRushTypeCoinFlip
+
+    mapNumbers = actraiser_randomizer.getUnshuffledMapNumbers(marahnaPath)
+    shuffle(rng, mapNumbers)
+    bossRush = actraiser_randomizer.getUnshuffledBossRush()
+    shuffle(rng, bossRush)
+    bossRush.append(0x701)
+
+    if bossRushType == actraiser_randomizer.BOSS_RUSH_TYPE___CONSECUTIVE:
+        mapNumbers = [x for x in mapNumbers if x != actraiser_randomizer.BOSS_RUSH_PLACEHOLDER]
+        consecutiveIndex = randBelow(rng, len(mapNumbers) + 1)
+        mapNumbers = mapNumbers[:consecutiveIndex] + bossRush + mapNumbers[consecutiveIndex:]
+    else:
+        bossRushIterator = iter(bossRush)
+        mapNumbers = [
+            next(bossRushIterator) if x == actraiser_randomizer.BOSS_RUSH_PLACEHOLDER else x
+            for x in mapNumbers
+        ]
+
+    return mapNumbers, marahnaPath, bossRushType
+
+
+
+class RandomizeTest(unittest.TestCase):
+    # The lowest and highest seeds, plus a fixed sample of the rest.
+    seeds = sorted(set([
+        *range(200),
+        *range(2**32 - 200, 2**32),
+        *random.Random(0).sample(range(2**32), 5000),
+    ]))
+
+    def test_matches_reference(self):
+        for marahnaPath in [None, *actraiser_randomizer.MARAHNA_PATH_CHOICES]:
+            for bossRushType in [None, *actraiser_randomizer.BOSS_RUSH_TYPE_CHOICES]:
+                with self.subTest(marahnaPath=marahnaPath, bossRushType=bossRushType):
+                    for seed in self.seeds:
+                        self.assertEqual(
+                            actraiser_randomizer.randomize(seed, marahnaPath, bossRushType),
+                            referenceRandomize(seed, marahnaPath, bossRushType),
+                            f"Seed: {seed}",
+                        )
+
+    def test_shuffle_is_complete(self):
+        # Every seed's shuffle has each map exactly once, and its boss rush
+        # ends with Death Heim Clear.
+        for seed in self.seeds[:1000]:
+            mapNumbers, marahnaPath, bossRushType = actraiser_randomizer.randomize(seed, None, None)
+            expected = [
+                *[x for x in actraiser_randomizer.getUnshuffledMapNumbers(marahnaPath) if x != actraiser_randomizer.BOSS_RUSH_PLACEHOLDER],
+                *actraiser_randomizer.getUnshuffledBossRush(),
+                0x701,
+            ]
+            self.assertEqual(sorted(mapNumbers), sorted(expected), f"Seed: {seed}")
+            bossRushRooms = [x for x in mapNumbers if x & 0xF00 == 0x700]
+            self.assertEqual(bossRushRooms[-1], 0x701, f"Seed: {seed}")
+
+
+
+if __name__ == "__main__":
+    unittest.main()
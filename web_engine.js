@@ -0,0 +1,504 @@
+"use strict";
+
+// Seed generation in JavaScript, without Pyodide.
+// This is a port of the seed-dependent part of actraiser_randomizer.py:
+// randomize(), getHashString(), getSeedPatches(), and the IPS and BPS
+// encoders. Its output is byte-identical to generate()'s.
+// The patches and the shuffle's inputs aren't copied here: they come from
+// web_engine_data.json, which is exported from actraiser_randomizer.py
+// (see getWebEngineData). Run "py actraiser_tools.py enginecheck" after
+// changing either file, to check them against each other.
+// This file is used by the web interface, and by web_engine_check.js in
+// Node.js (for enginecheck), so it only uses what both provide.
+
+
+
+// CRC-32, as in zlib.crc32. (Also used by web_zip.js.)
+// Pass the previous CRC to continue a checksum over several pieces of data.
+const crc32Table = new Uint32Array(256).map((_, n) => {
+  let c = n;
+  for (let k = 0; k < 8; k++) {
+    c = (c & 1) ? (0xEDB88320 ^ (c >>> 1)) : (c >>> 1);
+  }
+  return c;
+});
+
+function crc32(bytes, previousCRC = 0) {
+  let crc = (previousCRC ^ 0xFFFFFFFF) >>> 0;
+  for (let i = 0; i < bytes.length; i++) {
+    crc = crc32Table[(crc ^ bytes[i]) & 0xFF] ^ (crc >>> 8);
+  }
+  return (crc ^ 0xFFFFFFFF) >>> 0;
+}
+
+
+
+// MD5, for getHashString. (The Web Crypto API doesn't support MD5.)
+// Returns the digest as a lowercase hex string.
+const md5Shifts = [
+  7, 12, 17, 22, 7, 12, 17, 22, 7, 12, 17, 22, 7, 12, 17, 22,
+  5, 9, 14, 20, 5, 9, 14, 20, 5, 9, 14, 20, 5, 9, 14, 20,
+  4, 11, 16, 23, 4, 11, 16, 23, 4, 11, 16, 23, 4, 11, 16, 23,
+  6, 10, 15, 21, 6, 10, 15, 21, 6, 10, 15, 21, 6, 10, 15, 21,
+];
+const md5Constants = new Uint32Array(64).map((_, i) => Math.floor(Math.abs(Math.sin(i + 1)) * 2 ** 32));
+
+function md5Hex(bytes) {
+  // Padding: 0x80, then zeroes, then the length in bits (64-bit little-endian).
+  const paddedLength = Math.ceil((bytes.length + 9) / 64) * 64;
+  const padded = new Uint8Array(paddedLength);
+  padded.set(bytes);
+  padded[bytes.length] = 0x80;
+  const paddedView = new DataView(padded.buffer);
+  paddedView.setUint32(paddedLength - 8, (bytes.length * 8) >>> 0, true);
+  paddedView.setUint32(paddedLength - 4, Math.floor(bytes.length / 2 ** 29), true);
+
+  const digest = new Uint32Array([0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476]);
+  for (let blockOffset = 0; blockOffset < paddedLength; blockOffset += 64) {
+    let [a, b, c, d] = digest;
+    for (let i = 0; i < 64; i++) {
+      let f = 0;
+      let g = 0;
+      if (i < 16) {
+        f = (b & c) | (~b & d);
+        g = i;
+      } else if (i < 32) {
+        f = (d & b) | (~d & c);
+        g = (5 * i + 1) % 16;
+      } else if (i < 48) {
+        f = b ^ c ^ d;
+        g = (3 * i + 5) % 16;
+      } else {
+        f = c ^ (b | ~d);
+        g = (7 * i) % 16;
+      }
+      f = (f + a + md5Constants[i] + paddedView.getUint32(blockOffset + 4 * g, true)) | 0;
+      a = d;
+      d = c;
+      c = b;
+      b = (b + ((f << md5Shifts[i]) | (f >>> (32 - md5Shifts[i])))) | 0;
+    }
+    digest[0] += a;
+    digest[1] += b;
+    digest[2] += c;
+    digest[3] += d;
+  }
+
+  const digestBytes = new Uint8Array(16);
+  const digestView = new DataView(digestBytes.buffer);
+  digest.forEach((x, i) => digestView.setUint32(4 * i, x, true));
+  return Array.from(digestBytes, (x) => x.toString(16).padStart(2, "0")).join("");
+}
+
+
+
+// The Mersenne Twister (MT19937), as in CPython's random module.
+// The key is a list of 32-bit words, as for CPython's init_by_array().
+// Only the methods that randomize() uses are here. They all go through
+// randBelow(n), which is CPython's _randbelow(): take the top bits of the
+// next 32-bit output (as many bits as n has), and try again if the result
+// isn't below n.
+class MersenneTwister {
+  constructor(key) {
+    this.state = new Uint32Array(624);
+    this.index = 624;
+    this.initByArray(key);
+  }
+
+  initGenrand(seed) {
+    const mt = this.state;
+    mt[0] = seed;
+    for (let i = 1; i < 624; i++) {
+      mt[i] = Math.imul(1812433253, mt[i - 1] ^ (mt[i - 1] >>> 30)) + i;
+    }
+  }
+
+  initByArray(key) {
+    const mt = this.state;
+    this.initGenrand(19650218);
+    let i = 1;
+    let j = 0;
+    for (let k = Math.max(624, key.length); k > 0; k--) {
+      mt[i] = (mt[i] ^ Math.imul(mt[i - 1] ^ (mt[i - 1] >>> 30), 1664525)) + key[j] + j;
+      i++;
+      j++;
+      if (i >= 624) {
+        mt[0] = mt[623];
+        i = 1;
+      }
+      if (j >= key.length) {
+        j = 0;
+      }
+    }
+    for (let k = 623; k > 0; k--) {
+      mt[i] = (mt[i] ^ Math.imul(mt[i - 1] ^ (mt[i - 1] >>> 30), 1566083941)) - i;
+      i++;
+      if (i >= 624) {
+        mt[0] = mt[623];
+        i = 1;
+      }
+    }
+    mt[0] = 0x80000000;
+    this.index = 624;
+  }
+
+  twist() {
+    const mt = this.state;
+    for (let i = 0; i < 624; i++) {
+      const y = (mt[i] & 0x80000000) | (mt[(i + 1) % 624] & 0x7FFFFFFF);
+      mt[i] = mt[(i + 397) % 624] ^ (y >>> 1) ^ ((y & 1) ? 0x9908B0DF : 0);
+    }
+    this.index = 0;
+  }
+
+  nextUint32() {
+    if (this.index >= 624) {
+      this.twist();
+    }
+    let y = this.state[this.index++];
+    y ^= y >>> 11;
+    y ^= (y << 7) & 0x9D2C5680;
+    y ^= (y << 15) & 0xEFC60000;
+    y ^= y >>> 18;
+    return y >>> 0;
+  }
+
+  // n must be from 1 to 2**32 - 1.
+  randBelow(n) {
+    const bitLength = 32 - Math.clz32(n);
+    let r = this.nextUint32() >>> (32 - bitLength);
+    while (r >= n) {
+      r = this.nextUint32() >>> (32 - bitLength);
+    }
+    return r;
+  }
+
+  choice(sequence) {
+    return sequence[this.randBelow(sequence.length)];
+  }
+
+  shuffle(array) {
+    for (let i = array.length - 1; i > 0; i--) {
+      const j = this.randBelow(i + 1);
+      [array[i], array[j]] = [array[j], array[i]];
+    }
+  }
+
+  randInt(a, b) {
+    return a + this.randBelow(b - a + 1);
+  }
+}
+
+// The init_by_array() key for random.Random(seed): the seed's absolute
+// value, split into 32-bit words, least significant first.
+// A race seed (null) is seeded from the system's source of randomness, as
+// random.Random(None) is, with as many words as the generator's state.
+function getSeedKey(seed) {
+  if (seed === null) {
+    return Array.from(crypto.getRandomValues(new Uint32Array(624)));
+  }
+  if (!Number.isSafeInteger(seed)) {
+    throw new Error(`Unsupported seed value: ${seed}`);
+  }
+  const key = [];
+  for (let x = Math.abs(seed); x > 0; x = Math.floor(x / 2 ** 32)) {
+    key.push(x % 2 ** 32);
+  }
+  return (key.length > 0) ? key : [0];
+}
+
+
+
+// Load web_engine_data.json, converting the patch data from hex strings.
+function loadEngineData(engineJSON) {
+  const hexToBytes = (hexString) => Uint8Array.from(hexString.match(/../g) ?? [], (x) => parseInt(x, 16));
+  const loadPatches = (patches) => patches.map(([offset, hexString]) => [offset, hexToBytes(hexString)]);
+  return {
+    ...engineJSON,
+    basePatches: loadPatches(engineJSON.basePatches),
+    flagPatches: Object.fromEntries(
+      Object.entries(engineJSON.flagPatches).map(([flag, patches]) => [flag, loadPatches(patches)])
+    ),
+  };
+}
+
+// As validateROM in actraiser_randomizer.py.
+function engineValidateROM(engineData, romBytes) {
+  if (romBytes.length !== engineData.romSize) {
+    throw new Error(`ROM is not ${engineData.romSize} bytes in size`);
+  }
+  const romName = new TextDecoder("latin1").decode(
+    romBytes.subarray(engineData.romNameOffset, engineData.romNameOffset + engineData.romName.length)
+  );
+  if (romName !== engineData.romName) {
+    throw new Error(`Unexpected internal ROM name: ${JSON.stringify(romName)} # Expected: ${JSON.stringify(engineData.romName)}`);
+  }
+}
+
+// As BasePatch in actraiser_randomizer.py: the unmodified ROM, the ROM with
+// the seed-independent changes, and the [start, end) ranges they cover.
+// The unmodified ROM's CRC-32 (for BPS patches) is also worked out once here.
+function engineBasePatch(engineData, sourceBytes) {
+  engineValidateROM(engineData, sourceBytes);
+  const romBytes = sourceBytes.slice();
+  const ranges = [];
+  for (const [offset, data] of engineData.basePatches) {
+    romBytes.set(data, offset);
+    ranges.push([offset, offset + data.length]);
+  }
+  for (const offset of engineData.tileFixOffsets) {
+    romBytes[offset] &= engineData.tileFixMask;
+    ranges.push([offset, offset + 1]);
+  }
+  return { sourceBytes, sourceCRC32: crc32(sourceBytes), romBytes, ranges };
+}
+
+
+
+// As getFlagString in actraiser_randomizer.py.
+function engineGetFlagString(initialLives, zantetsuken, marahnaPath, bossRushType) {
+  let flagString = "";
+  flagString += { extra: "E", unlimited: "U", deathcount: "D" }[initialLives] ?? "";
+  flagString += zantetsuken ? "Z" : "";
+  flagString += { left: "L", right: "R" }[marahnaPath] ?? "";
+  flagString += { consecutive: "C", scattered: "S" }[bossRushType] ?? "";
+  return flagString;
+}
+
+// As randomize in actraiser_randomizer.py, following engineData.shuffle.steps.
+function engineRandomize(engineData, seed, marahnaPath, bossRushType) {
+  const shuffle = engineData.shuffle;
+  const rng = new MersenneTwister(getSeedKey(seed));
+
+  const marahnaCoinFlip = rng.choice(shuffle.marahnaPathChoices);
+  marahnaPath ??= marahnaCoinFlip;
+  if (!shuffle.marahnaPathChoices.includes(marahnaPath)) {
+    throw new Error(`Unexpected marahnaPath value: ${JSON.stringify(marahnaPath)}`);
+  }
+
+  const bossRushTypeCoinFlip = rng.choice(shuffle.bossRushTypeChoices);
+  bossRushType ??= bossRushTypeCoinFlip;
+  if (!shuffle.bossRushTypeChoices.includes(bossRushType)) {
+    throw new Error(`Unexpected bossRushType value: ${JSON.stringify(bossRushType)}`);
+  }
+
+  let mapNumbers = shuffle.unshuffledMapNumbers[marahnaPath].slice();
+  rng.shuffle(mapNumbers);
+
+  const bossRush = shuffle.unshuffledBossRush.slice();
+  rng.shuffle(bossRush);
+  bossRush.push(shuffle.bossRushEnd);
+
+  if (bossRushType === "consecutive") {
+    mapNumbers = mapNumbers.filter((x) => x !== shuffle.bossRushPlaceholder);
+    const consecutiveIndex = rng.randInt(0, mapNumbers.length);
+    mapNumbers.splice(consecutiveIndex, 0, ...bossRush);
+  } else {
+    for (const boss of bossRush) {
+      mapNumbers[mapNumbers.indexOf(shuffle.bossRushPlaceholder)] = boss;
+    }
+  }
+
+  return { mapNumbers, marahnaPath, bossRushType };
+}
+
+// As getHashString in actraiser_randomizer.py.
+function engineGetHashString(engineData, mapNumbers) {
+  const hashInput = [engineData.randomizerVersion, ...mapNumbers.map((x) => x.toString(16).toUpperCase())].join(",");
+  return md5Hex(new TextEncoder().encode(hashInput)).toUpperCase().substring(0, 8);
+}
+
+// As getSeedPatches in actraiser_randomizer.py.
+function engineGetSeedPatches(engineData, titleString, mapNumbers, hashString, initialLives, zantetsuken) {
+  const layout = engineData.seedLayout;
+  if (mapNumbers.length > layout.mapNumbersLimit) {
+    throw new Error(`Too many map numbers: ${mapNumbers.length} # Limit: ${layout.mapNumbersLimit}`);
+  }
+  if (![null, "extra", "unlimited", "deathcount"].includes(initialLives)) {
+    throw new Error(`Unexpected initialLives value: ${JSON.stringify(initialLives)}`);
+  }
+  const textEncoder = new TextEncoder();
+  const seedPatches = [];
+
+  // The title screen text. (Centred as Python's "^" format does: any odd
+  // space goes on the right.)
+  const menuOption = `> ${titleString.substring(0, 25)}`;
+  const leftPadding = " ".repeat(Math.floor((32 - menuOption.length) / 2));
+  seedPatches.push([layout.titleOffset, textEncoder.encode(`${leftPadding}${menuOption}`.padEnd(32) + "\x00")]);
+  const versionString = `v.${engineData.randomizerVersion.substring(0, 15)}`;
+  const hvLine = `  ${hashString.padEnd(8)}  ${versionString.padStart(17)}\x0D\x0D`;
+  seedPatches.push([layout.hashVersionOffset, textEncoder.encode(hvLine)]);
+
+  for (const flag of engineGetFlagString(initialLives, zantetsuken, null, null)) {
+    seedPatches.push(...engineData.flagPatches[flag]);
+  }
+
+  const mapNumbersBytes = new Uint8Array(2 * (mapNumbers.length + 2));
+  const mapNumbersView = new DataView(mapNumbersBytes.buffer);
+  [layout.creditsMapNumber, ...mapNumbers, layout.creditsMapNumber].forEach((x, i) => {
+    mapNumbersView.setUint16(2 * i, x, true);
+  });
+  seedPatches.push([layout.mapNumbersOffset, mapNumbersBytes]);
+
+  const creditsThreshold = (Math.floor(mapNumbers.length / 10) << 4) + (mapNumbers.length % 10) + 1;
+  seedPatches.push([layout.creditsThresholdOffset, Uint8Array.of(creditsThreshold)]);
+
+  return seedPatches;
+}
+
+
+
+// Merge [start, end) ranges into sorted, non-overlapping runs, combining
+// overlapping and adjacent ranges, as mergePatches does.
+function mergeRanges(ranges) {
+  const runs = [];
+  for (const [start, end] of ranges.toSorted((x, y) => x[0] - y[0])) {
+    const lastRun = runs[runs.length - 1];
+    if (lastRun !== undefined && start <= lastRun[1]) {
+      lastRun[1] = Math.max(lastRun[1], end);
+    } else {
+      runs.push([start, end]);
+    }
+  }
+  return runs;
+}
+
+function concatBytes(parts) {
+  const output = new Uint8Array(parts.reduce((total, part) => total + part.length, 0));
+  let position = 0;
+  for (const part of parts) {
+    output.set(part, position);
+    position += part.length;
+  }
+  return output;
+}
+
+// As encodeIPS in actraiser_randomizer.py, for the given runs of the
+// patched ROM.
+function engineEncodeIPS(romBytes, runs) {
+  const textEncoder = new TextEncoder();
+  const parts = [textEncoder.encode("PATCH")];
+  for (const [start, end] of runs) {
+    for (let offset = start; offset < end; offset += 0xFFFF) {
+      const size = Math.min(end - offset, 0xFFFF);
+      if (offset > 0xFFFFFF || offset === 0x454F46) {
+        throw new Error(`Offset cannot be stored in an IPS patch: 0x${offset.toString(16).toUpperCase()}`);
+      }
+      parts.push(Uint8Array.of(offset >>> 16, (offset >>> 8) & 0xFF, offset & 0xFF, size >>> 8, size & 0xFF));
+      parts.push(romBytes.subarray(offset, offset + size));
+    }
+  }
+  parts.push(textEncoder.encode("EOF"));
+  return concatBytes(parts);
+}
+
+function encodeBPSNumber(number) {
+  const numberBytes = [];
+  while (true) {
+    const x = number & 0x7F;
+    number = Math.floor(number / 0x80);
+    if (number === 0) {
+      numberBytes.push(0x80 | x);
+      return numberBytes;
+    }
+    numberBytes.push(x);
+    number -= 1;
+  }
+}
+
+// As encodeBPS in actraiser_randomizer.py, for the given runs of the
+// patched ROM. The gaps between the runs are SourceRead actions.
+function engineEncodeBPS(sourceBytes, sourceCRC32, romBytes, runs) {
+  const parts = [new TextEncoder().encode("BPS1")];
+  parts.push(Uint8Array.from([
+    ...encodeBPSNumber(sourceBytes.length),
+    ...encodeBPSNumber(romBytes.length),
+    ...encodeBPSNumber(0),
+  ]));
+  let outputOffset = 0;
+  for (const [start, end] of runs) {
+    if (start > outputOffset) {
+      parts.push(Uint8Array.from(encodeBPSNumber(((start - outputOffset - 1) * 4) + 0)));
+    }
+    parts.push(Uint8Array.from(encodeBPSNumber(((end - start - 1) * 4) + 1)));
+    parts.push(romBytes.subarray(start, end));
+    outputOffset = end;
+  }
+  if (romBytes.length > outputOffset) {
+    parts.push(Uint8Array.from(encodeBPSNumber(((romBytes.length - outputOffset - 1) * 4) + 0)));
+  }
+  const checksums = new DataView(new ArrayBuffer(8));
+  checksums.setUint32(0, sourceCRC32, true);
+  checksums.setUint32(4, crc32(romBytes), true);
+  parts.push(new Uint8Array(checksums.buffer));
+  const patchBytes = concatBytes([...parts, new Uint8Array(4)]);
+  const patchView = new DataView(patchBytes.buffer);
+  patchView.setUint32(patchBytes.length - 4, crc32(patchBytes.subarray(0, patchBytes.length - 4)), true);
+  return patchBytes;
+}
+
+
+
+// As generate in actraiser_randomizer.py, starting from an engineBasePatch.
+// Returns { outputBytes, flagString, hashString, mapNumbers,
+// chosenMarahnaPath, chosenBossRushType }.
+function engineGenerate(engineData, basePatch, isRaceSeed, seed, initialLives, zantetsuken, marahnaPath, bossRushType, outputFormat = "sfc") {
+  if (isRaceSeed) {
+    seed = null;
+  }
+  const flagString = engineGetFlagString(initialLives, zantetsuken, marahnaPath, bossRushType);
+  const shuffled = engineRandomize(engineData, seed, marahnaPath, bossRushType);
+  const hashString = engineGetHashString(engineData, shuffled.mapNumbers);
+
+  let titleString = isRaceSeed ? "RACE!" : `${seed}`;
+  if (flagString) {
+    titleString += ` -${flagString}`;
+  }
+  const seedPatches = engineGetSeedPatches(engineData, titleString, shuffled.mapNumbers, hashString, initialLives, zantetsuken);
+
+  const romBytes = basePatch.romBytes.slice();
+  for (const [offset, data] of seedPatches) {
+    romBytes.set(data, offset);
+  }
+
+  let outputBytes = null;
+  if (outputFormat === "sfc") {
+    outputBytes = romBytes;
+  } else {
+    const runs = mergeRanges([
+      ...basePatch.ranges,
+      ...seedPatches.map(([offset, data]) => [offset, offset + data.length]),
+    ]);
+    if (outputFormat === "ips") {
+      outputBytes = engineEncodeIPS(romBytes, runs);
+    } else if (outputFormat === "bps") {
+      outputBytes = engineEncodeBPS(basePatch.sourceBytes, basePatch.sourceCRC32, romBytes, runs);
+    } else {
+      throw new Error(`Unexpected outputFormat value: ${JSON.stringify(outputFormat)}`);
+    }
+  }
+
+  return {
+    outputBytes,
+    flagString,
+    hashString,
+    mapNumbers: shuffled.mapNumbers,
+    chosenMarahnaPath: shuffled.marahnaPath,
+    chosenBossRushType: shuffled.bossRushType,
+  };
+}
+
+
+
+if (typeof module !== "undefined") {
+  module.exports = {
+    crc32,
+    md5Hex,
+    MersenneTwister,
+    loadEngineData,
+    engineBasePatch,
+    engineRandomize,
+    engineGetHashString,
+    engineGenerate,
+  };
+}
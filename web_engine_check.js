@@ -0,0 +1,63 @@
+"use strict";
+
+// Node.js driver for "py actraiser_tools.py enginecheck".
+// Usage: node web_engine_check.js ROM_FILE < cases.jsonl > results.jsonl
+// Each input line is a JSON object with the arguments for engineGenerate:
+//   {"isRaceSeed": false, "seed": 5, "initialLives": "extra",
+//    "zantetsuken": true, "marahnaPath": null, "bossRushType": null,
+//    "outputFormat": "sfc", "outputFile": null}
+// Each output line is the generated seed's details and the SHA-256 of its
+// output. If outputFile is given, the output is also written to that file.
+
+const crypto = require("node:crypto");
+const fs = require("node:fs");
+const path = require("node:path");
+
+const engine = require("./web_engine.js");
+
+
+
+function main() {
+  const engineJSON = JSON.parse(fs.readFileSync(path.join(__dirname, "web_engine_data.json"), "utf8"));
+  const engineData = engine.loadEngineData(engineJSON);
+  const basePatch = engine.engineBasePatch(engineData, new Uint8Array(fs.readFileSync(process.argv[2])));
+
+  const outputLines = [];
+  for (const line of fs.readFileSync(0, "utf8").split("\n")) {
+    if (!line.trim()) {
+      continue;
+    }
+    const testCase = JSON.parse(line);
+    let result = null;
+    try {
+      const generated = engine.engineGenerate(
+        engineData,
+        basePatch,
+        testCase.isRaceSeed,
+        testCase.seed,
+        testCase.initialLives,
+        testCase.zantetsuken,
+        testCase.marahnaPath,
+        testCase.bossRushType,
+        testCase.outputFormat,
+      );
+      if (testCase.outputFile) {
+        fs.writeFileSync(testCase.outputFile, generated.outputBytes);
+      }
+      result = {
+        flags: generated.flagString,
+        hash: generated.hashString,
+        marahnaPath: generated.chosenMarahnaPath,
+        bossRushType: generated.chosenBossRushType,
+        maps: generated.mapNumbers,
+        sha256: crypto.createHash("sha256").update(generated.outputBytes).digest("hex"),
+      };
+    } catch (e) {
+      result = { error: e.message };
+    }
+    outputLines.push(JSON.stringify(result));
+  }
+  fs.writeFileSync(1, outputLines.join("\n") + "\n");
+}
+
+main();
@@ -1,7 +1,5 @@
 "use strict";
 
-let worker = null;
-
 const storageWrapper = {
   keyNamePrefix: "actraiser_randomizer",
   storageBackend: window.localStorage,
@@ -18,40 +16,8 @@ const storageWrapper = {
 
 
 
-function bytesToBase64(bytes) {
-  const alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/" + "=";
-  const PADDING_INDEX = alphabet.length - 1;
-  const base64 = new Array(4 * Math.ceil(bytes.length / 3));
-
-  // With each pass of the loop, process three bytes of input
-  for (let i = 0; 3*i < bytes.length; i++) {
-    // 1st input byte
-    base64[4*i + 0] = (bytes[3*i + 0] & 0b11111100) >> 2;
-    base64[4*i + 1] = (bytes[3*i + 0] & 0b00000011) << 4;
-    // 2nd input byte
-    if (3*i + 1 < bytes.length) {
-      base64[4*i + 1] |= (bytes[3*i + 1] & 0b11110000) >> 4;
-      base64[4*i + 2]  = (bytes[3*i + 1] & 0b00001111) << 2;
-    } else {
-      base64[4*i + 2]  = PADDING_INDEX;
-    }
-    // 3rd input byte
-    if (3*i + 2 < bytes.length) {
-      base64[4*i + 2] |= (bytes[3*i + 2] & 0b11000000) >> 6;
-      base64[4*i + 3]  = (bytes[3*i + 2] & 0b00111111);
-    } else {
-      base64[4*i + 3]  = PADDING_INDEX;
-    }
-    // Convert the four output values to Base64 characters
-    base64[4*i + 0] = alphabet[base64[4*i + 0]];
-    base64[4*i + 1] = alphabet[base64[4*i + 1]];
-    base64[4*i + 2] = alphabet[base64[4*i + 2]];
-    base64[4*i + 3] = alphabet[base64[4*i + 3]];
-  }
-
-  return base64.join("");
-}
-
+// Only used to move a ROM stored by older versions of the page, which kept
+// it in localStorage as Base64, to IndexedDB.
 function base64ToBytes(base64) {
   const binString = atob(base64);
   return Uint8Array.from(binString, (m) => m.codePointAt(0));
@@ -99,14 +65,60 @@ function updateStatusMessage(message = "", textClass = "") {
 
 
 
+function updateTimings(timings = []) {
+  // Show the time taken by each stage of generating the seed.
+  // Nested stages are indented under the stage they're part of.
+  const nameWidth = Math.max(0, ...timings.map((x) => 2*x.depth + x.stage.length));
+  const lines = timings.map((x) => {
+    const stageName = " ".repeat(2*x.depth) + x.stage;
+    return `${stageName.padEnd(nameWidth)}  ${x.duration.toFixed(3).padStart(10)} ms`;
+  });
+  document.getElementById("timingBreakdown").innerText = lines.join("\n");
+  if (lines.length > 0) {
+    document.getElementById("timings").classList.remove("d-none");
+  } else {
+    document.getElementById("timings").classList.add("d-none");
+  }
+}
+
+
+
+// Store the selected ROM. The ROM itself goes in IndexedDB, and is only read
+// by the web worker. Its SHA-256, and whether it's valid (which is checked
+// once, here), go in localStorage for quick access.
+async function storeROM(romBuffer) {
+  const romBytes = new Uint8Array(romBuffer);
+  const romSHA256 = await sha256Hex(romBuffer);
+  const romValid = isValidROM(romBytes);
+  try {
+    await removeROM();
+    if (romValid) {
+      await fileStorage.setItem("rom", { sha256: romSHA256, romBuffer: romBuffer });
+    }
+    storageWrapper.setItem("rom_sha256", romSHA256);
+    storageWrapper.setItem("rom_valid", String(romValid));
+  } catch (e) {
+    storageWrapper.removeItem("rom_sha256");
+    storageWrapper.removeItem("rom_valid");
+    updateStatusMessage(`Could not store ROM: ${e.message}`, "danger");
+  }
+}
+
+async function removeROM() {
+  storageWrapper.removeItem("rom_sha256");
+  storageWrapper.removeItem("rom_valid");
+  await fileStorage.removeItem("rom");
+}
+
+
+
 function updateFileButton() {
   const buttonClasses = ["btn-success", "btn-danger", "btn-warning"];
   document.getElementById("fileButton").classList.remove(...buttonClasses);
 
-  const romBase64 = storageWrapper.getItem("rom_base64");
-  if (romBase64 !== null) {
-    const romBytes = base64ToBytes(romBase64);
-    if (isValidROM(romBytes)) {
+  const romSHA256 = storageWrapper.getItem("rom_sha256");
+  if (romSHA256 !== null) {
+    if (storageWrapper.getItem("rom_valid") === "true") {
       document.getElementById("fileButton").classList.add("btn-success");
       document.getElementById("fileButton").innerText = "Valid ROM selected";
       document.getElementById("generate").disabled = false;
@@ -130,17 +142,7 @@ async function changeFileName(event) {
   if (fileList.length > 0) {
     const fileObject = fileList.item(0);
     const fileBuffer = await fileObject.arrayBuffer();
-    const fileBytes = new Uint8Array(fileBuffer);
-    try {
-      storageWrapper.setItem("rom_base64", bytesToBase64(fileBytes));
-    } catch (e) {
-      if (e instanceof DOMException && e.name === "QuotaExceededError") {
-        storageWrapper.removeItem("rom_base64");
-        updateStatusMessage("Could not store ROM: localStorage quota exceeded", "danger");
-      } else {
-        throw e;
-      }
-    }
+    await storeROM(fileBuffer);
     updateFileButton();
   }
 }
@@ -152,9 +154,9 @@ document.getElementById("fileButton").addEventListener("click", function (event)
 
 
 
-function clearFileName(event) {
+async function clearFileName(event) {
   updateStatusMessage();
-  storageWrapper.removeItem("rom_base64");
+  await removeROM();
   updateFileButton();
 }
 document.getElementById("clearFileName").addEventListener("click", clearFileName);
@@ -185,16 +187,185 @@ document.getElementById("newSeed").addEventListener("click", newSeed);
 
 
 
-function generate(event) {
+// The JavaScript engine (web_engine.js) generates seeds on the page itself,
+// in a few milliseconds, without waiting for Pyodide to load. It's used if
+// web_engine_data.json is for the same randomizer version as
+// actraiser_randomizer.py. If it isn't (or it can't be loaded), the web
+// workers below run actraiser_randomizer.py itself instead.
+// The engine reads the ROM from IndexedDB the first time it's used, and
+// keeps it (as an engineBasePatch) for later seeds.
+const engineState = {
+  engineData: null,
+  romSHA256: null,
+  basePatch: null,
+};
+
+async function loadEngine(randomizerVersion) {
+  try {
+    const response = await fetch("web_engine_data.json");
+    if (!response.ok) {
+      throw new Error(`HTTP response status code: ${response.status}`);
+    }
+    const engineJSON = await response.json();
+    if (engineJSON.randomizerVersion === randomizerVersion) {
+      engineState.engineData = loadEngineData(engineJSON);
+    }
+  } catch (e) {
+    console.warn("Could not load the JavaScript engine's data:", e);
+  }
+}
+
+// Generate one seed with the engine. Takes and returns the same Maps as the
+// web worker does, so the two can be used interchangeably.
+async function runEngine(randomizerArgs) {
+  const generatedSeed = new Map();
+  try {
+    const timings = [];
+    let startTime = performance.now();
+    const romSHA256 = randomizerArgs.get("romSHA256");
+    if (engineState.romSHA256 !== romSHA256) {
+      const storedROM = await fileStorage.getItem("rom");
+      if (!storedROM || storedROM.sha256 !== romSHA256) {
+        throw new Error("The selected ROM could not be found. Please select it again.");
+      }
+      engineState.basePatch = engineBasePatch(engineState.engineData, new Uint8Array(storedROM.romBuffer));
+      engineState.romSHA256 = romSHA256;
+    }
+    timings.push({ stage: "loadROM", depth: 0, duration: performance.now() - startTime });
+
+    startTime = performance.now();
+    const isRaceSeed = randomizerArgs.get("isRaceSeed");
+    const seed = randomizerArgs.get("seed");
+    const outputFormat = randomizerArgs.get("outputFormat");
+    const generated = engineGenerate(
+      engineState.engineData,
+      engineState.basePatch,
+      isRaceSeed,
+      seed,
+      randomizerArgs.get("initialLives"),
+      randomizerArgs.get("zantetsuken"),
+      randomizerArgs.get("marahnaPath"),
+      randomizerArgs.get("bossRushType"),
+      outputFormat,
+    );
+    timings.push({ stage: "engineGenerate", depth: 0, duration: performance.now() - startTime });
+
+    // Construct the output filename, as web_worker.js does.
+    let basename = `actraiser_${isRaceSeed ? "RACE" : seed}`;
+    if (generated.flagString) {
+      basename += `_${generated.flagString}`;
+    }
+    if (isRaceSeed) {
+      basename += `_${generated.hashString}`;
+    }
+
+    generatedSeed.set("outputBytes", generated.outputBytes);
+    generatedSeed.set("outputFileName", `${basename}.${outputFormat}`);
+    generatedSeed.set("hashString", generated.hashString);
+    generatedSeed.set("timings", timings);
+  } catch (e) {
+    generatedSeed.set("error", `Generation failed: ${e.message}`);
+  }
+  // Let the page update (e.g. the progress bar) between seeds.
+  await new Promise((resolve) => setTimeout(resolve, 0));
+  return generatedSeed;
+}
+
+
+
+// Web workers that run the randomizer, if the engine can't be used. Each
+// one loads its own copy of Pyodide, so the first is started when the page
+// loads, and more are only started when generating many seeds at once.
+// Each worker reads the ROM from IndexedDB (by its SHA-256) and keeps it,
+// so the ROM is never sent to the workers, and they all share one copy.
+const workerPool = [];
+
+// Generating many seeds uses one worker per CPU, up to this limit.
+// (Each worker needs its own Pyodide, which takes a lot of memory.)
+const MAX_WORKER_POOL_SIZE = 8;
+
+function startWorkers(poolSize) {
+  while (workerPool.length < poolSize) {
+    workerPool.push(new Worker("web_worker.js"));
+  }
+}
+
+// Send one request to a worker, and wait for its reply.
+// A worker only handles one request at a time.
+function runWorker(worker, randomizerArgs) {
+  return new Promise((resolve) => {
+    worker.addEventListener("message", (event) => resolve(event.data), { once: true });
+    worker.postMessage(randomizerArgs);
+  });
+}
+
+// Send a generated ROM's buffer back to the worker that made it, once the
+// page is done with it, so the worker can reuse it for a later seed (see
+// web_worker.js). Patches aren't sent back.
+function recycleWorkerOutput(worker, generatedSeed) {
+  if (!generatedSeed.has("patchRuns")) {
+    return;
+  }
+  const outputBytes = generatedSeed.get("outputBytes");
+  const recycledArgs = new Map();
+  recycledArgs.set("recycledBytes", outputBytes);
+  recycledArgs.set("romSHA256", generatedSeed.get("romSHA256"));
+  recycledArgs.set("patchRuns", generatedSeed.get("patchRuns"));
+  worker.postMessage(recycledArgs, [outputBytes.buffer]);
+}
+
+
+
+function downloadBlob(blob, fileName) {
+  const blobURL = window.URL.createObjectURL(blob);
+  const downloadAnchor = document.createElement("a");
+  downloadAnchor.setAttribute("href", blobURL);
+  downloadAnchor.setAttribute("download", fileName);
+  document.body.appendChild(downloadAnchor);
+  downloadAnchor.click();
+  document.body.removeChild(downloadAnchor);
+  window.URL.revokeObjectURL(blobURL);
+}
+
+
+
+function updateProgress(doneCount = null, totalCount = null) {
+  if (doneCount === null) {
+    document.getElementById("progress").classList.add("d-none");
+    return;
+  }
+  document.getElementById("progressBar").style.width = `${100 * doneCount / totalCount}%`;
+  document.getElementById("progress").classList.remove("d-none");
+}
+
+
+
+function enterGeneratingMode() {
+  updateTimings();
+  updateProgress();
+  document.getElementById("generate").disabled = true;
+  document.getElementById("generateSpinner").classList.remove("d-none");
+  document.getElementById("generateText").innerText = "Generating...";
+  updateStatusMessage("Generation in progress, this may take some time...")
+}
+
+function exitGeneratingMode() {
+  document.getElementById("generateText").innerText = "Generate";
+  document.getElementById("generateSpinner").classList.add("d-none");
+  document.getElementById("generate").disabled = false;
+}
+
+
+
+async function generate(event) {
   // Verify that the stored ROM is OK
   updateStatusMessage();
-  const romBase64 = storageWrapper.getItem("rom_base64");
-  if (romBase64 === null) {
+  const romSHA256 = storageWrapper.getItem("rom_sha256");
+  if (romSHA256 === null) {
     updateStatusMessage("No ROM selected", "danger");
     return;
   }
-  const romBytes = base64ToBytes(romBase64);
-  if (!isValidROM(romBytes)) {
+  if (storageWrapper.getItem("rom_valid") !== "true") {
     updateStatusMessage("Invalid ROM selected", "danger");
     return;
   }
@@ -217,6 +388,14 @@ function generate(event) {
     seed %= 2**32
   }
 
+  // Verify that the number of seeds is OK
+  const seedCountString = document.getElementById("seedCount").value.trim();
+  const seedCount = parseInt(seedCountString, 10);
+  if (!/^[0-9]+$/.test(seedCountString) || seedCount < 1 || seedCount > 1000) {
+    updateStatusMessage("Number of seeds must be from 1 to 1000", "danger");
+    return;
+  }
+
   // Get the selected randomizer options
   let initialLives = null;
   const initialLivesString = document.getElementById("initialLives").value;
@@ -235,58 +414,147 @@ function generate(event) {
   if (["consecutive", "scattered"].includes(bossRushTypeString)) {
     bossRushType = bossRushTypeString;
   }
+  let outputFormat = "sfc";
+  const outputFormatString = document.getElementById("outputFormat").value;
+  if (["ips", "bps"].includes(outputFormatString)) {
+    outputFormat = outputFormatString;
+  }
 
-  // Enter "Generating..." mode
-  document.getElementById("generate").disabled = true;
-  document.getElementById("generateSpinner").classList.remove("d-none");
-  document.getElementById("generateText").innerText = "Generating...";
-  updateStatusMessage("Generation in progress, this may take some time...")
-
-  // Send a message to the web worker to run the randomizer
+  // The worker reads the ROM from IndexedDB, so only its SHA-256 is sent.
   const randomizerArgs = new Map();
-  randomizerArgs.set("romBytes", romBytes);
+  randomizerArgs.set("romSHA256", romSHA256);
   randomizerArgs.set("isRaceSeed", isRaceSeed);
   randomizerArgs.set("seed", seed);
   randomizerArgs.set("initialLives", initialLives);
   randomizerArgs.set("zantetsuken", zantetsuken);
   randomizerArgs.set("marahnaPath", marahnaPath);
   randomizerArgs.set("bossRushType", bossRushType);
-  worker.postMessage(randomizerArgs, [romBytes.buffer]);
+  randomizerArgs.set("outputFormat", outputFormat);
+
+  enterGeneratingMode();
+  if (seedCount === 1) {
+    await generateOne(randomizerArgs);
+  } else {
+    await generateMany(randomizerArgs, seedCount);
+  }
+  exitGeneratingMode();
 }
 document.getElementById("generate").addEventListener("click", generate);
 
 
 
-function downloadSeed(event) {
-  // Retrieve the generated seed
-  const generatedSeed = event.data;
-  const romByteArray = generatedSeed.get("romByteArray");
-  const romFileName = generatedSeed.get("romFileName");
+async function generateOne(randomizerArgs) {
+  let generatedSeed = null;
+  if (engineState.engineData !== null) {
+    generatedSeed = await runEngine(randomizerArgs);
+  } else {
+    generatedSeed = await runWorker(workerPool[0], randomizerArgs);
+  }
+  if (generatedSeed.has("error")) {
+    updateStatusMessage(generatedSeed.get("error"), "danger");
+    return;
+  }
+  const outputBytes = generatedSeed.get("outputBytes");
+  const outputFileName = generatedSeed.get("outputFileName");
+  const mimeType = outputFileName.endsWith(".sfc") ? "application/vnd.nintendo.snes.rom" : "application/octet-stream";
+
+  // Prompt the user to download the generated seed.
+  // The Blob has its own copy of the data, so the buffer can be recycled.
+  downloadBlob(new Blob([outputBytes], { type: mimeType }), outputFileName);
+  if (engineState.engineData === null) {
+    recycleWorkerOutput(workerPool[0], generatedSeed);
+  }
+  updateStatusMessage(`Generated '${outputFileName}'`, "success");
+  updateTimings(generatedSeed.get("timings"));
+}
 
-  // Prompt the user to download the generated seed
-  const romBlob = new Blob([romByteArray], { type: "application/vnd.nintendo.snes.rom" });
-  const romURL = window.URL.createObjectURL(romBlob);
-  const downloadAnchor = document.createElement("a");
-  downloadAnchor.setAttribute("href", romURL);
-  downloadAnchor.setAttribute("download", romFileName);
-  document.body.appendChild(downloadAnchor);
-  downloadAnchor.click();
-  document.body.removeChild(downloadAnchor);
-  window.URL.revokeObjectURL(romURL);
 
-  // Exit "Generating..." mode
-  updateStatusMessage(`Generated '${romFileName}'`, "success");
-  document.getElementById("generateText").innerText = "Generate";
-  document.getElementById("generateSpinner").classList.add("d-none");
-  document.getElementById("generate").disabled = false;
+
+// Generate seedCount seeds with the same options, using the engine or a
+// pool of workers, and download them as a ZIP file. For race seeds, each one
+// is a new race seed. Otherwise, the seeds count up from the given seed.
+async function generateMany(randomizerArgs, seedCount) {
+  let generators = null;
+  if (engineState.engineData !== null) {
+    generators = [{ generateSeed: runEngine, worker: null }];
+  } else {
+    const poolSize = Math.min(seedCount, navigator.hardwareConcurrency || 1, MAX_WORKER_POOL_SIZE);
+    startWorkers(poolSize);
+    generators = workerPool.slice(0, poolSize).map((worker) => ({
+      generateSeed: (seedArgs) => runWorker(worker, seedArgs),
+      worker: worker,
+    }));
+  }
+
+  const isRaceSeed = randomizerArgs.get("isRaceSeed");
+  const firstSeed = randomizerArgs.get("seed");
+  const generatedSeeds = new Array(seedCount);
+  let nextIndex = 0;
+  let doneCount = 0;
+  let errorMessage = null;
+  updateProgress(0, seedCount);
+  updateStatusMessage(`Generated 0 of ${seedCount} seeds...`);
+
+  // Each worker takes the next seed as soon as it's done with the last one.
+  async function runUntilDone({ generateSeed, worker }) {
+    while (nextIndex < seedCount && errorMessage === null) {
+      const seedIndex = nextIndex++;
+      const seedArgs = new Map(randomizerArgs);
+      if (!isRaceSeed) {
+        seedArgs.set("seed", (firstSeed + seedIndex) % 2**32);
+      }
+      const generatedSeed = await generateSeed(seedArgs);
+      if (generatedSeed.has("error")) {
+        errorMessage = generatedSeed.get("error");
+        return;
+      }
+
+      // Keep the output in a Blob (with its CRC-32, for the ZIP file), so
+      // that a worker's buffer can be recycled straight away.
+      const outputBytes = generatedSeed.get("outputBytes");
+      generatedSeed.set("outputBlob", new Blob([outputBytes]));
+      generatedSeed.set("outputCRC", crc32(outputBytes));
+      if (worker !== null) {
+        recycleWorkerOutput(worker, generatedSeed);
+      }
+      generatedSeed.delete("outputBytes");
+      generatedSeeds[seedIndex] = generatedSeed;
+      doneCount++;
+      updateProgress(doneCount, seedCount);
+      updateStatusMessage(`Generated ${doneCount} of ${seedCount} seeds...`);
+    }
+  }
+  await Promise.all(generators.map(runUntilDone));
+  updateProgress();
+  if (errorMessage !== null) {
+    updateStatusMessage(errorMessage, "danger");
+    return;
+  }
+
+  // Put the seeds in a ZIP file, with a list of their hashes.
+  // (Race seeds could, rarely, have the same file name.)
+  const files = [];
+  const usedFileNames = new Set();
+  const seedListLines = [];
+  for (const generatedSeed of generatedSeeds) {
+    let fileName = generatedSeed.get("outputFileName");
+    for (let n = 2; usedFileNames.has(fileName); n++) {
+      fileName = generatedSeed.get("outputFileName").replace(/(\.[^.]*)$/, `_${n}$1`);
+    }
+    usedFileNames.add(fileName);
+    files.push({ fileName: fileName, fileBlob: generatedSeed.get("outputBlob"), crc: generatedSeed.get("outputCRC") });
+    seedListLines.push(`${fileName}\tHash: ${generatedSeed.get("hashString")}\n`);
+  }
+  files.push({ fileName: "seeds.txt", fileBytes: new TextEncoder().encode(seedListLines.join("")) });
+
+  const zipFileName = `actraiser_${seedCount}_seeds.zip`;
+  downloadBlob(makeZip(files), zipFileName);
+  updateStatusMessage(`Generated '${zipFileName}'`, "success");
 }
 
 
 
 async function main() {
-  worker = new Worker("web_worker.js");
-  worker.addEventListener("message", downloadSeed);
-
   const fileName = "actraiser_randomizer.py"
   const response = await fetch(fileName);
   if (!response.ok) {
@@ -297,6 +565,25 @@ async function main() {
   const versionMatch = versionRegex.exec(fileString);
   if (versionMatch !== null) {
     document.getElementById("version").innerText = versionMatch[1];
+    await loadEngine(versionMatch[1]);
+  }
+  if (engineState.engineData === null) {
+    startWorkers(1);
+  }
+
+  // Cache everything for quick startup and offline use: see service_worker.js.
+  // (Service workers need HTTPS or localhost, so this doesn't always work.)
+  if ("serviceWorker" in navigator && versionMatch !== null) {
+    navigator.serviceWorker.register(`service_worker.js?version=${encodeURIComponent(versionMatch[1])}`).catch((e) => {
+      console.warn("Could not register the service worker:", e);
+    });
+  }
+
+  // Move a ROM stored by an older version of the page to IndexedDB.
+  const legacyRomBase64 = storageWrapper.getItem("rom_base64");
+  if (legacyRomBase64 !== null) {
+    await storeROM(base64ToBytes(legacyRomBase64).buffer);
+    storageWrapper.removeItem("rom_base64");
   }
 
   updateFileButton();
@@ -0,0 +1,64 @@
+"use strict";
+
+// IndexedDB storage, shared by the web interface and the web worker.
+// Everything is kept in one object store, by key:
+// - "rom": The selected ROM, as { sha256, romBuffer }.
+//   The ROM's SHA-256 and validity are also kept in localStorage, so the
+//   page can check them without reading the ROM.
+// - "module/...": The compiled randomizer module and the extended map
+//   metadata, as { pycBuffer, metadataBuffer }. See web_worker.js.
+// Values are stored as ArrayBuffers, not strings, so nothing needs to be
+// encoded or decoded.
+const fileStorage = {
+  databaseName: "actraiser_randomizer",
+  databaseVersion: 1,
+  storeName: "files",
+  databasePromise: null,
+
+  getDatabase() {
+    if (this.databasePromise === null) {
+      this.databasePromise = new Promise((resolve, reject) => {
+        const request = indexedDB.open(this.databaseName, this.databaseVersion);
+        request.addEventListener("upgradeneeded", () => {
+          request.result.createObjectStore(this.storeName);
+        });
+        request.addEventListener("success", () => resolve(request.result));
+        request.addEventListener("error", () => reject(request.error));
+      });
+    }
+    return this.databasePromise;
+  },
+
+  // Run one request against the object store, and wait for its transaction
+  // to finish. (For writes, that's when the data is safely stored.)
+  async runRequest(mode, makeRequest) {
+    const database = await this.getDatabase();
+    return new Promise((resolve, reject) => {
+      const transaction = database.transaction(this.storeName, mode);
+      const request = makeRequest(transaction.objectStore(this.storeName));
+      transaction.addEventListener("complete", () => resolve(request.result));
+      transaction.addEventListener("error", () => reject(transaction.error));
+      transaction.addEventListener("abort", () => reject(transaction.error));
+    });
+  },
+
+  getItem(keyName) {
+    return this.runRequest("readonly", (store) => store.get(keyName));
+  },
+  setItem(keyName, keyValue) {
+    return this.runRequest("readwrite", (store) => store.put(keyValue, keyName));
+  },
+  removeItem(keyName) {
+    return this.runRequest("readwrite", (store) => store.delete(keyName));
+  },
+  getKeys() {
+    return this.runRequest("readonly", (store) => store.getAllKeys());
+  },
+};
+
+
+
+async function sha256Hex(buffer) {
+  const digest = await crypto.subtle.digest("SHA-256", buffer);
+  return Array.from(new Uint8Array(digest), (x) => x.toString(16).padStart(2, "0")).join("");
+}
@@ -1,73 +1,237 @@
 "use strict";
 
 self.importScripts("https://cdn.jsdelivr.net/pyodide/v0.27.3/full/pyodide.js");
+self.importScripts("web_storage.js");
 
+async function fetchBytes(fileName) {
+  const response = await fetch(fileName);
+  if (!response.ok) {
+    throw new Error(`Could not fetch '${fileName}'. HTTP response status code: ${response.status}`);
+  }
+  const fileBuffer = await response.arrayBuffer();
+  return new Uint8Array(fileBuffer);
+}
+
+// Get the randomizer ready as soon as the worker starts, while the user is
+// still choosing a ROM and options: load Pyodide, import the randomizer and
+// load the extended map metadata.
+// The first time, the module is compiled, and the compiled module (.pyc) and
+// the metadata are stored in IndexedDB. After that, they're taken from there,
+// so the module doesn't need to be compiled again. The stored copy is keyed
+// by the randomizer version, the source's SHA-256 and the Pyodide version,
+// so a change to any of them means compiling again.
 async function loadPyodideAndFiles() {
   self.pyodide = await loadPyodide();
 
-  async function fetchFile(fileName) {
-    const response = await fetch(fileName);
-    if (!response.ok) {
-      throw new Error(`Could not fetch '${fileName}'. HTTP response status code: ${response.status}`);
-    }
-    const fileBuffer = await response.arrayBuffer();
-    const fileBytes = new Uint8Array(fileBuffer);
-    self.pyodide.FS.writeFile(fileName, fileBytes);
+  const sourceBytes = await fetchBytes("actraiser_randomizer.py");
+  self.pyodide.FS.writeFile("actraiser_randomizer.py", sourceBytes);
+
+  const sourceString = new TextDecoder().decode(sourceBytes);
+  const versionRegex = /^randomizerVersion = \"(.*)\"$/m;
+  const versionMatch = versionRegex.exec(sourceString);
+  const randomizerVersion = (versionMatch !== null) ? versionMatch[1] : "unknown";
+  const sourceSHA256 = await sha256Hex(sourceBytes);
+  const moduleKey = `module/${randomizerVersion}/${sourceSHA256}/${self.pyodide.version}`;
+
+  // The compiled module is used without checking the source's timestamp
+  // (see below), so it has to go where Python looks for it.
+  const pycFileName = self.pyodide.runPython(`
+import importlib.util
+importlib.util.cache_from_source("actraiser_randomizer.py")
+`);
+
+  // IndexedDB may be unavailable (e.g. in some private browsing modes).
+  // That only means the module is compiled every time.
+  let storedModule = null;
+  try {
+    storedModule = await fileStorage.getItem(moduleKey);
+  } catch (e) {
+    console.warn("Could not read the compiled module from IndexedDB:", e);
   }
 
-  await fetchFile("actraiser_randomizer.py");
+  let metadataBytes = null;
+  if (storedModule) {
+    self.pyodide.FS.mkdirTree(pycFileName.substring(0, pycFileName.lastIndexOf("/")));
+    self.pyodide.FS.writeFile(pycFileName, new Uint8Array(storedModule.pycBuffer));
+    metadataBytes = new Uint8Array(storedModule.metadataBuffer);
+  } else {
+    metadataBytes = await fetchBytes("extended_map_metadata.bin");
+  }
+  self.pyodide.FS.writeFile("extended_map_metadata.bin", metadataBytes);
+
+  self.pyodide.runPython(`
+import actraiser_randomizer
+`);
+
+  if (!storedModule) {
+    // Compile the module to a .pyc that's used without checking the
+    // source's timestamp, since the source file is written anew each time.
+    self.pyodide.runPython(`
+import py_compile
+py_compile.compile(
+    "actraiser_randomizer.py",
+    cfile = ${JSON.stringify(pycFileName)},
+    invalidation_mode = py_compile.PycInvalidationMode.UNCHECKED_HASH,
+    doraise = True,
+)
+`);
+    const pycBytes = self.pyodide.FS.readFile(pycFileName);
+    try {
+      // Replace any compiled module from an older version.
+      for (const keyName of await fileStorage.getKeys()) {
+        if (keyName.startsWith("module/")) {
+          await fileStorage.removeItem(keyName);
+        }
+      }
+      await fileStorage.setItem(moduleKey, {
+        pycBuffer: pycBytes.buffer,
+        metadataBuffer: metadataBytes.buffer,
+      });
+    } catch (e) {
+      console.warn("Could not store the compiled module in IndexedDB:", e);
+    }
+  }
 }
 const pyodideReadyPromise = loadPyodideAndFiles();
 
 
 
+// The ROM is read from IndexedDB the first time it's used, and kept for
+// later seeds. The page sends its SHA-256, so a different ROM is noticed.
+// The ROM is copied into Python once, where it's kept as a BasePatch, so
+// each seed only needs the seed-dependent work.
+// The ROM never comes back out of Python. Instead, each seed is generated
+// as a RomOverlay, and only its patches (a few kilobytes) are copied out,
+// straight from Python's memory. They're applied to a copy of the ROM that's
+// made here, which is then transferred (not copied) to the page.
+// Once the page is done with a copy, it sends it back. Only the patched
+// ranges are restored, and the copy is kept in spareOutputs for a later
+// seed, so the whole ROM only needs to be copied for the first seed.
+const romCache = {
+  sha256: null,
+  romBytes: null,
+  spareOutputs: [],
+};
+
+async function loadROM(romSHA256) {
+  if (romCache.sha256 !== romSHA256) {
+    const storedROM = await fileStorage.getItem("rom");
+    if (!storedROM || storedROM.sha256 !== romSHA256) {
+      throw new Error("The selected ROM could not be found. Please select it again.");
+    }
+    romCache.sha256 = null;
+    romCache.romBytes = new Uint8Array(storedROM.romBuffer);
+    romCache.spareOutputs = [];
+    pyodide.globals.set("workerRomBytes", romCache.romBytes);
+    pyodide.runPython(`
+import actraiser_randomizer
+workerBasePatch = actraiser_randomizer.BasePatch(workerRomBytes.to_bytes())
+del workerRomBytes
+`);
+    romCache.sha256 = storedROM.sha256;
+  }
+}
+
+// Take back a copy of the ROM from the page. It's only kept if it's a copy
+// of the current ROM.
+function recycleOutput(recycledArgs) {
+  if (recycledArgs.get("romSHA256") !== romCache.sha256) {
+    return;
+  }
+  const recycledBytes = recycledArgs.get("recycledBytes");
+  for (const [offset, length] of recycledArgs.get("patchRuns")) {
+    recycledBytes.set(romCache.romBytes.subarray(offset, offset + length), offset);
+  }
+  romCache.spareOutputs.push(recycledBytes);
+}
+
+
+
 async function runRandomizer(event) {
   await pyodideReadyPromise;
 
   const randomizerArgs = event.data;
-  const romBytes = randomizerArgs.get("romBytes");
+  const romSHA256 = randomizerArgs.get("romSHA256");
   const isRaceSeed = randomizerArgs.get("isRaceSeed");
   const seed = randomizerArgs.get("seed");
   const initialLives = randomizerArgs.get("initialLives");
   const zantetsuken = randomizerArgs.get("zantetsuken");
   const marahnaPath = randomizerArgs.get("marahnaPath");
   const bossRushType = randomizerArgs.get("bossRushType");
+  const outputFormat = randomizerArgs.get("outputFormat");
+
+  // Stage timings, shown on the page after the seed is generated.
+  // Durations are in milliseconds. Stages with a greater depth are part
+  // of the closest preceding stage with a lesser depth.
+  const timings = [];
+  let startTime = performance.now();
+
+  await loadROM(romSHA256);
+  timings.push({ stage: "loadROM", depth: 0, duration: performance.now() - startTime });
 
-  pyodide.globals.set("romBytes", pyodide.toPy(romBytes));
+  startTime = performance.now();
   pyodide.globals.set("isRaceSeed", pyodide.toPy(isRaceSeed));
   pyodide.globals.set("seed", pyodide.toPy(seed));
   pyodide.globals.set("initialLives", pyodide.toPy(initialLives));
   pyodide.globals.set("zantetsuken", pyodide.toPy(zantetsuken));
   pyodide.globals.set("marahnaPath", pyodide.toPy(marahnaPath));
   pyodide.globals.set("bossRushType", pyodide.toPy(bossRushType));
+  pyodide.globals.set("outputFormat", pyodide.toPy(outputFormat));
+  timings.push({ stage: "setGlobals", depth: 0, duration: performance.now() - startTime });
 
   const pythonCode = `
+import time
 import actraiser_randomizer
 
-flagString = actraiser_randomizer.getFlagString(
-    initialLives,
-    zantetsuken,
-    marahnaPath,
-    bossRushType,
-)
+# Record the stage timings. The hook is module state, so make sure it's
+# removed even if generating fails, or the next seed's timings would be
+# added to these.
+timingSpans = actraiser_randomizer.TimingSpans()
+actraiser_randomizer.timingHook = timingSpans
+try:
+    flagString = actraiser_randomizer.getFlagString(
+        initialLives,
+        zantetsuken,
+        marahnaPath,
+        bossRushType,
+    )
 
-# Generate the seed.
-(
-    romByteArray,
-    mapNumbers,
-    chosenMarahnaPath,
-    chosenBossRushType,
-) = actraiser_randomizer.generate(
-    romBytes,
-    isRaceSeed,
-    seed,
-    initialLives,
-    zantetsuken,
-    marahnaPath,
-    bossRushType,
-)
+    # Generate the seed: a ROM (as a RomOverlay), or an IPS or BPS patch.
+    (
+        output,
+        mapNumbers,
+        chosenMarahnaPath,
+        chosenBossRushType,
+    ) = actraiser_randomizer.generate(
+        workerBasePatch,
+        isRaceSeed,
+        seed,
+        initialLives,
+        zantetsuken,
+        marahnaPath,
+        bossRushType,
+        outputFormat,
+        overlay = True,
+    )
 
-hashString = actraiser_randomizer.getHashString(mapNumbers)
+    # For a ROM, put the patches' data in a single buffer, for the worker to read.
+    if outputFormat == actraiser_randomizer.OUTPUT_FORMAT___SFC:
+        patchRuns = [[offset, len(data)] for offset, data in output.patchList]
+        patchData = b"".join([data for offset, data in output.patchList])
+    else:
+        patchRuns = None
+        patchData = output
+
+    startTime = time.perf_counter_ns()
+    hashString = actraiser_randomizer.getHashString(mapNumbers)
+    actraiser_randomizer.endStage("hashString", startTime)
+finally:
+    actraiser_randomizer.timingHook = None
+
+timings = [
+    {"stage": x["stage"], "depth": x["depth"], "duration": x["duration"] / 1e6}
+    for x in timingSpans.getBreakdown()
+]
 
 # Construct the output filename.
 basename = "actraiser"
@@ -77,15 +241,70 @@ if flagString:
 if isRaceSeed:
     basename += f"_{hashString}"
 
-romFileName = f"{basename}.sfc"
+outputFileName = f"{basename}.{outputFormat}"
 `
+  startTime = performance.now();
   pyodide.runPython(pythonCode);
+  timings.push({ stage: "runPython", depth: 0, duration: performance.now() - startTime });
+  const timingsProxy = pyodide.globals.get("timings");
+  const pythonTimings = timingsProxy.toJs({ dict_converter: Object.fromEntries });
+  timingsProxy.destroy();
+  for (const timing of pythonTimings) {
+    timings.push({ ...timing, depth: timing.depth + 1 });
+  }
+
+  // For a ROM, apply the patches to a copy of the ROM (a spare one, if
+  // there is one). For a patch, just copy it. Either way, the data is read
+  // through a view of Python's memory, without copying it first.
+  startTime = performance.now();
+  let outputBytes = null;
+  let patchRuns = null;
+  const patchRunsProxy = pyodide.globals.get("patchRuns");
+  const patchDataProxy = pyodide.globals.get("patchData");
+  const patchDataBuffer = patchDataProxy.getBuffer("u8");
+  if (patchRunsProxy !== undefined) {
+    patchRuns = patchRunsProxy.toJs();
+    patchRunsProxy.destroy();
+    outputBytes = romCache.spareOutputs.pop() ?? romCache.romBytes.slice();
+    let patchDataPosition = 0;
+    for (const [offset, length] of patchRuns) {
+      outputBytes.set(patchDataBuffer.data.subarray(patchDataPosition, patchDataPosition + length), offset);
+      patchDataPosition += length;
+    }
+  } else {
+    outputBytes = patchDataBuffer.data.slice();
+  }
+  patchDataBuffer.release();
+  patchDataProxy.destroy();
+  const outputFileName = pyodide.globals.get("outputFileName");
+  const hashString = pyodide.globals.get("hashString");
+  timings.push({ stage: "copyOutput", depth: 0, duration: performance.now() - startTime });
 
-  const romByteArray = pyodide.globals.get("romByteArray").toJs();
-  const romFileName = pyodide.globals.get("romFileName");
   const generatedSeed = new Map();
-  generatedSeed.set("romByteArray", romByteArray);
-  generatedSeed.set("romFileName", romFileName);
-  self.postMessage(generatedSeed, [romByteArray.buffer]);
+  generatedSeed.set("outputBytes", outputBytes);
+  generatedSeed.set("outputFileName", outputFileName);
+  generatedSeed.set("hashString", hashString);
+  generatedSeed.set("timings", timings);
+  if (patchRuns !== null) {
+    // What the page needs to send back, to recycle the copy of the ROM.
+    generatedSeed.set("romSHA256", romCache.sha256);
+    generatedSeed.set("patchRuns", patchRuns);
+  }
+  self.postMessage(generatedSeed, [outputBytes.buffer]);
 }
-self.addEventListener("message", runRandomizer);
+
+// Report any error to the page, so it doesn't wait for a seed forever.
+// Recycled copies of the ROM don't get a reply.
+self.addEventListener("message", async function (event) {
+  if (event.data.has("recycledBytes")) {
+    recycleOutput(event.data);
+    return;
+  }
+  try {
+    await runRandomizer(event);
+  } catch (e) {
+    const generatedSeed = new Map();
+    generatedSeed.set("error", `Generation failed: ${e.message}`);
+    self.postMessage(generatedSeed);
+  }
+});
@@ -0,0 +1,79 @@
+"use strict";
+
+// A minimal ZIP file writer, for downloading many generated seeds at once.
+// Files are stored without compression: ROMs barely compress, and patches
+// are already small. Each file is { fileName, fileBytes (a Uint8Array) },
+// or { fileName, fileBlob, crc } for data that's already in a Blob.
+// Returns a Blob. The files' data isn't copied; the Blob refers to it.
+// (No ZIP64 support, so there's a limit of 65535 files and 4 GiB in total.)
+// crc32() comes from web_engine.js.
+
+function makeZip(files, date = new Date()) {
+  const dosTime = (date.getHours() << 11) | (date.getMinutes() << 5) | (date.getSeconds() >> 1);
+  const dosDate = ((date.getFullYear() - 1980) << 9) | ((date.getMonth() + 1) << 5) | date.getDate();
+  const textEncoder = new TextEncoder();
+
+  const blobParts = [];
+  const centralDirectoryParts = [];
+  let offset = 0;
+  for (const { fileName, fileBytes, fileBlob, crc: fileCRC } of files) {
+    const nameBytes = textEncoder.encode(fileName);
+    const fileData = fileBlob ?? fileBytes;
+    const fileSize = (fileBlob !== undefined) ? fileBlob.size : fileBytes.length;
+    const crc = (fileBlob !== undefined) ? fileCRC : crc32(fileBytes);
+
+    // Local file header, then the file's data.
+    // Flag 0x0800: The file name is UTF-8.
+    const localHeader = new DataView(new ArrayBuffer(30));
+    localHeader.setUint32(0, 0x04034B50, true);
+    localHeader.setUint16(4, 20, true);
+    localHeader.setUint16(6, 0x0800, true);
+    localHeader.setUint16(8, 0, true);
+    localHeader.setUint16(10, dosTime, true);
+    localHeader.setUint16(12, dosDate, true);
+    localHeader.setUint32(14, crc, true);
+    localHeader.setUint32(18, fileSize, true);
+    localHeader.setUint32(22, fileSize, true);
+    localHeader.setUint16(26, nameBytes.length, true);
+    localHeader.setUint16(28, 0, true);
+    blobParts.push(localHeader, nameBytes, fileData);
+
+    // Central directory entry
+    const centralHeader = new DataView(new ArrayBuffer(46));
+    centralHeader.setUint32(0, 0x02014B50, true);
+    centralHeader.setUint16(4, 20, true);
+    centralHeader.setUint16(6, 20, true);
+    centralHeader.setUint16(8, 0x0800, true);
+    centralHeader.setUint16(10, 0, true);
+    centralHeader.setUint16(12, dosTime, true);
+    centralHeader.setUint16(14, dosDate, true);
+    centralHeader.setUint32(16, crc, true);
+    centralHeader.setUint32(20, fileSize, true);
+    centralHeader.setUint32(24, fileSize, true);
+    centralHeader.setUint16(28, nameBytes.length, true);
+    centralHeader.setUint16(30, 0, true);
+    centralHeader.setUint16(32, 0, true);
+    centralHeader.setUint16(34, 0, true);
+    centralHeader.setUint16(36, 0, true);
+    centralHeader.setUint32(38, 0, true);
+    centralHeader.setUint32(42, offset, true);
+    centralDirectoryParts.push(centralHeader, nameBytes);
+
+    offset += 30 + nameBytes.length + fileSize;
+  }
+
+  const centralDirectorySize = centralDirectoryParts.reduce((total, part) => total + part.byteLength, 0);
+
+  // End of central directory record
+  const endRecord = new DataView(new ArrayBuffer(22));
+  endRecord.setUint32(0, 0x06054B50, true);
+  endRecord.setUint16(4, 0, true);
+  endRecord.setUint16(6, 0, true);
+  endRecord.setUint16(8, files.length, true);
+  endRecord.setUint16(10, files.length, true);
+  endRecord.setUint32(12, centralDirectorySize, true);
+  endRecord.setUint32(16, offset, true);
+  endRecord.setUint16(20, 0, true);
+
+  return new Blob([...blobParts, ...centralDirectoryParts, endRecord], { type: "application/zip" });
+}